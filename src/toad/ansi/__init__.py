@@ -1 +1,6 @@
+from toad.ansi._ansi import DamageSpan as DamageSpan
+from toad.ansi._ansi import merge_damage as merge_damage
 from toad.ansi._ansi import TerminalState as TerminalState
+from toad.ansi._metrics import MAX_SEQUENCE_LENGTH as MAX_SEQUENCE_LENGTH
+from toad.ansi._sgr import SGRParser as SGRParser
+from toad.ansi._worker import TerminalWorker as TerminalWorker
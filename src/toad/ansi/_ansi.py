@@ -1,25 +1,39 @@
 from __future__ import annotations
 
 import io
+from array import array
+from bisect import bisect_right
 from itertools import accumulate
-import re2 as re
+from operator import attrgetter
 
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
 from functools import lru_cache
-from typing import Any, Awaitable, Callable, Iterable, Literal, Mapping, NamedTuple
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Iterable,
+    Iterator,
+    Literal,
+    Mapping,
+    MutableSequence,
+    NamedTuple,
+    Sequence,
+    overload,
+)
 
 import rich.repr
 
-from textual import events
-from textual.color import Color
-from textual.content import Content, EMPTY_CONTENT
+from textual import events, log
+from textual.cache import LRUCache
+from textual.content import Content, EMPTY_CONTENT, Span
 from textual.geometry import clamp
 from textual.style import Style, NULL_STYLE
 
-from toad.ansi._ansi_colors import ANSI_COLORS
 from toad.ansi._keys import TERMINAL_KEY_MAP, CURSOR_KEYS_APPLICATION
+from toad.ansi._metrics import ANSIMetrics, MAX_SEQUENCE_LENGTH
 from toad.ansi._control_codes import CONTROL_CODES
-from toad.ansi._sgr_styles import SGR_STYLES
+from toad.ansi._sgr import SGR_PARSER, SGRParser
 from toad.ansi._stream_parser import (
     StreamParser,
     SeparatorToken,
@@ -27,8 +41,11 @@ from toad.ansi._stream_parser import (
     Pattern,
     PatternCheck,
     ParseResult,
+    ReadUntil,
     Token,
 )
+from toad.ansi._byte_tokenizer import ANSIByteTokenizer
+from toad.ansi._tokenizer import ANSITokenizer
 
 from toad.dec import CHARSET_MAP
 
@@ -76,10 +93,41 @@ class FEPattern(Pattern):
     OSC_TERMINATORS = frozenset({"\x07", "\x9c"})
     DSC_TERMINATORS = frozenset({"\x9c"})
 
+    __slots__ = ["metrics", "max_length"]
+
+    def __init__(
+        self, metrics: ANSIMetrics, max_length: int = MAX_SEQUENCE_LENGTH
+    ) -> None:
+        """
+        Args:
+            metrics: Metrics to record discarded sequences.
+            max_length: Maximum length of a sequence. Longer sequences are discarded.
+        """
+        self.metrics = metrics
+        self.max_length = max_length
+        super().__init__()
+
+    def discard(self, last_character: str, terminators: frozenset[str]) -> PatternCheck:
+        """Consume the remainder of an oversize OSC or DCS, without storing it.
+
+        Args:
+            last_character: The last character in the sequence so far.
+            terminators: Characters which terminate the sequence.
+        """
+        metrics = self.metrics
+        metrics.record_oversize(self.max_length + 2)
+        while (character := (yield)) not in terminators:
+            metrics.discarded_characters += 1
+            if last_character == "\x1b" and character == "\\":
+                break
+            last_character = character
+        return ("oversize", "")
+
     def check(self) -> PatternCheck:
         sequence = io.StringIO()
         store = sequence.write
         store(character := (yield))
+        max_length = self.max_length
 
         match character:
             # CSI
@@ -87,7 +135,13 @@ class FEPattern(Pattern):
                 CSI_TERMINATORS = self.CSI_TERMINATORS
                 while (character := (yield)) not in CSI_TERMINATORS:
                     store(character)
+                    if sequence.tell() > max_length:
+                        self.metrics.record_oversize(max_length + 2)
+                        return ("oversize", "")
                 store(character)
+                if sequence.tell() > max_length:
+                    self.metrics.record_oversize(max_length + 2)
+                    return ("oversize", "")
                 return ("csi", sequence.getvalue())
 
             # OSC
@@ -96,24 +150,34 @@ class FEPattern(Pattern):
                 OSC_TERMINATORS = self.OSC_TERMINATORS
                 while (character := (yield)) not in OSC_TERMINATORS:
                     store(character)
-                    if last_character == "\x1b" and character in {"\\", "\0x5c"}:
+                    if last_character == "\x1b" and character == "\\":
                         break
+                    if sequence.tell() > max_length:
+                        return (yield from self.discard(character, OSC_TERMINATORS))
                     last_character = character
-                store(character)
-
+                else:
+                    store(character)
+                if sequence.tell() > max_length:
+                    self.metrics.record_oversize(sequence.tell() + 1)
+                    return ("oversize", "")
                 return ("osc", sequence.getvalue())
 
             # DCS
             case "P":
-                print("TODO DCS")
                 last_character = ""
                 DSC_TERMINATORS = self.DSC_TERMINATORS
                 while (character := (yield)) not in DSC_TERMINATORS:
                     store(character)
                     if last_character == "\x1b" and character == "\\":
                         break
+                    if sequence.tell() > max_length:
+                        return (yield from self.discard(character, DSC_TERMINATORS))
                     last_character = character
-                store(character)
+                else:
+                    store(character)
+                if sequence.tell() > max_length:
+                    self.metrics.record_oversize(sequence.tell() + 1)
+                    return ("oversize", "")
                 return ("dcs", sequence.getvalue())
 
             # Character set designation
@@ -142,18 +206,39 @@ class FEPattern(Pattern):
 class ANSIParser(StreamParser[tuple[str, str]]):
     """Parse a stream of text containing escape sequences in to logical tokens."""
 
+    def __init__(self, max_sequence_length: int = MAX_SEQUENCE_LENGTH) -> None:
+        """
+        Args:
+            max_sequence_length: Maximum length of an escape sequence. Longer
+                sequences are discarded.
+        """
+        self.max_sequence_length = max_sequence_length
+        """Maximum length of an escape sequence."""
+        self.metrics = ANSIMetrics()
+        """Counters for notable events."""
+        super().__init__()
+
+    @property
+    def is_idle(self) -> bool:
+        """Is the parser between escape sequences?"""
+        return isinstance(self._reading, ReadUntil)
+
     def parse(self) -> ParseResult[tuple[str, str]]:
         NEW_LINE = "\n"
         CARRIAGE_RETURN = "\r"
         ESCAPE = "\x1b"
         BACKSPACE = "\x08"
+        metrics = self.metrics
+        max_length = self.max_sequence_length
 
         while True:
             token = yield self.read_until(NEW_LINE, CARRIAGE_RETURN, ESCAPE, BACKSPACE)
             if isinstance(token, SeparatorToken):
                 if token.text == ESCAPE:
-                    token = yield self.read_patterns("\x1b", fe=FEPattern())
-                    if isinstance(token, PatternToken):
+                    token = yield self.read_patterns(
+                        "\x1b", max_length, fe=FEPattern(metrics, max_length)
+                    )
+                    if isinstance(token, PatternToken) and token.value[0] != "oversize":
                         yield token.value
                 else:
                     yield "separator", token.text
@@ -164,6 +249,13 @@ class ANSIParser(StreamParser[tuple[str, str]]):
 
 EMPTY_LINE = Content()
 
+REFLOW_BATCH = 1000
+"""Number of lines to refold in each step of a reflow (lines at the end of a buffer
+are refolded first, the remainder in steps)."""
+
+PACKED_CACHE_SIZE = 256
+"""Number of line records to keep, when lines are packed."""
+
 
 type ClearType = Literal["cursor_to_end", "cursor_to_beginning", "screen", "scrollback"]
 ANSI_CLEAR: Mapping[int, ClearType] = {
@@ -365,68 +457,312 @@ type ANSICommand = (
     | ANSICursorPositionRequest
 )
 
+type CSIParameters = list[int | None]
+"""Numeric CSI parameters, with `None` for a missing parameter."""
+
+
+def _get_parameter(parameters: CSIParameters, index: int = 0, default: int = 1) -> int:
+    """Get a CSI parameter.
+
+    Args:
+        parameters: Parsed parameters.
+        index: Index of parameter.
+        default: Value to use if the parameter is missing.
+
+    Returns:
+        The parameter value.
+    """
+    if index < len(parameters) and (parameter := parameters[index]) is not None:
+        return parameter
+    return default
+
+
+def _csi_cursor_up(parameters: CSIParameters) -> ANSICommand | None:
+    # CUU - Cursor Up: ESC[nA
+    return ANSICursor(delta_y=-_get_parameter(parameters))
+
+
+def _csi_cursor_down(parameters: CSIParameters) -> ANSICommand | None:
+    # CUD - Cursor Down: ESC[nB
+    return ANSICursor(delta_y=+_get_parameter(parameters))
+
+
+def _csi_cursor_forward(parameters: CSIParameters) -> ANSICommand | None:
+    # CUF - Cursor Forward: ESC[nC
+    return ANSICursor(delta_x=+_get_parameter(parameters))
+
+
+def _csi_cursor_back(parameters: CSIParameters) -> ANSICommand | None:
+    # CUB - Cursor Back: ESC[nD
+    return ANSICursor(delta_x=-_get_parameter(parameters))
+
+
+def _csi_cursor_next_line(parameters: CSIParameters) -> ANSICommand | None:
+    # CNL - Cursor Next Line: ESC[nE
+    return ANSICursor(absolute_x=0, delta_y=+_get_parameter(parameters))
+
+
+def _csi_cursor_previous_line(parameters: CSIParameters) -> ANSICommand | None:
+    # CPL - Cursor Previous Line: ESC[nF
+    return ANSICursor(absolute_x=0, delta_y=-_get_parameter(parameters))
+
+
+def _csi_cursor_horizontal_absolute(parameters: CSIParameters) -> ANSICommand | None:
+    # CHA - Cursor Horizontal Absolute: ESC[nG
+    return ANSICursor(absolute_x=_get_parameter(parameters) - 1)
+
+
+def _csi_cursor_position(parameters: CSIParameters) -> ANSICommand | None:
+    # CUP - Cursor Position: ESC[n;mH
+    # HVP - Horizontal Vertical Position: ESC[n;mf
+    return ANSICursor(
+        absolute_x=_get_parameter(parameters, 1) - 1,
+        absolute_y=_get_parameter(parameters) - 1,
+    )
+
+
+def _csi_delete_characters(parameters: CSIParameters) -> ANSICommand | None:
+    # DCH - Delete Character: ESC[nP
+    return ANSICursor(
+        clear_range=(0, _get_parameter(parameters) - 1),
+        relative=True,
+        erase=True,
+    )
+
+
+def _csi_scroll_up(parameters: CSIParameters) -> ANSICommand | None:
+    # SU - Scroll Up: ESC[nS
+    return ANSIScroll(-1, _get_parameter(parameters))
+
+
+def _csi_scroll_down(parameters: CSIParameters) -> ANSICommand | None:
+    # SD - Scroll Down: ESC[nT
+    return ANSIScroll(+1, _get_parameter(parameters))
+
+
+def _csi_vertical_position_absolute(parameters: CSIParameters) -> ANSICommand | None:
+    # VPA - Vertical Position Absolute: ESC[nd
+    return ANSICursor(absolute_y=_get_parameter(parameters) - 1)
+
+
+def _csi_erase_characters(parameters: CSIParameters) -> ANSICommand | None:
+    # ECH - Erase Character: ESC[nX
+    return ANSICursor(
+        clear_range=(0, _get_parameter(parameters) - 1),
+        relative=True,
+        erase=False,
+    )
+
+
+def _csi_erase_display(parameters: CSIParameters) -> ANSICommand | None:
+    # ED - Erase in Display: ESC[nJ
+    match _get_parameter(parameters, default=0):
+        case 0:
+            return ANSIStream.CLEAR_SCREEN_CURSOR_TO_END
+        case 1:
+            return ANSIStream.CLEAR_SCREEN_CURSOR_TO_BEGINNING
+        case 2:
+            return ANSIStream.CLEAR_SCREEN
+        case 3:
+            return ANSIStream.CLEAR_SCREEN_SCROLLBACK
+    return None
+
+
+def _csi_erase_line(parameters: CSIParameters) -> ANSICommand | None:
+    # EL - Erase in Line: ESC[nK
+    match _get_parameter(parameters, default=0):
+        case 0:
+            return ANSIStream.CLEAR_LINE_CURSOR_TO_END
+        case 1:
+            return ANSIStream.CLEAR_LINE_CURSOR_TO_BEGINNING
+        case 2:
+            return ANSIStream.CLEAR_LINE
+    return None
+
+
+def _csi_scroll_margin(parameters: CSIParameters) -> ANSICommand | None:
+    # DECSTBM - Set Top and Bottom Margins: ESC[t;br
+    top = _get_parameter(parameters, 0, 0)
+    bottom = _get_parameter(parameters, 1, 0)
+    return ANSIScrollMargin(top - 1 if top else None, bottom - 1 if bottom else None)
+
+
+def _csi_set_mode(parameters: CSIParameters) -> ANSICommand | None:
+    # SM - Set Mode: ESC[nh
+    if 4 in parameters:
+        return ANSIStream.ENABLE_REPLACE_MODE
+    return None
+
+
+def _csi_reset_mode(parameters: CSIParameters) -> ANSICommand | None:
+    # RM - Reset Mode: ESC[nl
+    if 4 in parameters:
+        return ANSIStream.DISABLE_REPLACE_MODE
+    return None
+
+
+def _csi_device_status_report(parameters: CSIParameters) -> ANSICommand | None:
+    # DSR - Device Status Report: ESC[6n
+    if _get_parameter(parameters, default=0) == 6:
+        return ANSICursorPositionRequest()
+    return None
+
+
+def _csi_window_manipulation(parameters: CSIParameters) -> ANSICommand | None:
+    # XTWINOPS - Window manipulation: ESC[n;n;nt
+    print("TODO", "XTWINOPS", parameters)
+    return None
+
+
+CSI_HANDLERS: Mapping[str, Callable[[CSIParameters], ANSICommand | None]] = {
+    "A": _csi_cursor_up,
+    "B": _csi_cursor_down,
+    "C": _csi_cursor_forward,
+    "D": _csi_cursor_back,
+    "E": _csi_cursor_next_line,
+    "F": _csi_cursor_previous_line,
+    "G": _csi_cursor_horizontal_absolute,
+    "H": _csi_cursor_position,
+    "f": _csi_cursor_position,
+    "P": _csi_delete_characters,
+    "S": _csi_scroll_up,
+    "T": _csi_scroll_down,
+    "d": _csi_vertical_position_absolute,
+    "X": _csi_erase_characters,
+    "J": _csi_erase_display,
+    "K": _csi_erase_line,
+    "r": _csi_scroll_margin,
+    "h": _csi_set_mode,
+    "l": _csi_reset_mode,
+    "n": _csi_device_status_report,
+    "t": _csi_window_manipulation,
+}
+"""Handlers for CSI sequences with numeric parameters, keyed on the final character."""
+
+PRIVATE_MODE_FEATURES: Mapping[int, str] = {
+    1: "cursor_keys",
+    7: "auto_wrap",
+    12: "cursor_blink",
+    25: "show_cursor",
+    1049: "alternate_screen",
+    2004: "bracketed_paste",
+}
+"""Maps private modes on to `ANSIFeatures` fields."""
+
 
 class ANSIStream:
-    def __init__(self) -> None:
-        self.parser = ANSIParser()
+    def __init__(
+        self,
+        parser: ANSIParser | ANSITokenizer | None = None,
+        sgr_parser: SGRParser = SGR_PARSER,
+    ) -> None:
+        """
+        Args:
+            parser: Engine to split text in to tokens, or `None` for the default
+                (regex based) tokenizer.
+            sgr_parser: Converts SGR sequences in to styles.
+        """
+        self.parser = ANSITokenizer() if parser is None else parser
+        self.byte_tokenizer = ANSIByteTokenizer(
+            self.parser.max_sequence_length, self.parser.metrics
+        )
+        """Splits UTF-8 encoded bytes in to tokens."""
+        self.sgr_parser = sgr_parser
         self.style = NULL_STYLE
         self.show_cursor = True
 
-    @classmethod
-    @lru_cache(maxsize=1024)
-    def _parse_sgr(cls, sgr: str) -> Style | None:
-        """Parse a SGR (Select Graphics Rendition) code in to a Style instance,
-        or `None` to indicate a reset.
-
-        Args:
-            sgr: SGR sequence.
+    @property
+    def metrics(self) -> ANSIMetrics:
+        """Counters for notable events in the stream."""
+        return self.parser.metrics
 
-        Returns:
-            A Visual Style, or `None`.
-        """
-        codes = [
-            code if code < 255 else 255
-            for code in map(int, [sgr_code or "0" for sgr_code in sgr.split(";")])
-        ]
-        style = NULL_STYLE
-        while codes:
-            match codes:
-                case [38, 2, red, green, blue, *codes]:
-                    # Foreground RGB
-                    style += Style(foreground=Color(red, green, blue))
-                case [48, 2, red, green, blue, *codes]:
-                    # Background RGB
-                    style += Style(background=Color(red, green, blue))
-                case [38, 5, ansi_color, *codes]:
-                    # Foreground ANSI
-                    style += Style(foreground=ANSI_COLORS[ansi_color])
-                case [48, 5, ansi_color, *codes]:
-                    # Background ANSI
-                    style += Style(background=ANSI_COLORS[ansi_color])
-                case [0, *codes]:
-                    # reset
-                    return None
-                case [code, *codes]:
-                    if sgr_style := SGR_STYLES.get(code):
-                        style += sgr_style
-
-        return style
-
-    def feed(self, text: str) -> Iterable[ANSICommand]:
+    def feed(self, text: str | bytes) -> Iterable[ANSICommand]:
         """Feed text potentially containing ANSI sequences, and parse in to
         an iterable of ansi commands.
 
+        Text may be given as UTF-8 encoded bytes, which are decoded as required.
+        A stream shouldn't switch between text and bytes part way through an
+        escape sequence.
+
         Args:
-            text: Text to feed.
+            text: Text (or UTF-8 encoded bytes) to feed.
 
         Yields:
             `ANSICommand` instances.
         """
+        if self.is_plain(text):
+            yield from self._feed_plain(self.decode(text))
+            return
 
-        for token in self.parser.feed(text):
+        tokens = (
+            self.parser.feed(text)
+            if isinstance(text, str)
+            else self.byte_tokenizer.feed(text)
+        )
+        for token in tokens:
             if not isinstance(token, Token):
                 yield from self.on_token(token)
 
+    def decode(self, text: str | bytes) -> str:
+        """Decode plain text (see `is_plain`), which may be UTF-8 encoded bytes.
+
+        Args:
+            text: Text or bytes.
+
+        Returns:
+            Decoded text.
+        """
+        return text if isinstance(text, str) else self.byte_tokenizer.decode(text)
+
+    def is_plain(self, text: str | bytes) -> bool:
+        """Check if text may skip the parser.
+
+        Plain text has no escape sequences, no backspaces, and no carriage returns
+        other than those preceding a new line. It is only plain if the parser
+        isn't part way through an escape sequence.
+
+        Args:
+            text: Text or UTF-8 encoded bytes to check.
+
+        Returns:
+            `True` if the text is plain.
+        """
+        if not (self.parser.is_idle and self.byte_tokenizer.is_idle):
+            return False
+        if isinstance(text, str):
+            return (
+                "\x1b" not in text
+                and "\x08" not in text
+                and text.count("\r") == text.count("\r\n")
+            )
+        return (
+            b"\x1b" not in text
+            and b"\x08" not in text
+            and text.count(b"\r") == text.count(b"\r\n")
+        )
+
+    def _feed_plain(self, text: str) -> Iterable[ANSICommand]:
+        """Produce the same commands as `feed`, for plain text.
+
+        Args:
+            text: Plain text (see `is_plain`).
+
+        Yields:
+            `ANSICommand` instances.
+        """
+        carriage_return = self.ANSI_SEPARATORS["\r"]
+        *lines, last_line = text.split("\n")
+        for line in lines:
+            if line.endswith("\r"):
+                if line := line[:-1]:
+                    yield ANSIContent(line)
+                yield carriage_return
+            elif line:
+                yield ANSIContent(line)
+            yield ANSINewLine()
+        if last_line:
+            yield ANSIContent(last_line)
+
     ANSI_SEPARATORS = {
         "\n": ANSICursor(delta_y=+1, absolute_x=0),
         "\r": ANSICursor(absolute_x=0),
@@ -476,168 +812,134 @@ class ANSIStream:
         "O": SHIFT_G3,
     }
 
+    CSI_COMMANDS: Mapping[str, tuple[ANSICommand, ...]] = {
+        "[A": (ANSICursor(delta_y=-1),),
+        "[B": (ANSICursor(delta_y=+1),),
+        "[C": (ANSICursor(delta_x=+1),),
+        "[D": (ANSICursor(delta_x=-1),),
+        "[H": (ANSICursor(absolute_x=0, absolute_y=0),),
+        "[J": (CLEAR_SCREEN_CURSOR_TO_END,),
+        "[0J": (CLEAR_SCREEN_CURSOR_TO_END,),
+        "[1J": (CLEAR_SCREEN_CURSOR_TO_BEGINNING,),
+        "[2J": (CLEAR_SCREEN,),
+        "[3J": (CLEAR_SCREEN_SCROLLBACK,),
+        "[K": (CLEAR_LINE_CURSOR_TO_END,),
+        "[0K": (CLEAR_LINE_CURSOR_TO_END,),
+        "[1K": (CLEAR_LINE_CURSOR_TO_BEGINNING,),
+        "[2K": (CLEAR_LINE,),
+        "[4h": (ENABLE_REPLACE_MODE,),
+        "[4l": (DISABLE_REPLACE_MODE,),
+        "[?25h": (SHOW_CURSOR,),
+        "[?25l": (HIDE_CURSOR,),
+        "[?1049h": (ENABLE_ALTERNATE_SCREEN,),
+        "[?1049l": (DISABLE_ALTERNATE_SCREEN,),
+        "[?2004h": (ENABLE_BRACKETED_PASTE,),
+        "[?2004l": (DISABLE_BRACKETED_PASTE,),
+        "[?12h": (ENABLE_CURSOR_BLINK,),
+        "[?12l": (DISABLE_CURSOR_BLINK,),
+        "[?1h": (ENABLE_CURSOR_KEYS_APPLICATION_MODE,),
+        "[?1l": (DISABLE_CURSOR_KEYS_APPLICATION_MODE,),
+        "[?7h": (ENABLE_AUTO_WRAP,),
+        "[?7l": (DISABLE_AUTO_WRAP,),
+    }
+    """Preallocated commands for common CSI sequences without variable parameters."""
+
     @classmethod
-    @lru_cache(maxsize=1024)
-    def _parse_csi(cls, csi: str) -> ANSICommand | None:
-        """Parse CSI sequence in to an ansi segment.
+    def _parse_csi(cls, csi: str) -> tuple[ANSICommand, ...]:
+        """Parse CSI sequence in to ansi commands.
 
         Args:
             csi: CSI sequence.
 
         Returns:
-            Ansi segment, or `None` if one couldn't be decoded.
+            A tuple of commands (empty if the sequence couldn't be decoded).
         """
-
-        if match := re.fullmatch(r"\[(\d+)?(?:;)?(\d*)?(\w)", csi):
-            match_groups = match.groups(default="")
-            match match_groups:
-                case [lines, _, "A"]:
-                    # CUU - Cursor Up: ESC[nA
-                    return ANSICursor(delta_y=-int(lines or 1))
-                case [lines, _, "B"]:
-                    # CUD - Cursor Down: ESC[nB
-                    return ANSICursor(delta_y=+int(lines or 1))
-                case [cells, _, "C"]:
-                    # CUF - Cursor Forward: ESC[nC
-                    return ANSICursor(delta_x=+int(cells or 1))
-                case [cells, _, "D"]:
-                    # CUB - Cursor Back: ESC[nD
-                    return ANSICursor(delta_x=-int(cells or 1))
-                case [lines, _, "E"]:
-                    # CNL - Cursor Next Line: ESC[nE
-                    return ANSICursor(absolute_x=0, delta_y=+int(lines or 1))
-                case [lines, _, "F"]:
-                    # CPL - Cursor Previous Line: ESC[nF
-                    return ANSICursor(absolute_x=0, delta_y=-int(lines or 1))
-                case [cells, _, "G"]:
-                    # CHA - Cursor Horizontal Absolute: ESC[nG
-                    return ANSICursor(absolute_x=+int(cells or 1) - 1)
-                case [row, column, "H" | "f"]:
-                    # CUP - Cursor Position: ESC[n;mH
-                    # HVP - Horizontal Vertical Position: ESC[n;mf
-                    return ANSICursor(
-                        absolute_x=int(column or 1) - 1,
-                        absolute_y=int(row or 1) - 1,
-                    )
-                case [characters, _, "P"]:
-                    return ANSICursor(
-                        clear_range=(0, int(characters or 1) - 1),
-                        relative=True,
-                        erase=True,
-                    )
-                case [lines, _, "S"]:
-                    return ANSIScroll(-1, int(lines))
-                case [lines, _, "T"]:
-                    return ANSIScroll(+1, int(lines))
-                case [row, _, "d"]:
-                    # VPA - Vertical Position Absolute: ESC[nd
-                    return ANSICursor(absolute_y=int(row or 1) - 1)
-                case [characters, _, "X"]:
-                    return ANSICursor(
-                        clear_range=(0, int(characters or 1) - 1),
-                        relative=True,
-                        erase=False,
-                    )
-                case ["0" | "", _, "J"]:
-                    return cls.CLEAR_SCREEN_CURSOR_TO_END
-                case ["1", _, "J"]:
-                    return cls.CLEAR_SCREEN_CURSOR_TO_BEGINNING
-                case ["2", _, "J"]:
-                    return cls.CLEAR_SCREEN
-                case ["3", _, "J"]:
-                    return cls.CLEAR_SCREEN_SCROLLBACK
-                case ["0" | "", _, "K"]:
-                    return cls.CLEAR_LINE_CURSOR_TO_END
-                case ["1", _, "K"]:
-                    return cls.CLEAR_LINE_CURSOR_TO_BEGINNING
-                case ["2", _, "K"]:
-                    return cls.CLEAR_LINE
-                case [top, bottom, "r"]:
-                    return ANSIScrollMargin(
-                        int(top or "1") - 1 if top else None,
-                        int(bottom or "1") - 1 if top else None,
-                    )
-                case ["4", _, "h" | "l" as replace_mode]:
-                    return (
-                        cls.ENABLE_REPLACE_MODE
-                        if replace_mode == "h"
-                        else cls.DISABLE_REPLACE_MODE
+        if (commands := cls.CSI_COMMANDS.get(csi)) is not None:
+            return commands
+        parameters = csi[1:-1]
+        final = csi[-1]
+        if not parameters.lstrip("0123456789;"):
+            # Numeric parameters
+            if (handler := CSI_HANDLERS.get(final)) is not None:
+                if (
+                    command := handler(
+                        [
+                            int(parameter) if parameter else None
+                            for parameter in parameters.split(";")
+                        ]
+                        if parameters
+                        else []
                     )
+                ) is not None:
+                    return (command,)
+                if final == "t":
+                    return ()
+        elif (
+            final in "hl"
+            and parameters.startswith("?")
+            and not parameters[1:].lstrip("0123456789;")
+        ):
+            return cls._parse_private_modes(parameters[1:], final == "h")
 
-                case ["6", _, "n"]:
-                    return ANSICursorPositionRequest()
-
-                case _:
-                    print("Unknown CSI (a)", repr(csi))
-                    return None
-
-        elif match := re.fullmatch(r"\[([0-9:;<=>?]*)([!-/]*)([@-~])", csi):
-            match match.groups(default=""):
-                case ["?25", "", "h"]:
-                    return cls.SHOW_CURSOR
-                case ["?25", "", "l"]:
-                    return cls.HIDE_CURSOR
-                case ["?1049", "", "h"]:
-                    return cls.ENABLE_ALTERNATE_SCREEN
-                case ["?1049", "", "l"]:
-                    return cls.DISABLE_ALTERNATE_SCREEN
-                case ["?2004", "", "h"]:
-                    return cls.ENABLE_BRACKETED_PASTE
-                case ["?2004", "", "l"]:
-                    return cls.DISABLE_BRACKETED_PASTE
-                case ["?12", "", "h"]:
-                    return cls.ENABLE_CURSOR_BLINK
-                case ["?12", "", "l"]:
-                    return cls.DISABLE_CURSOR_BLINK
-                case ["?1", "", "h"]:
-                    return cls.ENABLE_CURSOR_KEYS_APPLICATION_MODE
-                case ["?1", "", "l"]:
-                    return cls.DISABLE_CURSOR_KEYS_APPLICATION_MODE
-                case ["?7", "", "h"]:
-                    return cls.ENABLE_AUTO_WRAP
-                case ["?7", "", "l"]:
-                    return cls.DISABLE_AUTO_WRAP
-
-                # \x1b[22;0;0t
-                case [param1, param2, "t"]:
-                    print("TODO", "XTWINOPS", param1, param2)
-                    # 't' = XTWINOPS (Window manipulation)
-                    return None
-                case _:
-                    if match := re.fullmatch(r"\[\?([0-9;]+)([hl])", csi):
-                        modes = [m for m in match.group(1).split(";")]
-                        enable = match.group(2) == "h"
-                        tracking: Literal["none"] | MOUSE_TRACKING_MODES | None = None
-                        format: MOUSE_FORMAT | None = None
-                        focus_events: bool | None = None
-                        alternate_scroll: bool | None = None
-                        for mode in modes:
-                            if mode == "1000":
-                                tracking = "button" if enable else "none"
-                            elif mode == "1002":
-                                tracking = "drag" if enable else "none"
-                            elif mode == "1003":
-                                tracking = "all" if enable else "none"
-                            elif mode == "1006":
-                                format = "sgr"
-                            elif mode == "1015":
-                                format = "urxvt"
-                            elif mode == "1004":
-                                focus_events = enable
-                            elif mode == "1007":
-                                alternate_scroll = enable
-                        return ANSIMouseTracking(
-                            mode=tracking,
-                            format=format,
-                            focus_events=focus_events,
-                            alternate_scroll=alternate_scroll,
-                        )
-                    else:
-                        print("Unknown CSI (b)", repr(csi))
-                        return None
+        print("Unknown CSI", repr(csi))
+        return ()
 
-        print("Unknown CSI (c)", repr(csi))
-        return None
+    @classmethod
+    def _parse_private_modes(cls, modes: str, enable: bool) -> tuple[ANSICommand, ...]:
+        """Parse DEC private modes (`ESC[?n;nh` or `ESC[?n;nl`).
+
+        Args:
+            modes: Modes separated by semicolons.
+            enable: Enable (`True`) or disable (`False`) the modes?
+
+        Returns:
+            A tuple of commands.
+        """
+        features: dict[str, bool] = {}
+        tracking: Literal["none"] | MOUSE_TRACKING_MODES | None = None
+        format: MOUSE_FORMAT | None = None
+        focus_events: bool | None = None
+        alternate_scroll: bool | None = None
+        mouse = False
+        for mode in modes.split(";"):
+            if not mode:
+                continue
+            mode_number = int(mode)
+            if (feature := PRIVATE_MODE_FEATURES.get(mode_number)) is not None:
+                features[feature] = enable
+                continue
+            mouse = True
+            if mode_number == 1000:
+                tracking = "button" if enable else "none"
+            elif mode_number == 1002:
+                tracking = "drag" if enable else "none"
+            elif mode_number == 1003:
+                tracking = "all" if enable else "none"
+            elif mode_number == 1006:
+                format = "sgr"
+            elif mode_number == 1015:
+                format = "urxvt"
+            elif mode_number == 1004:
+                focus_events = enable
+            elif mode_number == 1007:
+                alternate_scroll = enable
+            else:
+                mouse = False
+                log.warning("Unknown private mode", mode)
+
+        commands: list[ANSICommand] = []
+        if features:
+            commands.append(ANSIFeatures(**features))
+        if mouse:
+            commands.append(
+                ANSIMouseTracking(
+                    mode=tracking,
+                    format=format,
+                    focus_events=focus_events,
+                    alternate_scroll=alternate_scroll,
+                )
+            )
+        return tuple(commands)
 
     def on_token(self, token: tuple[str, str]) -> Iterable[ANSICommand]:
         match token:
@@ -648,33 +950,19 @@ class ANSIStream:
                     yield self.ANSI_SEPARATORS[separator]
 
             case ["osc", osc]:
-                match osc[1:].split(";"):
+                match osc[1:].removesuffix("\x1b\\").rstrip("\x07\x9c").split(";"):
                     case ["8", *_, link]:
-                        self.style += Style(link=link or None)
+                        self.style = replace(self.style, link=link or None)
                     case ["2025", current_directory, *_]:
                         self.current_directory = current_directory
                         yield ANSIWorkingDirectory(current_directory)
 
             case ["csi", csi]:
                 if csi.endswith("m"):
-                    if (sgr_style := self._parse_sgr(csi[1:-1])) is None:
-                        self.style = NULL_STYLE
-                    else:
-                        self.style += sgr_style
-                        # Special case to use widget background rather
-                        # than theme background
-                        if (
-                            sgr_style.background is not None
-                            and sgr_style.background.ansi == -1
-                        ):
-                            self.style = (
-                                Style(foreground=self.style.foreground)
-                                + sgr_style.without_color
-                            )
+                    self.style = self.sgr_parser.apply(self.style, csi[1:-1])
                     yield ANSIStyle(self.style)
                 else:
-                    if (ansi_segment := self._parse_csi(csi)) is not None:
-                        yield ansi_segment
+                    yield from self._parse_csi(csi)
 
             case ["dec", dec]:
                 slot, character_set = list(dec)
@@ -711,7 +999,7 @@ class LineFold(NamedTuple):
     """The index of the folded line."""
 
     offset: int
-    """The offset within the original line."""
+    """The offset within the original line (the length of the previous folds)."""
 
     content: Content
     """The content."""
@@ -720,6 +1008,68 @@ class LineFold(NamedTuple):
     """Integer that increments on update."""
 
 
+FOLD_OFFSET = attrgetter("offset")
+"""Key to bisect a line's folds by offset."""
+
+
+class DamageSpan(NamedTuple):
+    """A contiguous range of updated (folded) lines."""
+
+    start: int
+    """First updated line."""
+
+    end: int
+    """Line following the last updated line."""
+
+
+def coalesce_lines(line_numbers: set[int]) -> list[DamageSpan]:
+    """Coalesce line numbers in to contiguous spans.
+
+    Args:
+        line_numbers: Set of line numbers.
+
+    Returns:
+        Spans in ascending order, with no adjacent spans.
+    """
+    spans: list[DamageSpan] = []
+    start = end = -1
+    for line_no in sorted(line_numbers):
+        if line_no != end:
+            if start != end:
+                spans.append(DamageSpan(start, end))
+            start = line_no
+        end = line_no + 1
+    if start != end:
+        spans.append(DamageSpan(start, end))
+    return spans
+
+
+def merge_damage(
+    damage: list[DamageSpan] | None, other_damage: list[DamageSpan] | None
+) -> list[DamageSpan] | None:
+    """Merge the damage from two writes.
+
+    Args:
+        damage: Spans from `coalesce_lines`, or `None` for a full refresh.
+        other_damage: Spans to merge, or `None` for a full refresh.
+
+    Returns:
+        Merged spans in ascending order, or `None` for a full refresh.
+    """
+    if damage is None or other_damage is None:
+        return None
+    if not damage:
+        return other_damage
+    merged: list[DamageSpan] = []
+    for span in sorted(damage + other_damage):
+        if merged and span.start <= (last_span := merged[-1]).end:
+            if span.end > last_span.end:
+                merged[-1] = DamageSpan(last_span.start, span.end)
+        else:
+            merged.append(span)
+    return merged
+
+
 @dataclass
 class LineRecord:
     """A single line in the terminal."""
@@ -736,6 +1086,424 @@ class LineRecord:
     updates: int = 0
     """An integer used for caching."""
 
+    @property
+    def is_blank(self) -> bool:
+        """Is the line blank (whitespace with no style)?"""
+        content = self.content
+        return not content.spans and (not (plain := content.plain) or plain.isspace())
+
+
+class FoldedLines:
+    """The folded lines of a buffer, as a sequence of `LineFold` objects.
+
+    The folds are stored in the line records. This class maintains a Fenwick tree of
+    the number of folds in each line, so a folded line can be located (and the index
+    of a line's first fold found) in O(log n), without building a list of every fold.
+    Updating a line is O(1) if its number of folds is unchanged, otherwise O(log n).
+
+    When lines are removed from the start, the line numbers in the remaining folds
+    are out of date. Rather than renumber every fold, a line's folds are renumbered
+    when they are next accessed.
+
+    """
+
+    __slots__ = ["_lines", "_counts", "_tree", "_total", "_cache"]
+
+    def __init__(self, lines: Sequence[LineRecord]) -> None:
+        """
+        Args:
+            lines: Line records (shared with the buffer).
+        """
+        self._lines = lines
+        self._counts: array[int] = array("I")
+        """Number of folds in each line."""
+        self._tree: array[int] = array("I", [0])
+        """Fenwick tree of fold counts (1-based)."""
+        self._total = 0
+        """Total number of folds."""
+        self._cache: tuple[int, int] = (0, 0)
+        """The most recently located line, and the index of its first fold."""
+
+    def __len__(self) -> int:
+        return self._total
+
+    def __iter__(self) -> Iterator[LineFold]:
+        for line_no, line in enumerate(self._lines[: len(self._counts)]):
+            if line.folds and line.folds[0].line_no != line_no:
+                self._renumber(line_no)
+            yield from line.folds
+
+    def __getitem__(self, index: int) -> LineFold:
+        line_no, start = self._cache
+        if start <= index and line_no < len(counts := self._counts):
+            if index < start + counts[line_no]:
+                fold = self._lines[line_no].folds[index - start]
+                if fold.line_no != line_no:
+                    fold = self._renumber(line_no)[index - start]
+                return fold
+        total = self._total
+        if index < 0:
+            index += total
+        if index < 0 or index >= total:
+            raise IndexError("folded line index out of range")
+        line_no, fold_offset = self.locate(index)
+        fold = self._lines[line_no].folds[fold_offset]
+        if fold.line_no != line_no:
+            fold = self._renumber(line_no)[fold_offset]
+        return fold
+
+    def _renumber(self, line_no: int) -> list[LineFold]:
+        """Update the line number in a line's folds.
+
+        Args:
+            line_no: Line number.
+
+        Returns:
+            The line's folds.
+        """
+        folds = self._lines[line_no].folds
+        folds[:] = [fold._replace(line_no=line_no) for fold in folds]
+        return folds
+
+    def locate(self, index: int) -> tuple[int, int]:
+        """Locate a folded line.
+
+        Args:
+            index: Index of folded line (must be within range).
+
+        Returns:
+            A tuple of the line number, and the index of the fold within the line.
+        """
+        counts = self._counts
+        line_no, start = self._cache
+        if line_no < len(counts):
+            if start <= index < start + counts[line_no]:
+                return line_no, index - start
+            # Sequential access (rendering) will often be in the following line
+            start += counts[line_no]
+            line_no += 1
+            if line_no < len(counts) and start <= index < start + counts[line_no]:
+                self._cache = (line_no, start)
+                return line_no, index - start
+
+        tree = self._tree
+        size = len(tree) - 1
+        line_no = 0
+        remaining = index
+        step = 1 << size.bit_length()
+        while step:
+            node = line_no + step
+            if node <= size and tree[node] <= remaining:
+                line_no = node
+                remaining -= tree[node]
+            step >>= 1
+        self._cache = (line_no, index - remaining)
+        return line_no, remaining
+
+    def line_start(self, line_no: int) -> int:
+        """Get the index of the first fold in a line.
+
+        Args:
+            line_no: Line number (may be the number of lines, for the end).
+
+        Returns:
+            Index of folded line.
+        """
+        cache_line_no, cache_start = self._cache
+        if line_no == cache_line_no and line_no < len(self._counts):
+            return cache_start
+        tree = self._tree
+        start = 0
+        node = line_no
+        while node:
+            start += tree[node]
+            node &= node - 1
+        return start
+
+    def append_line(self, fold_count: int) -> None:
+        """Add a line to the end.
+
+        Args:
+            fold_count: Number of folds in the new line.
+        """
+        counts = self._counts
+        tree = self._tree
+        counts.append(fold_count)
+        node = len(counts)
+        # The new node covers the lines following its parent's range
+        value = fold_count
+        child = node - 1
+        stop = node - (node & -node)
+        while child > stop:
+            value += tree[child]
+            child -= child & -child
+        tree.append(value)
+        self._total += fold_count
+
+    def set_fold_count(self, line_no: int, fold_count: int) -> None:
+        """Update the number of folds in a line.
+
+        Args:
+            line_no: Line number.
+            fold_count: New number of folds.
+        """
+        counts = self._counts
+        delta = fold_count - counts[line_no]
+        if not delta:
+            return
+        counts[line_no] = fold_count
+        self._total += delta
+        tree = self._tree
+        size = len(tree)
+        node = line_no + 1
+        while node < size:
+            tree[node] += delta
+            node += node & -node
+        if self._cache[0] > line_no:
+            self._cache = (0, 0)
+
+    def truncate(self, line_count: int) -> None:
+        """Remove lines from the end.
+
+        Args:
+            line_count: Number of lines to keep.
+        """
+        if line_count >= len(self._counts):
+            return
+        del self._counts[line_count:]
+        # Nodes only cover preceding lines, so the remaining tree is intact
+        del self._tree[line_count + 1 :]
+        self._total = self.line_start(line_count)
+        if self._cache[0] >= line_count:
+            self._cache = (0, 0)
+
+    def remove_head(self, line_count: int) -> int:
+        """Remove lines from the start.
+
+        The caller should remove the line records.
+
+        Args:
+            line_count: Number of lines to remove.
+
+        Returns:
+            Number of folded lines removed.
+        """
+        removed = self.line_start(line_count)
+        del self._counts[:line_count]
+        self._build_tree()
+        self._total -= removed
+        self._cache = (0, 0)
+        return removed
+
+    def clear(self) -> None:
+        """Remove all lines."""
+        self._counts.clear()
+        del self._tree[1:]
+        self._total = 0
+        self._cache = (0, 0)
+
+    def rebuild(self, fold_counts: Iterable[int] | None = None) -> None:
+        """Rebuild from the folds in the line records.
+
+        Args:
+            fold_counts: Number of folds in each line, or `None` to count the folds
+                in the line records.
+        """
+        if fold_counts is None:
+            fold_counts = (len(line.folds) for line in self._lines)
+        self._counts = array("I", fold_counts)
+        self._build_tree()
+        self._total = sum(self._counts)
+        self._cache = (0, 0)
+
+    def _build_tree(self) -> None:
+        """Build the Fenwick tree from the fold counts, in O(n)."""
+        tree = self._tree = array("I", [0])
+        tree.extend(self._counts)
+        size = len(tree) - 1
+        for node in range(1, size + 1):
+            if (parent := node + (node & -node)) <= size:
+                tree[parent] += tree[node]
+
+
+class PackedLines(MutableSequence[LineRecord]):
+    """The lines of a buffer which won't be written to again, packed in to a string and
+    a few arrays.
+
+    A line record, with its content, spans, and folds, will typically require around a
+    kilobyte. Packed lines store the text of every line in a single string, and the
+    spans in run-length arrays, which requires little more than the text. Line records
+    are created on demand, and the most recently used are kept.
+
+    Packed lines are read only.
+
+    """
+
+    __slots__ = [
+        "_text",
+        "_offsets",
+        "_span_offsets",
+        "_span_starts",
+        "_span_ends",
+        "_span_styles",
+        "_line_styles",
+        "_cell_lengths",
+        "_styles",
+        "_line_style_table",
+        "_fold_line",
+        "_width",
+        "_updates",
+        "_cache",
+    ]
+
+    def __init__(
+        self,
+        lines: Iterable[LineRecord],
+        fold_line: Callable[[int, Content, int], list[LineFold]],
+        width: int,
+        updates: int,
+        cache_size: int = PACKED_CACHE_SIZE,
+    ) -> None:
+        """
+        Args:
+            lines: Line records to pack.
+            fold_line: Callable which folds a line (with tabs expanded), given the line
+                number, content, and width.
+            width: Width to fold to.
+            updates: Updates value for the line records.
+            cache_size: Number of line records to keep.
+        """
+        texts: list[str] = []
+        self._offsets = offsets = array("I", [0])
+        """Offset of each line in the text, and the end of the text."""
+        self._span_offsets = span_offsets = array("I", [0])
+        """Index of the first span in each line, and the end of the spans."""
+        self._span_starts = span_starts = array("I")
+        self._span_ends = span_ends = array("I")
+        self._span_styles = span_styles = array("I")
+        """Index of each span's style."""
+        self._line_styles = line_styles = array("I")
+        """Index of the style for the remainder of each line."""
+        self._cell_lengths = cell_lengths = array("I")
+        """Cell length of each line (with tabs expanded)."""
+        style_indices: dict[Style | str, int] = {}
+        line_style_indices: dict[Style, int] = {}
+
+        position = 0
+        for line in lines:
+            content = line.content
+            plain = content.plain
+            texts.append(plain)
+            position += len(plain) + 1
+            offsets.append(position)
+            for start, end, style in content.spans:
+                span_starts.append(start)
+                span_ends.append(end)
+                span_styles.append(style_indices.setdefault(style, len(style_indices)))
+            span_offsets.append(len(span_starts))
+            line_styles.append(
+                line_style_indices.setdefault(line.style, len(line_style_indices))
+            )
+            cell_lengths.append(
+                content.expand_tabs(8).cell_length
+                if "\t" in plain
+                else content.cell_length
+            )
+
+        self._text = "\n".join(texts)
+        """The text of every line, separated by newlines."""
+        self._styles: list[Style | str] = list(style_indices)
+        """Styles referenced by the spans."""
+        self._line_style_table: list[Style] = list(line_style_indices)
+        """Styles referenced by the lines."""
+        self._fold_line = fold_line
+        self._width = width
+        self._updates = updates
+        self._cache: LRUCache[int, LineRecord] = LRUCache(cache_size)
+        """Most recently used line records."""
+
+    def __len__(self) -> int:
+        return len(self._line_styles)
+
+    @overload
+    def __getitem__(self, index: int) -> LineRecord: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> list[LineRecord]: ...
+
+    def __getitem__(self, index: int | slice) -> LineRecord | list[LineRecord]:
+        if isinstance(index, slice):
+            return [self[line_no] for line_no in range(*index.indices(len(self)))]
+        if (line := self._cache.get(index)) is not None:
+            return line
+        line_count = len(self._line_styles)
+        if index < 0:
+            index += line_count
+        if index < 0 or index >= line_count:
+            raise IndexError("packed line index out of range")
+        if (line := self._cache.get(index)) is None:
+            line = self._cache[index] = self._unpack(index)
+        return line
+
+    def __setitem__(self, index, value) -> None:
+        raise TypeError("packed lines are read only")
+
+    def __delitem__(self, index) -> None:
+        raise TypeError("packed lines are read only")
+
+    def insert(self, index: int, value: LineRecord) -> None:
+        raise TypeError("packed lines are read only")
+
+    @property
+    def text(self) -> str:
+        """The text of every line, separated by newlines."""
+        return self._text
+
+    def _unpack(self, line_no: int) -> LineRecord:
+        """Create the line record for a line.
+
+        Args:
+            line_no: Line number.
+
+        Returns:
+            A new line record.
+        """
+        text = self._text[self._offsets[line_no] : self._offsets[line_no + 1] - 1]
+        styles = self._styles
+        span_start = self._span_offsets[line_no]
+        span_end = self._span_offsets[line_no + 1]
+        spans = [
+            Span(start, end, styles[style])
+            for start, end, style in zip(
+                self._span_starts[span_start:span_end],
+                self._span_ends[span_start:span_end],
+                self._span_styles[span_start:span_end],
+            )
+        ]
+        content = Content(text, spans, strip_control_codes=False)
+        return LineRecord(
+            content,
+            self._line_style_table[self._line_styles[line_no]],
+            self._fold_line(line_no, content.expand_tabs(8), self._width),
+            self._updates,
+        )
+
+    def refold(self, width: int, updates: int) -> Iterator[int]:
+        """Fold to a new width.
+
+        Args:
+            width: New width.
+            updates: Updates value for the line records.
+
+        Yields:
+            The number of folds in each line.
+        """
+        self._width = width
+        self._updates = updates
+        self._cache.clear()
+        for line_no, cell_length in enumerate(self._cell_lengths):
+            yield 1 if cell_length <= width else len(self[line_no].folds)
+
 
 @rich.repr.auto
 class ScrollMargin(NamedTuple):
@@ -771,11 +1539,9 @@ class Buffer:
 
     name: str = "buffer"
     """Name of the buffer (debugging aid)."""
-    lines: list[LineRecord] = field(default_factory=list)
-    """unfolded lines."""
-    line_to_fold: list[int] = field(default_factory=list)
-    """An index from folded lines on to unfolded lines."""
-    folded_lines: list[LineFold] = field(default_factory=list)
+    lines: MutableSequence[LineRecord] = field(default_factory=list)
+    """unfolded lines (a list, or `PackedLines` once compacted)."""
+    folded_lines: FoldedLines = field(init=False)
     """Folded lines."""
     scroll_margin: ScrollMargin = ScrollMargin(None, None)
     """Scroll margins"""
@@ -787,8 +1553,21 @@ class Buffer:
     """The longest line in the buffer."""
     updates: int = 0
     """Updates count (used in caching)."""
+    trimmed_folded_lines: int = 0
+    """Number of folded lines removed from the start of the buffer."""
+    reflow_line: int = 0
+    """Lines before this line may be folded to a previous width."""
+    non_blank_line_count: int = field(init=False, default=0)
+    """Number of lines which aren't blank."""
+    last_non_blank_line: int = field(init=False, default=-1)
+    """Index of the last line which isn't blank, or -1 if all lines are blank."""
     _updated_lines: set[int] | None = None
 
+    def __post_init__(self) -> None:
+        self.folded_lines = FoldedLines(self.lines)
+        self.non_blank_line_count = sum(not line.is_blank for line in self.lines)
+        self.last_non_blank_line = self._find_non_blank_line(len(self.lines))
+
     @property
     def line_count(self) -> int:
         """Total number of lines."""
@@ -818,24 +1597,22 @@ class Buffer:
         if self.cursor_line >= len(self.folded_lines):
             return (len(self.folded_lines), 0)
         cursor_folded_line = self.folded_lines[self.cursor_line]
-        cursor_line_offset = cursor_folded_line.line_offset
-        line_no = cursor_folded_line.line_no
-        line = self.lines[line_no]
-        position = 0
-        for folded_line_offset, folded_line in enumerate(line.folds):
-            if folded_line_offset == cursor_line_offset:
-                position += self.cursor_offset
-                break
-            position += len(folded_line.content)
-
-        return (line_no, position)
+        return (
+            cursor_folded_line.line_no,
+            cursor_folded_line.offset + self.cursor_offset,
+        )
 
     @property
     def is_blank(self) -> bool:
         """Is this buffer blank (spaces in all lines)?"""
-        return not any(
-            (line.content.plain.strip() or line.content.spans) for line in self.lines
-        )
+        return not self.non_blank_line_count
+
+    @property
+    def text(self) -> str:
+        """The text of all the (unfolded) lines, separated by newlines."""
+        if isinstance(self.lines, PackedLines):
+            return self.lines.text
+        return "\n".join(line.content.plain for line in self.lines)
 
     def update_cursor(self, line_no: int, cursor_line_offset: int) -> None:
         """Move the cursor to the given unfolded line and offset.
@@ -846,23 +1623,76 @@ class Buffer:
             line_no: Unfolded line number.
             cursor_line_offset: Offset within the line.
         """
-        line = self.lines[line_no]
-        fold_line_start = self.line_to_fold[line_no]
-        position = 0
-        fold_offset = 0
-        for fold_offset, fold in enumerate(line.folds):
-            line_length = len(fold.content)
-            if (
-                cursor_line_offset >= position
-                and cursor_line_offset < position + line_length
-            ):
+        folds = self.lines[line_no].folds
+        fold_line_start = self.folded_lines.line_start(line_no)
+        # The last fold starting at or before the offset
+        fold_offset = bisect_right(folds, cursor_line_offset, key=FOLD_OFFSET) - 1
+        if fold_offset >= 0:
+            fold = folds[fold_offset]
+            if cursor_line_offset < fold.offset + len(fold.content):
                 self.cursor_line = fold_line_start + fold_offset
-                self.cursor_offset = cursor_line_offset - position
-                break
-            position += line_length
+                self.cursor_offset = cursor_line_offset - fold.offset
+                return
+        # Offset is past the end of the line
+        self.cursor_line = fold_line_start + len(folds) - 1
+        self.cursor_offset = len(folds[-1].content)
+
+    def _find_non_blank_line(self, line_no: int) -> int:
+        """Find the last line which isn't blank, before a given line.
+
+        Args:
+            line_no: Line number to search back from.
+
+        Returns:
+            Line number, or -1 if the lines are all blank.
+        """
+        if self.non_blank_line_count:
+            lines = self.lines
+            for line_no in range(line_no - 1, -1, -1):
+                if not lines[line_no].is_blank:
+                    return line_no
+        return -1
+
+    def track_blank_line(self, line_no: int, was_blank: bool, blank: bool) -> None:
+        """Update the count of non-blank lines, after adding or updating a line.
+
+        This is O(1), unless the last non-blank line becomes blank, which requires
+        a search for the previous non-blank line.
+
+        Args:
+            line_no: Line number.
+            was_blank: Was the line blank before (`True` for a new line)?
+            blank: Is the line blank now?
+        """
+        if blank == was_blank:
+            return
+        if blank:
+            self.non_blank_line_count -= 1
+            if line_no == self.last_non_blank_line:
+                self.last_non_blank_line = self._find_non_blank_line(line_no)
         else:
-            self.cursor_line = fold_line_start + len(line.folds) - 1
-            self.cursor_offset = len(line.folds[-1].content)
+            self.non_blank_line_count += 1
+            if line_no > self.last_non_blank_line:
+                self.last_non_blank_line = line_no
+
+    def delete_lines(self, start: int, end: int | None = None) -> None:
+        """Delete (unfolded) lines, and update the count of non-blank lines.
+
+        Folded lines are not updated.
+
+        Args:
+            start: First line to delete.
+            end: Line following the last line to delete, or `None` for the end.
+        """
+        lines = self.lines
+        if end is None:
+            end = len(lines)
+        self.non_blank_line_count -= sum(not line.is_blank for line in lines[start:end])
+        del lines[start:end]
+        if self.last_non_blank_line >= end:
+            self.last_non_blank_line -= end - start
+        elif self.last_non_blank_line >= start:
+            self.last_non_blank_line = self._find_non_blank_line(start)
 
     def update_line(self, line_no: int) -> None:
         """Record an updated line.
@@ -881,8 +1711,9 @@ class Buffer:
 
         """
         del self.lines[:]
-        del self.line_to_fold[:]
-        del self.folded_lines[:]
+        self.folded_lines.clear()
+        self.non_blank_line_count = 0
+        self.last_non_blank_line = -1
         self.cursor_line = 0
         self.cursor_offset = 0
         self.max_line_width = 0
@@ -891,10 +1722,18 @@ class Buffer:
     def remove_last_line(self) -> None:
         if not self.lines:
             return
-        last_line_index = len(self.lines) - 1
-        del self.lines[-1]
-        del self.folded_lines[self.line_to_fold[last_line_index] :]
-        del self.line_to_fold[last_line_index]
+        self.truncate(len(self.lines) - 1)
+
+    def truncate(self, line_count: int) -> None:
+        """Remove lines from the end of the buffer.
+
+        Args:
+            line_count: Number of (unfolded) lines to keep.
+        """
+        if line_count >= len(self.lines):
+            return
+        self.delete_lines(line_count)
+        self.folded_lines.truncate(line_count)
         self.updates += 1
 
 
@@ -915,6 +1754,11 @@ class DECState:
     def gr(self) -> str:
         return self.slots[self.gr_slot]
 
+    @property
+    def is_identity(self) -> bool:
+        """Will `translate` return text unaltered?"""
+        return self.shift is None and not CHARSET_MAP.get(self.gl, None)
+
     def update(self, dec: DEC | None, dec_invoke: DECInvoke | None) -> None:
         if dec is not None:
             self.slots[dec.slot] = dec.character_set
@@ -963,15 +1807,29 @@ class TerminalState:
         *,
         width: int = 80,
         height: int = 24,
+        scrollback_lines: int | None = None,
+        max_sequence_length: int = MAX_SEQUENCE_LENGTH,
+        sgr_parser: SGRParser | None = None,
     ) -> None:
         """
         Args:
             width: Initial width.
             height: Initial height.
+            scrollback_lines: Maximum number of lines in the scrollback buffer, or
+                `None` for no limit.
+            max_sequence_length: Maximum length of an escape sequence. Longer
+                sequences are discarded.
+            sgr_parser: Converts SGR sequences in to styles, or `None` for the parser
+                shared by all terminals.
         """
         self._write_stdin = write_stdin
+        self._stdin_replies: list[str] = []
+        """Replies to the process (e.g. cursor position reports), waiting to be sent."""
 
-        self._ansi_stream = ANSIStream()
+        self._ansi_stream = ANSIStream(
+            ANSITokenizer(max_sequence_length),
+            SGR_PARSER if sgr_parser is None else sgr_parser,
+        )
         """ANSI stream processor."""
 
         self.width = width
@@ -998,6 +1856,8 @@ class TerminalState:
         """Current working directory."""
         self.scrollback_buffer = Buffer("scrollback")
         """Scrollbar buffer lines."""
+        self.scrollback_lines = scrollback_lines
+        """Maximum number of lines in the scrollback buffer, or `None` for no limit."""
         self.alternate_buffer = Buffer("alternate")
         """Alternate buffer lines."""
         self.dec_state = DECState()
@@ -1027,6 +1887,11 @@ class TerminalState:
             return False
         return True
 
+    @property
+    def metrics(self) -> ANSIMetrics:
+        """Counters for notable events in the ANSI stream."""
+        return self._ansi_stream.metrics
+
     @property
     def screen_start_line_no(self) -> int:
         return max(0, self.scrollback_buffer.height - self.height)
@@ -1114,40 +1979,186 @@ class TerminalState:
 
         """
         buffer = self.scrollback_buffer
-        while buffer.lines:
-            last_line_content = buffer.lines[-1].content
-            if last_line_content.spans or last_line_content.plain.rstrip():
-                break
-            buffer.remove_last_line()
+        buffer.truncate(buffer.last_non_blank_line + 1)
 
-    def _reflow(self) -> None:
-        buffer = self.buffer
-        if not buffer.lines:
-            return
+    def trim_scrollback(self) -> int:
+        """Remove lines from the start of the scrollback buffer, if it has grown
+        beyond the scrollback limit.
 
+        Lines are removed in batches of at least an eighth of the limit, so the cost
+        of rebuilding the fold index is proportional to the number of lines removed.
+        Lines which are on screen, or hold the cursor, are never removed.
+
+        Returns:
+            Number of folded lines removed.
+        """
+        if (max_lines := self.scrollback_lines) is None:
+            return 0
+        buffer = self.scrollback_buffer
+        if len(buffer.lines) <= max_lines + max_lines // 8:
+            return 0
+        folded_lines = buffer.folded_lines
+        line_count = len(buffer.lines) - max_lines
+        keep_line = min(buffer.cursor_line, self.screen_start_line_no)
+        if folded_lines.line_start(line_count) > keep_line:
+            line_count = folded_lines.locate(keep_line)[0]
+        if line_count <= 0:
+            return 0
+        buffer.delete_lines(0, line_count)
+        buffer.reflow_line = max(0, buffer.reflow_line - line_count)
+        removed = folded_lines.remove_head(line_count)
+        buffer.cursor_line -= removed
+        buffer.trimmed_folded_lines += removed
         buffer._updated_lines = None
-        # Unfolded cursor position
+        buffer.updates = self.advance_updates()
+        return removed
+
+    def compact(self) -> None:
+        """Pack the scrollback buffer in to compact storage.
+
+        Call this when the terminal won't be written to again, as the scrollback buffer
+        will be read only. It may still be resized.
+
+        """
+        buffer = self.scrollback_buffer
+        if isinstance(buffer.lines, PackedLines):
+            return
         cursor_line, cursor_offset = buffer.cursor
+        lines = PackedLines(
+            buffer.lines, self._fold_line, self.width, self.advance_updates()
+        )
+        buffer.lines = lines
+        # Packed lines are folded to the current width, which may not match lines
+        # awaiting a reflow
+        buffer.folded_lines = FoldedLines(lines)
+        buffer.folded_lines.rebuild(lines.refold(self.width, self.advance_updates()))
+        buffer.reflow_line = 0
+        buffer._updated_lines = None
+        buffer.updates = self.advance_updates()
+        self._restore_cursor(buffer, cursor_line, cursor_offset)
 
-        buffer.folded_lines.clear()
-        buffer.line_to_fold.clear()
-        width = self.width
+    @property
+    def reflow_pending(self) -> bool:
+        """Are there lines folded to a previous width?"""
+        buffer = self.scrollback_buffer
+        return bool(min(buffer.reflow_line, len(buffer.lines)))
+
+    def _reflow(self) -> None:
+        """Refold the buffers after a change of width.
+
+        The alternate buffer, and lines at the end of the scrollback buffer (which
+        will include those on screen), are refolded immediately. The remaining lines
+        keep their folds until they are refolded by `continue_reflow`.
+
+        """
+        for buffer in (self.scrollback_buffer, self.alternate_buffer):
+            if not buffer.lines:
+                continue
+            buffer._updated_lines = None
+            # Unfolded cursor position
+            cursor_line, cursor_offset = buffer.cursor
+
+            if isinstance(buffer.lines, PackedLines):
+                # Packed lines are folded on demand, so only the counts are needed
+                buffer.folded_lines.rebuild(
+                    buffer.lines.refold(self.width, self.advance_updates())
+                )
+                self._restore_cursor(buffer, cursor_line, cursor_offset)
+                continue
+
+            line_count = len(buffer.lines)
+            if buffer is self.alternate_buffer:
+                # The alternate screen is addressed from the top
+                reflow_line = 0
+            else:
+                reflow_line = max(0, line_count - max(REFLOW_BATCH, self.height * 2))
+            self._refold_lines(buffer, reflow_line, line_count)
+            if cursor_line < reflow_line:
+                self._refold_lines(buffer, cursor_line, cursor_line + 1)
+            buffer.reflow_line = reflow_line
+            self._restore_cursor(buffer, cursor_line, cursor_offset)
+
+    def continue_reflow(self, line_count: int = REFLOW_BATCH) -> bool:
+        """Refold lines in the scrollback buffer which are folded to a previous width.
+
+        Lines are refolded from the end of the buffer, towards the start.
 
-        for line_no, line_record in enumerate(buffer.lines):
+        Args:
+            line_count: Maximum number of lines to refold.
+
+        Returns:
+            `True` if there are more lines to refold, or `False` if the reflow is
+                complete.
+        """
+        buffer = self.scrollback_buffer
+        if reflow_line := min(buffer.reflow_line, len(buffer.lines)):
+            cursor_line, cursor_offset = buffer.cursor
+            start_line = max(0, reflow_line - line_count)
+            self._refold_lines(buffer, start_line, reflow_line)
+            buffer.reflow_line = start_line
+            self._restore_cursor(buffer, cursor_line, cursor_offset)
+            buffer.updates = self.advance_updates()
+        return self.reflow_pending
+
+    def reflow_folded_lines(self, buffer: Buffer, start: int, end: int) -> None:
+        """Refold lines folded to a previous width, within a range of folded lines.
+
+        Call this to refold the lines in view ahead of `continue_reflow`. Folded
+        lines before `start` won't move.
+
+        Args:
+            buffer: Buffer to refold.
+            start: Index of first folded line.
+            end: Index of last folded line (exclusive).
+        """
+        folded_lines = buffer.folded_lines
+        end = min(end, len(folded_lines))
+        reflow_line = min(buffer.reflow_line, len(buffer.lines))
+        if start >= end or not reflow_line:
+            return
+        start_line, _ = folded_lines.locate(start)
+        if start_line >= reflow_line:
+            return
+        end_line = min(folded_lines.locate(end - 1)[0] + 1, reflow_line)
+        cursor_line, cursor_offset = buffer.cursor
+        self._refold_lines(buffer, start_line, end_line)
+        self._restore_cursor(buffer, cursor_line, cursor_offset)
+        buffer.updates = self.advance_updates()
+
+    def _refold_lines(self, buffer: Buffer, start: int, end: int) -> None:
+        """Fold lines to the current width.
+
+        Args:
+            buffer: Buffer.
+            start: First line number.
+            end: Last line number (exclusive).
+        """
+        width = self.width
+        folded_lines = buffer.folded_lines
+        lines = buffer.lines
+        for line_no in range(start, end):
+            line_record = lines[line_no]
             line_expanded_tabs = line_record.content.expand_tabs(8)
             line_record.folds[:] = self._fold_line(line_no, line_expanded_tabs, width)
             line_record.updates = self.advance_updates()
-            buffer.line_to_fold.append(len(buffer.folded_lines))
-            buffer.folded_lines.extend(line_record.folds)
+            folded_lines.set_fold_count(line_no, len(line_record.folds))
 
-        # After reflow, we need to work out where the cursor is within the folded lines
-        # cursor_line = min(cursor_line, len(buffer.lines) - 1)
+    def _restore_cursor(
+        self, buffer: Buffer, cursor_line: int, cursor_offset: int
+    ) -> None:
+        """Work out where the cursor is within the folded lines, after refolding.
+
+        Args:
+            buffer: Buffer.
+            cursor_line: Unfolded cursor line.
+            cursor_offset: Unfolded cursor offset.
+        """
         if cursor_line >= len(buffer.lines):
-            buffer.cursor_line = len(buffer.lines)
+            buffer.cursor_line = len(buffer.folded_lines)
             buffer.cursor_offset = 0
         else:
             line = buffer.lines[cursor_line]
-            fold_cursor_line = buffer.line_to_fold[cursor_line]
+            fold_cursor_line = buffer.folded_lines.line_start(cursor_line)
 
             fold_cursor_offset = 0
             for fold in reversed(line.folds):
@@ -1160,16 +2171,53 @@ class TerminalState:
             buffer.cursor_offset = fold_cursor_offset
 
     async def write(
-        self, text: str, *, hide_output: bool = False
-    ) -> tuple[set[int] | None, set[int] | None]:
-        """Write to the terminal.
+        self, text: str | bytes, *, hide_output: bool = False
+    ) -> tuple[list[DamageSpan] | None, list[DamageSpan] | None]:
+        """Write to the terminal, and send any replies to stdin.
 
         Args:
-            text: Text to write.
+            text: Text to write, or UTF-8 encoded bytes (from a PTY).
+            hide_output: Hide visible output from buffers.
+
+        Returns:
+            A pair of updated line spans or `None` for full refresh, for scrollback
+                and alternate screen.
+        """
+        updates = self.process(text, hide_output=hide_output)
+        if self._stdin_replies:
+            await self.send_stdin_replies()
+        return updates
+
+    def take_stdin_replies(self) -> list[str]:
+        """Take the replies to stdin queued by `process`.
+
+        Returns:
+            Replies, in the order they were generated.
+        """
+        replies = self._stdin_replies
+        self._stdin_replies = []
+        return replies
+
+    async def send_stdin_replies(self) -> None:
+        """Send queued replies to stdin."""
+        for reply in self.take_stdin_replies():
+            await self.write_stdin(reply)
+
+    def process(
+        self, text: str | bytes, *, hide_output: bool = False
+    ) -> tuple[list[DamageSpan] | None, list[DamageSpan] | None]:
+        """Process text written to the terminal.
+
+        This doesn't do any I/O. Replies to the process are queued, to be sent with
+        `send_stdin_replies` (or retrieved with `take_stdin_replies`).
+
+        Args:
+            text: Text to write, or UTF-8 encoded bytes (from a PTY).
             hide_output: Hide visible output from buffers.
 
         Returns:
-            A pair of deltas or `None for full refresh, for scrollback and alternate screen.
+            A pair of updated line spans or `None` for full refresh, for scrollback
+                and alternate screen.
         """
         alternate_buffer = self.alternate_buffer
         scrollback_buffer = self.scrollback_buffer
@@ -1177,25 +2225,33 @@ class TerminalState:
         # Reset updated lines delta
         alternate_buffer._updated_lines = set()
         scrollback_buffer._updated_lines = set()
+        if not isinstance(text, str) and self._ansi_stream.is_plain(text):
+            text = self._ansi_stream.decode(text)
         # Write sequences and update
+        ansi_commands: Iterable[ANSICommand]
         if hide_output:
-            for ansi_command in self._ansi_stream.feed(text):
-                if not isinstance(ansi_command, (ANSIContent, ANSICursor)):
-                    await self._handle_ansi_command(ansi_command)
+            ansi_commands = (
+                ansi_command
+                for ansi_command in self._ansi_stream.feed(text)
+                if not isinstance(ansi_command, (ANSIContent, ANSICursor))
+            )
+        elif isinstance(text, str) and self._write_plain(text):
+            ansi_commands = ()
         else:
-            for ansi_command in self._ansi_stream.feed(text):
-                await self._handle_ansi_command(ansi_command)
+            ansi_commands = self._ansi_stream.feed(text)
+        self._process_commands(ansi_commands)
+        self.trim_scrollback()
 
         # Get deltas
         scrollback_updates = (
             None
             if scrollback_buffer._updated_lines is None
-            else scrollback_buffer._updated_lines.copy()
+            else coalesce_lines(scrollback_buffer._updated_lines)
         )
         alternate_updates = (
             None
             if alternate_buffer._updated_lines is None
-            else alternate_buffer._updated_lines.copy()
+            else coalesce_lines(alternate_buffer._updated_lines)
         )
         # Reset deltas
         self.alternate_buffer._updated_lines = set()
@@ -1203,19 +2259,82 @@ class TerminalState:
         # Return deltas accumulated during write
         return (scrollback_updates, alternate_updates)
 
+    def _write_plain(self, text: str) -> bool:
+        """Write plain text directly to the end of the scrollback buffer.
+
+        This is a fast path for the common case of a command writing lines of text
+        (think `cat`). It has the same effect as handling the commands from the ANSI
+        stream, but skips the parser, and adds each line to the buffer only once.
+
+        Args:
+            text: Text to write.
+
+        Returns:
+            `True` if the text was written, or `False` if it should be handled by
+                the ANSI stream.
+        """
+        if (
+            self.alternate_screen
+            or not self.dec_state.is_identity
+            or not self._ansi_stream.is_plain(text)
+            # Folds have expanded tabs, which throws off cursor offsets
+            or "\t" in text
+        ):
+            return False
+        buffer = self.scrollback_buffer
+        folded_lines = buffer.folded_lines
+        cursor_line = buffer.cursor_line
+        if cursor_line == len(folded_lines):
+            # Cursor is on a line yet to be written
+            if buffer.cursor_offset:
+                return False
+            line_content = None
+        elif (
+            cursor_line == len(folded_lines) - 1
+            and "\t" not in (line_content := buffer.lines[-1].content).plain
+            and self.get_cursor_line_offset(buffer) == len(line_content)
+        ):
+            # Cursor is at the end of the last line
+            pass
+        else:
+            return False
+
+        style = self.style
+        buffer.update_line(cursor_line)
+        first_line, *lines = text.replace("\r\n", "\n").split("\n")
+        if first_line:
+            content = Content.styled(first_line, style, strip_control_codes=False)
+            if line_content is None:
+                self.add_line(buffer, content)
+            else:
+                content = line_content + content
+                self.update_line(buffer, buffer.last_line_no, content)
+            buffer.update_cursor(buffer.last_line_no, len(content))
+        if lines:
+            if buffer.cursor_line < len(folded_lines):
+                buffer.lines[-1].content.simplify()
+            else:
+                self.add_line(buffer, EMPTY_LINE)
+            for line in lines[:-1]:
+                self.add_line(
+                    buffer, Content.styled(line, style, strip_control_codes=False)
+                )
+            if last_line := lines[-1]:
+                content = Content.styled(last_line, style, strip_control_codes=False)
+                self.add_line(buffer, content)
+                buffer.update_cursor(buffer.last_line_no, len(content))
+            else:
+                buffer.cursor_line = len(folded_lines)
+                buffer.cursor_offset = clamp(0, 0, self.width - 1)
+            buffer.update_line(buffer.cursor_line)
+            self._line_updated(buffer, cursor_line)
+            self._line_updated(buffer, buffer.cursor_line)
+        buffer.updates = self.advance_updates()
+        return True
+
     def get_cursor_line_offset(self, buffer: Buffer) -> int:
         """The cursor offset within the un-folded lines."""
-        cursor_folded_line = buffer.folded_lines[buffer.cursor_line]
-        cursor_line_offset = cursor_folded_line.line_offset
-        line_no = cursor_folded_line.line_no
-        line = buffer.lines[line_no]
-        position = 0
-        for folded_line_offset, folded_line in enumerate(line.folds):
-            if folded_line_offset == cursor_line_offset:
-                position += buffer.cursor_offset
-                break
-            position += len(folded_line.content)
-        return position
+        return buffer.folded_lines[buffer.cursor_line].offset + buffer.cursor_offset
 
     def clear_buffer(self, clear: ClearType) -> None:
         buffer = self.buffer
@@ -1225,14 +2344,12 @@ class TerminalState:
             #     self.add_line(buffer, EMPTY_CONTENT)
         elif clear == "cursor_to_end":
             buffer._updated_lines = None
-            folded_cursor_line = buffer.cursor_line
             cursor_line, cursor_line_offset = buffer.cursor
             while buffer.cursor_line >= len(buffer.folded_lines):
                 self.add_line(buffer, EMPTY_LINE)
             line = buffer.lines[cursor_line]
-            del buffer.lines[cursor_line + 1 :]
-            del buffer.line_to_fold[cursor_line + 1 :]
-            del buffer.folded_lines[folded_cursor_line + 1 :]
+            buffer.delete_lines(cursor_line + 1)
+            buffer.folded_lines.truncate(len(buffer.lines))
             self.update_line(buffer, cursor_line, line.content[:cursor_line_offset])
         else:
             # print(f"TODO: clear_buffer({clear!r})")
@@ -1302,7 +2419,76 @@ class TerminalState:
             content += Content.blank(offset - len(content), style)
         return content
 
-    async def _handle_ansi_command(self, ansi_command: ANSICommand) -> None:
+    def _process_commands(self, ansi_commands: Iterable[ANSICommand]) -> None:
+        """Apply commands from the ANSI stream.
+
+        Runs of style and content (which are always on the same line) are combined,
+        and written to the buffer with a single line update.
+
+        Args:
+            ansi_commands: Commands from the ANSI stream.
+        """
+        parts: list[tuple[str, Style]] = []
+        translate = self.dec_state.translate
+        apply_ansi_command = self._apply_ansi_command
+        for ansi_command in ansi_commands:
+            if isinstance(ansi_command, ANSIContent):
+                parts.append((translate(ansi_command.text), self.style))
+                continue
+            if isinstance(ansi_command, ANSIStyle):
+                self.style = ansi_command.style
+                continue
+            if parts:
+                self._write_content(Content.assemble(*parts, strip_control_codes=False))
+                parts.clear()
+            apply_ansi_command(ansi_command)
+        if parts:
+            self._write_content(Content.assemble(*parts, strip_control_codes=False))
+
+    def _write_content(self, content: Content) -> None:
+        """Write content at the cursor.
+
+        Args:
+            content: Content to write.
+        """
+        buffer = self.buffer
+        folded_lines = buffer.folded_lines
+        while buffer.cursor_line >= len(folded_lines):
+            self.add_line(buffer, EMPTY_LINE)
+        folded_line = folded_lines[buffer.cursor_line]
+        line_no = folded_line.line_no
+        line = buffer.lines[line_no]
+
+        cursor_line_offset = self.get_cursor_line_offset(buffer)
+        line_content = line.content
+        if cursor_line_offset > len(line_content):
+            line_content = self._expand_content(
+                line_content, cursor_line_offset, line.style
+            )
+        if self.replace_mode:
+            updated_line = Content.assemble(
+                line_content[:cursor_line_offset],
+                content,
+                line_content[cursor_line_offset + len(content) :],
+                strip_control_codes=False,
+            )
+        else:
+            updated_line = Content.assemble(
+                line_content[:cursor_line_offset],
+                content,
+                line_content[cursor_line_offset:],
+                strip_control_codes=False,
+            )
+        self.update_line(buffer, line_no, updated_line)
+        buffer.update_cursor(line_no, cursor_line_offset + len(content))
+        buffer.updates = self.advance_updates()
+
+    def _apply_ansi_command(self, ansi_command: ANSICommand) -> None:
+        """Apply a single command.
+
+        Args:
+            ansi_command: Command to apply.
+        """
         if isinstance(ansi_command, ANSINewLine):
             if self.alternate_screen:
                 # New line behaves differently in alternate screen
@@ -1315,43 +2501,13 @@ class TerminalState:
                 self.style = style
 
             case ANSIContent(text):
-                buffer = self.buffer
-                folded_lines = buffer.folded_lines
-                while buffer.cursor_line >= len(folded_lines):
-                    self.add_line(buffer, EMPTY_LINE)
-                folded_line = folded_lines[buffer.cursor_line]
-                previous_content = folded_line.content
-                line_no = folded_line.line_no
-                line = buffer.lines[line_no]
-
-                cursor_line_offset = self.get_cursor_line_offset(buffer)
-                line_content = line.content
-                if cursor_line_offset > len(line_content):
-                    line_content = self._expand_content(
-                        line_content, cursor_line_offset, line.style
-                    )
-                content = Content.styled(
-                    self.dec_state.translate(text),
-                    self.style,
-                    strip_control_codes=False,
-                )
-                if self.replace_mode:
-                    updated_line = Content.assemble(
-                        line_content[:cursor_line_offset],
-                        content,
-                        line_content[cursor_line_offset + len(content) :],
-                        strip_control_codes=False,
-                    )
-                else:
-                    updated_line = Content.assemble(
-                        line_content[:cursor_line_offset],
-                        content,
-                        line_content[cursor_line_offset:],
+                self._write_content(
+                    Content.styled(
+                        self.dec_state.translate(text),
+                        self.style,
                         strip_control_codes=False,
                     )
-                self.update_line(buffer, line_no, updated_line)
-                buffer.update_cursor(line_no, cursor_line_offset + len(content))
-                buffer.updates = self.advance_updates()
+                )
 
             case ANSICursor(
                 delta_x,
@@ -1521,7 +2677,7 @@ class TerminalState:
             case ANSICursorPositionRequest():
                 row = self.buffer.cursor_line + 1
                 column = self.buffer.cursor_offset + 1
-                await self.write_stdin(f"\x1b[{row};{column}R")
+                self._stdin_replies.append(f"\x1b[{row};{column}R")
 
             case _:
                 print("Unhandled", ansi_command)
@@ -1567,19 +2723,23 @@ class TerminalState:
         updates = self.advance_updates()
         line_no = buffer.line_count
         width = self.width
+        line_expanded_tabs = content.expand_tabs(8)
+        buffer.max_line_width = max(
+            line_expanded_tabs.cell_length, buffer.max_line_width
+        )
         line_record = LineRecord(
             content,
             style,
-            self._fold_line(line_no, content, width),
+            self._fold_line(line_no, line_expanded_tabs, width),
             updates,
         )
         buffer.lines.append(line_record)
+        buffer.track_blank_line(line_no, True, line_record.is_blank)
         folds = line_record.folds
-        buffer.line_to_fold.append(len(buffer.folded_lines))
         fold_count = len(buffer.folded_lines)
         if buffer._updated_lines is not None:
             buffer._updated_lines.update(range(fold_count, fold_count + len(folds)))
-        buffer.folded_lines.extend(folds)
+        buffer.folded_lines.append_line(len(folds))
         buffer.updates = updates
 
     def update_line(
@@ -1601,26 +2761,19 @@ class TerminalState:
             line_expanded_tabs.cell_length, buffer.max_line_width
         )
         line_record = buffer.lines[line_index]
+        was_blank = line_record.is_blank
         line_record.content = line
+        buffer.track_blank_line(line_index, was_blank, line_record.is_blank)
         if style is not None:
             line_record.style = style
         line_record.folds[:] = self._fold_line(
             line_index, line_expanded_tabs, self.width
         )
         line_record.updates = self.advance_updates()
+        buffer.folded_lines.set_fold_count(line_index, len(line_record.folds))
 
         if buffer._updated_lines is not None:
-            fold_start = buffer.line_to_fold[line_index]
+            fold_start = buffer.folded_lines.line_start(line_index)
             buffer._updated_lines.update(
                 range(fold_start, fold_start + len(line_record.folds))
             )
-
-        fold_line = buffer.line_to_fold[line_index]
-        del buffer.line_to_fold[line_index:]
-        del buffer.folded_lines[fold_line:]
-
-        for line_no in range(line_index, buffer.line_count):
-            line_record = buffer.lines[line_no]
-            buffer.line_to_fold.append(len(buffer.folded_lines))
-            for fold in line_record.folds:
-                buffer.folded_lines.append(fold)
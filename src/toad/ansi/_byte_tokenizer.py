@@ -0,0 +1,237 @@
+from __future__ import annotations
+
+import codecs
+import re  # Stdlib re, as re2 has a high per-match overhead
+
+from typing import Iterable
+
+import rich.repr
+
+from toad.ansi._metrics import ANSIMetrics, MAX_SEQUENCE_LENGTH
+from toad.ansi._tokenizer import ANSIToken, DEC_FINAL
+
+# The same grammar as `toad.ansi._tokenizer.TOKENS`, but on UTF-8 encoded bytes.
+# Everything significant to the grammar is ASCII (which never occurs within a
+# multi-byte character), other than ST (U+009C) which is encoded as two bytes.
+TOKENS = re.compile(
+    rb"""
+    (?P<content>[^\n\r\x08\x1b]+)
+    |(?P<separator>[\n\r\x08])
+    |\x1b(?:
+        (?P<csi>\[[^\x40-\x7e]*[\x40-\x7e])
+        |(?P<osc>\][\s\S]*?(?:\x07|\xc2\x9c|\x1b\\))
+        |(?P<dcs>P[\s\S]*?(?:\xc2\x9c|\x1b\\))
+        |(?P<dec>[()*+\-./][\s\S])
+        |(?P<dec_invoke>[no~}|NO])
+        |(?P<la>\#[\s\S])
+        |(?P<sp>\ [\s\S])
+        |(?P<control>[^\[\]P()*+\-./\#\ ])
+    )
+    """,
+    re.VERBOSE,
+)
+"""Matches a single token. Incomplete escape sequences won't match."""
+
+STRING_TERMINATORS = {
+    b"]": re.compile(rb"\x07|\xc2\x9c|\x1b\\"),
+    b"P": re.compile(rb"\xc2\x9c|\x1b\\"),
+}
+"""Matches the end of OSC and DCS sequences, keyed on the introducer."""
+
+
+@rich.repr.auto
+class ANSIByteTokenizer:
+    """Splits a stream of UTF-8 encoded bytes containing escape sequences in to
+    logical tokens.
+
+    Produces the same tokens as `ANSITokenizer` does for the decoded text, but
+    locates escape sequences in the bytes, and decodes only what it yields. This
+    saves decoding everything up front, and scanning the decoded text again.
+
+    Maximum sequence lengths are in bytes rather than characters.
+
+    """
+
+    def __init__(
+        self,
+        max_sequence_length: int = MAX_SEQUENCE_LENGTH,
+        metrics: ANSIMetrics | None = None,
+    ) -> None:
+        """
+        Args:
+            max_sequence_length: Maximum length of an escape sequence. Longer
+                sequences are discarded.
+            metrics: Counters to update, or `None` for new counters.
+        """
+        self.max_sequence_length = max_sequence_length
+        """Maximum length of an escape sequence."""
+        self.metrics = ANSIMetrics() if metrics is None else metrics
+        """Counters for notable events."""
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        """Decodes content, which may end part way through a character."""
+        self._pending = b""
+        """An incomplete escape sequence, from the end of the previous chunk."""
+        self._discarding: bytes | None = None
+        """Introducer of an oversize OSC or DCS being discarded, or `None`."""
+        self._discard_tail = b""
+        """The last discarded byte."""
+
+    def __rich_repr__(self) -> rich.repr.Result:
+        yield "pending", self._pending, b""
+        yield "discarding", self._discarding, None
+
+    @property
+    def is_idle(self) -> bool:
+        """Is the tokenizer between escape sequences?"""
+        return not self._pending and self._discarding is None
+
+    def decode(self, data: bytes) -> str:
+        """Decode content, which doesn't need to end on a character boundary.
+
+        Args:
+            data: Bytes without escape sequences.
+
+        Returns:
+            Decoded text.
+        """
+        return self._decoder.decode(data)
+
+    @classmethod
+    def _find_terminator(
+        cls, introducer: bytes, data: bytes, tail: bytes
+    ) -> int | None:
+        """Find the end of an OSC or DCS sequence.
+
+        Args:
+            introducer: Byte following the escape (`b"]"` or `b"P"`).
+            data: Bytes to search.
+            tail: The byte preceding `data`, which may start a terminator.
+
+        Returns:
+            Offset following the terminator, or `None` if there is no terminator.
+        """
+        terminators = STRING_TERMINATORS[introducer]
+        if tail and (match := terminators.search(tail + data[:1])) is not None:
+            if match.end() == 2:
+                return 1
+        if (match := terminators.search(data)) is None:
+            return None
+        return match.end()
+
+    def _discard_pending(self) -> None:
+        """Discard a pending OSC or DCS which has exceeded the maximum length.
+
+        The remainder of the sequence will be discarded without buffering.
+        """
+        pending = self._pending
+        self._pending = b""
+        self.metrics.record_oversize(len(pending))
+        self._discarding = pending[1:2]
+        self._discard_tail = pending[-1:]
+
+    def _flush(self) -> str:
+        """Flush a character left incomplete by the end of a content run.
+
+        Returns:
+            Replacement text for an incomplete character, or an empty string.
+        """
+        if self._decoder.getstate()[0]:
+            return self._decoder.decode(b"", True)
+        return ""
+
+    def feed(self, data: bytes) -> Iterable[ANSIToken]:
+        """Feed bytes in to the tokenizer.
+
+        Args:
+            data: UTF-8 encoded bytes from stream.
+
+        Yields:
+            Tuples of token name and token text.
+        """
+        if not data:
+            return
+        if self._discarding is not None:
+            end = self._find_terminator(self._discarding, data, self._discard_tail)
+            if end is None:
+                self.metrics.discarded_characters += len(data)
+                self._discard_tail = data[-1:]
+                return
+            self.metrics.discarded_characters += end
+            self._discarding = None
+            data = data[end:]
+
+        if pending := self._pending:
+            self._pending = b""
+            introducer = pending[1:2]
+            if (
+                introducer in STRING_TERMINATORS
+                and self._find_terminator(introducer, data, pending[-1:]) is None
+            ):
+                # No need to scan an OSC or DCS until there is a terminator
+                self._pending = pending + data
+                if len(self._pending) > self.max_sequence_length + 1:
+                    self._discard_pending()
+                return
+            data = pending + data
+
+        match_token = TOKENS.match
+        decode = self._decoder.decode
+        max_sequence_length = self.max_sequence_length
+        # Content may end part way through a character, if it ends the data
+        incomplete = bool(self._decoder.getstate()[0])
+        position = 0
+        data_length = len(data)
+        while position < data_length:
+            if (match := match_token(data, position)) is None:
+                if incomplete and (text := self._flush()):
+                    yield "content", text
+                incomplete = False
+                # Escape sequence is incomplete
+                if data_length - position <= max_sequence_length + 1:
+                    # Wait for more data
+                    self._pending = data[position:]
+                    return
+                if data[position + 1 : position + 2] in STRING_TERMINATORS:
+                    self._pending = data[position:]
+                    self._discard_pending()
+                    return
+                # Abandon the oversize sequence
+                self.metrics.record_oversize(max_sequence_length + 2)
+                position += max_sequence_length + 2
+                continue
+            name = match.lastgroup
+            assert name is not None
+            position = match.end()
+            if name == "content":
+                token_bytes = match.group(name)
+                if not incomplete:
+                    try:
+                        yield name, token_bytes.decode()
+                        continue
+                    except UnicodeDecodeError:
+                        pass
+                # Invalid, or ends part way through a character
+                text = decode(token_bytes)
+                incomplete = bool(self._decoder.getstate()[0])
+                if text:
+                    yield name, text
+                continue
+            if incomplete:
+                if text := self._flush():
+                    yield "content", text
+                incomplete = False
+            token_bytes = match.group(name)
+            if len(token_bytes) > max_sequence_length:
+                if name == "csi":
+                    self.metrics.record_oversize(max_sequence_length + 2)
+                    position = match.start() + max_sequence_length + 2
+                else:
+                    self.metrics.record_oversize(len(token_bytes) + 1)
+                continue
+            try:
+                token_text = token_bytes.decode()
+            except UnicodeDecodeError:
+                token_text = token_bytes.decode("utf-8", "replace")
+            if name == "dec" and token_text[1] not in DEC_FINAL:
+                continue
+            yield name, token_text
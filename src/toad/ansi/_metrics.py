@@ -0,0 +1,25 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+MAX_SEQUENCE_LENGTH = 64 * 1024
+"""Default maximum length of an escape sequence (in characters)."""
+
+
+@dataclass
+class ANSIMetrics:
+    """Counters for notable events in an ANSI stream (a diagnostic aid)."""
+
+    oversize_sequences: int = 0
+    """Number of escape sequences discarded for exceeding the maximum length."""
+    discarded_characters: int = 0
+    """Number of characters in discarded escape sequences."""
+
+    def record_oversize(self, length: int) -> None:
+        """Record a discarded escape sequence.
+
+        Args:
+            length: Number of characters discarded.
+        """
+        self.oversize_sequences += 1
+        self.discarded_characters += length
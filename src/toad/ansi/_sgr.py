@@ -0,0 +1,263 @@
+from __future__ import annotations
+
+from itertools import islice
+from threading import Lock
+from typing import NamedTuple
+
+import rich.repr
+
+from textual.color import Color
+from textual.style import Style, NULL_STYLE
+
+from toad.ansi._ansi_colors import ANSI_COLORS
+from toad.ansi._sgr_styles import SGR_STYLES
+
+type SGRCodes = tuple[int, ...]
+
+SGR_CACHE_SIZE = 1024
+"""Initial number of entries in each SGR cache."""
+SGR_CACHE_MAX_SIZE = 16 * 1024
+"""Maximum number of entries in each SGR cache."""
+
+
+class SGRCacheInfo(NamedTuple):
+    """Statistics for an SGR cache."""
+
+    hits: int
+    """Number of lookups found in the cache."""
+    misses: int
+    """Number of lookups not found in the cache."""
+    size: int
+    """Number of entries in the cache."""
+    maxsize: int
+    """Current capacity of the cache."""
+
+
+class SGRCache[KeyType, ValueType](dict[KeyType, ValueType]):
+    """A dict with a maximum size, which grows if it is thrashing.
+
+    When full, the oldest quarter of the entries are discarded. The cache remembers
+    (the hashes of) discarded keys; if enough of them are stored again, the working
+    set doesn't fit and the maximum size doubles.
+
+    Lookups don't update `hits` and `misses`, which are counted by the caller.
+
+    The cache may be shared by threads. Stores (and evictions) hold a lock, so they
+    don't interfere, but a key found by one lookup may be evicted before the next, so
+    read values with a single lookup. The statistics are approximate when shared.
+
+    """
+
+    __slots__ = [
+        "maxsize",
+        "max_size",
+        "hits",
+        "misses",
+        "_evicted",
+        "_thrash_count",
+        "_lock",
+    ]
+
+    def __init__(self, maxsize: int, max_size: int) -> None:
+        """
+        Args:
+            maxsize: Initial maximum number of entries.
+            max_size: Maximum size the cache may grow to.
+        """
+        self.maxsize = maxsize
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._evicted: tuple[set[int], set[int]] = (set(), set())
+        """Hashes of recently evicted keys (current and previous generations)."""
+        self._thrash_count = 0
+        """Number of evicted keys which were stored again."""
+        self._lock = Lock()
+        """Held while the cache is modified."""
+
+    @property
+    def info(self) -> SGRCacheInfo:
+        """Cache statistics."""
+        return SGRCacheInfo(self.hits, self.misses, len(self), self.maxsize)
+
+    def store(self, key: KeyType, value: ValueType) -> None:
+        """Store a value, discarding old entries or growing as required.
+
+        Args:
+            key: Cache key.
+            value: Value to store.
+        """
+        key_hash = hash(key)
+        with self._lock:
+            evicted, previous_evicted = self._evicted
+            if key_hash in evicted or key_hash in previous_evicted:
+                self._thrash_count += 1
+            if len(self) >= self.maxsize:
+                if (
+                    self.maxsize < self.max_size
+                    and self._thrash_count >= self.maxsize // 4
+                ):
+                    self.maxsize = min(self.maxsize * 2, self.max_size)
+                    self._thrash_count = 0
+                else:
+                    evict_keys = list(islice(self, self.maxsize // 4 or 1))
+                    for evict_key in evict_keys:
+                        self.pop(evict_key, None)
+                    if len(evicted) >= self.maxsize * 4:
+                        # Start a new generation
+                        previous_evicted = evicted
+                        evicted = set()
+                        self._evicted = (evicted, previous_evicted)
+                    evicted.update(map(hash, evict_keys))
+            self[key] = value
+
+
+@rich.repr.auto
+class SGRParser:
+    """Converts SGR (Select Graphic Rendition) sequences in to styles.
+
+    Parameters are parsed in to a tuple of integers, which is the key for a cache of
+    styles. The result of applying a style to the current style is cached too, so
+    repeated sequences produce the same `Style` instance without combining styles.
+
+    """
+
+    def __init__(
+        self,
+        cache_size: int = SGR_CACHE_SIZE,
+        max_cache_size: int = SGR_CACHE_MAX_SIZE,
+    ) -> None:
+        """
+        Args:
+            cache_size: Initial size of caches.
+            max_cache_size: Maximum size of caches.
+        """
+        self._styles: SGRCache[SGRCodes, Style | None] = SGRCache(
+            cache_size, max_cache_size
+        )
+        """Maps parameters on to a style, or `None` for a reset."""
+        self._applied: SGRCache[tuple[Style, SGRCodes], Style] = SGRCache(
+            cache_size, max_cache_size
+        )
+        """Maps the current style and parameters on to the new style."""
+
+    def __rich_repr__(self) -> rich.repr.Result:
+        yield "styles", self.style_cache_info
+        yield "applied", self.applied_cache_info
+
+    @property
+    def style_cache_info(self) -> SGRCacheInfo:
+        """Statistics for the cache of styles."""
+        return self._styles.info
+
+    @property
+    def applied_cache_info(self) -> SGRCacheInfo:
+        """Statistics for the cache of applied styles."""
+        return self._applied.info
+
+    @classmethod
+    def parse_codes(cls, sgr: str) -> SGRCodes | None:
+        """Parse SGR parameters in to integers.
+
+        Args:
+            sgr: SGR parameters (without the CSI or final "m").
+
+        Returns:
+            A tuple of codes, or `None` if the parameters aren't valid.
+        """
+        try:
+            codes = [int(code) if code else 0 for code in sgr.split(";")]
+        except ValueError:
+            return None
+        return tuple([code if code < 255 else 255 for code in codes])
+
+    @classmethod
+    def build_style(cls, codes: SGRCodes) -> Style | None:
+        """Build a Style from SGR codes, or `None` to indicate a reset.
+
+        Args:
+            codes: Codes from `parse_codes`.
+
+        Returns:
+            A Visual Style, or `None`.
+        """
+        style = NULL_STYLE
+        codes_list = list(codes)
+        while codes_list:
+            match codes_list:
+                case [38, 2, red, green, blue, *codes_list]:
+                    # Foreground RGB
+                    style += Style(foreground=Color(red, green, blue))
+                case [48, 2, red, green, blue, *codes_list]:
+                    # Background RGB
+                    style += Style(background=Color(red, green, blue))
+                case [38, 5, ansi_color, *codes_list]:
+                    # Foreground ANSI
+                    style += Style(foreground=ANSI_COLORS[ansi_color])
+                case [48, 5, ansi_color, *codes_list]:
+                    # Background ANSI
+                    style += Style(background=ANSI_COLORS[ansi_color])
+                case [0, *codes_list]:
+                    # reset
+                    return None
+                case [code, *codes_list]:
+                    if sgr_style := SGR_STYLES.get(code):
+                        style += sgr_style
+
+        return style
+
+    def get_style(self, codes: SGRCodes) -> Style | None:
+        """Get the style for SGR codes, or `None` to indicate a reset.
+
+        Args:
+            codes: Codes from `parse_codes`.
+
+        Returns:
+            A Visual Style, or `None`.
+        """
+        styles = self._styles
+        try:
+            style = styles[codes]
+        except KeyError:
+            styles.misses += 1
+        else:
+            styles.hits += 1
+            return style
+        style = self.build_style(codes)
+        styles.store(codes, style)
+        return style
+
+    def apply(self, style: Style, sgr: str) -> Style:
+        """Apply an SGR sequence to a style.
+
+        Args:
+            style: The current style.
+            sgr: SGR parameters (without the CSI or final "m").
+
+        Returns:
+            The new style.
+        """
+        if (codes := self.parse_codes(sgr)) is None:
+            return style
+        applied = self._applied
+        key = (style, codes)
+        if (applied_style := applied.get(key)) is not None:
+            applied.hits += 1
+            return applied_style
+        applied.misses += 1
+        if (sgr_style := self.get_style(codes)) is None:
+            applied_style = NULL_STYLE
+        else:
+            applied_style = style + sgr_style
+            # Special case to use widget background rather
+            # than theme background
+            if sgr_style.background is not None and sgr_style.background.ansi == -1:
+                applied_style = (
+                    Style(foreground=applied_style.foreground) + sgr_style.without_color
+                )
+        applied.store(key, applied_style)
+        return applied_style
+
+
+SGR_PARSER = SGRParser()
+"""SGR parser shared by ANSI streams by default (which warms the caches)."""
@@ -1,5 +1,6 @@
 from functools import lru_cache
 import io
+import re as stdlib_re  # re2 converts the whole text on each search with a position
 import re2 as re
 
 import rich.repr
@@ -56,37 +57,121 @@ class ReadUntil[ResultType](StreamRead[ResultType]):
 
     def __init__(self, *characters: str) -> None:
         self.characters = characters
-        self._regex = re.compile(
-            "|".join(re.escape(character) for character in characters)
+        self._regex = stdlib_re.compile(
+            "|".join(stdlib_re.escape(character) for character in characters)
         )
 
     def __rich_repr__(self) -> rich.repr.Result:
         yield from self.characters
 
 
+@lru_cache(1024)
+def _compile_regex(regex: str) -> re._Regexp:
+    """Compile a regular expression (cached).
+
+    Args:
+        regex: Regular expression.
+
+    Returns:
+        Compiled regular expression.
+    """
+    return re.compile(regex)
+
+
 @rich.repr.auto
 class ReadRegex[ResultType](StreamRead[ResultType]):
-    __slots__ = ["regex", "max_length", "_buffer"]
+    """Search for a regular expression.
+
+    If `max_length` is set, no match may be longer than `max_length` characters, and
+    the text of a longer match is released. A match may include at most `lookbehind`
+    characters of previously fed text (`max_length - 1` by default), so text before
+    that can no longer match. It is released, so the buffer is bounded, and each
+    search resumes from the end of the released text. With neither set, a match may
+    start anywhere, and the whole buffer is searched again.
 
-    def __init__(self, regex: str, max_length: int | None = None) -> None:
+    """
+
+    __slots__ = ["regex", "max_length", "lookbehind", "_regex", "_buffer"]
+
+    def __init__(
+        self, regex: str, max_length: int | None = None, lookbehind: int | None = None
+    ) -> None:
         self.regex = regex
         self.max_length = max_length
-        self._buffer = io.StringIO()
+        if lookbehind is None and max_length is not None:
+            lookbehind = max(0, max_length - 1)
+        self.lookbehind = lookbehind
+        self._regex = _compile_regex(regex)
+        self._buffer = ""
 
     def __rich_repr__(self) -> rich.repr.Result:
         yield self.regex
+        yield "max_length", self.max_length, None
+        yield "lookbehind", self.lookbehind, None
 
     @property
     def buffer_size(self) -> int:
-        return self._buffer.tell()
+        return len(self._buffer)
+
+    def feed(self, text: str, position: int = 0) -> tuple[str, re._Match | None, int]:
+        """Feed text, and search for the regex.
+
+        Args:
+            text: Text to feed.
+            position: Offset within text to start reading.
+
+        Returns:
+            A tuple of released text (which precedes the match, or can no longer
+                match), the match or `None`, and the number of characters consumed.
+        """
+        previous_length = len(self._buffer)
+        buffer = self._buffer + text[position:]
+        max_length = self.max_length
+        search_position = 0
+        while (match := self._regex.search(buffer, search_position)) is not None:
+            match_start, match_end = match.span(0)
+            if max_length is None or match_end - match_start <= max_length:
+                self._buffer = ""
+                return (
+                    buffer[:match_start],
+                    match,
+                    max(0, match_end - previous_length),
+                )
+            # Too long, so release the match text and search after it
+            search_position = match_end
+        if self.lookbehind is None:
+            # A match may start anywhere, so the buffer must be searched again
+            self._buffer = buffer
+            return "", None, len(text) - position
+        # A match may only include the last `lookbehind` characters
+        release = max(search_position, len(buffer) - self.lookbehind)
+        self._buffer = buffer[release:]
+        return buffer[:release], None, len(text) - position
+
+
+def _store_text(store: io.StringIO, text: str, max_length: int | None) -> None:
+    """Store unconsumed text, up to a maximum length.
+
+    Args:
+        store: Unconsumed text.
+        text: New text.
+        max_length: Maximum length to store, or `None` for no maximum.
+    """
+    if max_length is None:
+        store.write(text)
+    elif (remaining := max_length - store.tell()) > 0:
+        store.write(text[:remaining])
 
 
 @rich.repr.auto
 class ReadPatterns[ResultType](StreamRead[ResultType]):
-    __slots__ = ["patterns", "_text"]
+    __slots__ = ["patterns", "max_length", "_text"]
 
-    def __init__(self, start: str = "", **patterns: Pattern) -> None:
+    def __init__(
+        self, start: str = "", max_length: int | None = None, **patterns: Pattern
+    ) -> None:
         self.patterns = patterns
+        self.max_length = max_length
         self._text = io.StringIO()
         self._text.write(start)
 
@@ -102,10 +187,20 @@ class ReadPatterns[ResultType](StreamRead[ResultType]):
     def is_exhausted(self) -> bool:
         return not self.patterns
 
-    def feed(self, text: str) -> tuple[int, TokenMatch | None]:
+    def feed(self, text: str, position: int = 0) -> tuple[int, TokenMatch | None]:
+        """Feed text to the patterns.
+
+        Args:
+            text: Text to feed.
+            position: Offset within text to start reading.
+
+        Returns:
+            A tuple of the number of characters consumed, and a match or `None`.
+        """
         consumed = 0
         new_patterns = patterns = self.patterns
-        for character in text:
+        for index in range(position, len(text)):
+            character = text[index]
             consumed += 1
             for name, sequence_validator in patterns.items():
                 if (value := sequence_validator.feed(character)) is False:
@@ -114,7 +209,7 @@ class ReadPatterns[ResultType](StreamRead[ResultType]):
                 elif value:
                     return consumed, (name, value)
             patterns = self._patterns = new_patterns
-        self._text.write(text[:consumed])
+        _store_text(self._text, text[position : position + consumed], self.max_length)
         return consumed, None
 
 
@@ -122,11 +217,14 @@ class ReadPatterns[ResultType](StreamRead[ResultType]):
 class ReadPattern[ResultType](StreamRead[ResultType]):
     """Special case for a single pattern."""
 
-    __slots__ = ["name", "pattern", "_text", "_exhaused"]
+    __slots__ = ["name", "pattern", "max_length", "_text", "_exhaused"]
 
-    def __init__(self, start: str, name: str, pattern: Pattern) -> None:
+    def __init__(
+        self, start: str, name: str, pattern: Pattern, max_length: int | None = None
+    ) -> None:
         self.name = name
         self.pattern: Pattern = pattern
+        self.max_length = max_length
         self._text = io.StringIO()
         self._text.write(start)
         self._exhaused = False
@@ -143,18 +241,27 @@ class ReadPattern[ResultType](StreamRead[ResultType]):
     def is_exhausted(self) -> bool:
         return self._exhaused
 
-    def feed(self, text: str) -> tuple[int, TokenMatch | None]:
+    def feed(self, text: str, position: int = 0) -> tuple[int, TokenMatch | None]:
+        """Feed text to the pattern.
+
+        Args:
+            text: Text to feed.
+            position: Offset within text to start reading.
+
+        Returns:
+            A tuple of the number of characters consumed, and a match or `None`.
+        """
         consumed = 0
         feed = self.pattern.feed
-        for character in text:
+        for index in range(position, len(text)):
             consumed += 1
-            if (value := feed(character)) is False:
+            if (value := feed(text[index])) is False:
                 self._exhaused = True
                 break
             elif value:
                 self._exhaused = True
                 return consumed, ("pattern", value)
-        self._text.write(text[:consumed])
+        _store_text(self._text, text[position : position + consumed], self.max_length)
         return consumed, None
 
 
@@ -232,31 +339,50 @@ class StreamParser[ParseType]:
         """
         return ReadUntil(*characters)
 
-    def read_regex(self, regex: str) -> ReadRegex:
+    def read_regex(
+        self, regex: str, max_length: int | None = None, lookbehind: int | None = None
+    ) -> ReadRegex:
         """Search for the matching regex.
 
         Args:
             regex: Regular expression.
+            max_length: Maximum length of a match, or `None` for no maximum.
+            lookbehind: Maximum number of characters from previous reads a match
+                may include, or `None` for `max_length - 1`.
         """
-        return ReadRegex(regex)
+        return ReadRegex(regex, max_length, lookbehind)
 
-    def read_patterns(self, start: str = "", **patterns) -> ReadPattern | ReadPatterns:
+    def read_patterns(
+        self, start: str = "", max_length: int | None = None, **patterns
+    ) -> ReadPattern | ReadPatterns:
         """Read until a pattern matches, or the patterns have been exhausted.
 
         Args:
             start: Initial part of the string.
+            max_length: Maximum length of unconsumed text to keep, or `None` for
+                no maximum.
             **patterns: One or more patterns.
         """
         if len(patterns) == 1:
             name, pattern = patterns.popitem()
-            return ReadPattern(start, name, pattern)
-        return ReadPatterns(start, **patterns)
+            return ReadPattern(start, name, pattern, max_length)
+        return ReadPatterns(start, max_length, **patterns)
 
     def feed(self, text: str) -> Iterable[Token | ParseType]:
-        sequences = text.splitlines(keepends=True)
-        # TODO: Cache
-        for sequence in sequences:
-            yield from self._feed(sequence)
+        """Feed text in to parser.
+
+        The text is parsed in a single scan. Newlines have no special meaning
+        to the parser, and will be handled by the `parse` method like any other
+        character.
+
+        Args:
+            text: Text from stream.
+
+        Returns:
+            A generator of tokens or the parse type.
+        """
+        if text:
+            yield from self._feed(text)
 
     def _feed(self, text: str) -> Iterable[Token | ParseType]:
         """Feed text in to parser.
@@ -287,62 +413,62 @@ class StreamParser[ParseType]:
                 self._gen.close()
                 self._gen = None
 
-        while text:
+        # Offset of the unread text, to avoid slicing the text for every token
+        position = 0
+        text_length = len(text)
+        while position < text_length:
             if isinstance(self._reading, (ReadPattern, ReadPatterns)):
-                consumed, pattern_match = self._reading.feed(text)
+                consumed, pattern_match = self._reading.feed(text, position)
 
                 if pattern_match is not None:
                     name, value = pattern_match
                     yield from send(PatternToken(name, value))
-                    text = text[consumed:]
+                    position += consumed
                 else:
                     if self._reading.is_exhausted:
                         unconsumed_text = self._reading.unconsumed_text
                         yield from send(Token(unconsumed_text))
-                        text = text[consumed:]
+                        position += consumed
                     else:
-                        text = ""
+                        position = text_length
 
             elif isinstance(self._reading, Read):
                 if self._reading.remaining:
-                    read_text = text[: self._reading.remaining]
+                    read_text = text[position : position + self._reading.remaining]
                     read_text_length = len(read_text)
                     self._reading.remaining -= read_text_length
-                    text = text[read_text_length:]
+                    position += read_text_length
                     yield from send(Token(read_text))
                 else:
                     yield from send(Token(""))
 
             elif isinstance(self._reading, ReadUntil):
-                if (match := self._reading._regex.search(text)) is not None:
+                if (match := self._reading._regex.search(text, position)) is not None:
                     start, end = match.span(0)
-                    read_text = text[:start]
 
-                    if read_text:
-                        yield from send(Token(read_text))
-                        text = text[start:]
+                    if start > position:
+                        yield from send(Token(text[position:start]))
+                        position = start
                     else:
                         yield from send(SeparatorToken(text[start:end]))
-                        text = text[end:]
+                        position = end
                 else:
-                    yield from send(Token(text))
-                    text = ""
+                    yield from send(Token(text[position:]))
+                    position = text_length
 
             elif isinstance(self._reading, ReadRegex):
-                self._reading._buffer.write(text)
-                match_text = self._reading._buffer.getvalue()
-                if (
-                    match := re.search(self._reading.regex, match_text, re.VERBOSE)
-                ) is not None:
-                    token_text = match_text[: match.start(0)]
-                    if token_text:
-                        yield from send(Token(token_text))
-                    end = match.end(0)
+                reading = self._reading
+                token_text, match, consumed = reading.feed(text, position)
+                position += consumed
+                if token_text:
+                    yield from send(Token(token_text))
+                if match is not None:
                     yield from send(MatchToken(match.group(0), match))
-                    text = text[end:]
-                else:
-                    yield from send(Token(match_text))
-                    text = ""
+                elif reading is not self._reading and reading.buffer_size:
+                    # The parser issued a new read; give it the unmatched text
+                    text = reading._buffer + text[position:]
+                    text_length = len(text)
+                    position = 0
 
     def parse(self) -> ParseResult[ParseType]:
         yield from ()
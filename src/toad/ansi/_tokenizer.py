@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import re  # Stdlib re, as re2 has a high per-match overhead
+
+from typing import Iterable
+
+import rich.repr
+
+from toad.ansi._metrics import ANSIMetrics, MAX_SEQUENCE_LENGTH
+
+type ANSIToken = tuple[str, str]
+
+TOKENS = re.compile(
+    r"""
+    (?P<content>[^\n\r\x08\x1b]+)
+    |(?P<separator>[\n\r\x08])
+    |\x1b(?:
+        (?P<csi>\[[^\x40-\x7e]*[\x40-\x7e])
+        |(?P<osc>\](?:[^\x07\x9c\x1b]|\x1b+[^\\\x07\x9c\x1b])*(?:\x1b*[\x07\x9c]|\x1b+\\))
+        |(?P<dcs>P(?:[^\x9c\x1b]|\x1b+[^\\\x9c\x1b])*(?:\x1b*\x9c|\x1b+\\))
+        |(?P<dec>[()*+\-./][\s\S])
+        |(?P<dec_invoke>[no~}|NO])
+        |(?P<la>\#[\s\S])
+        |(?P<sp>\ [\s\S])
+        |(?P<control>[^\[\]P()*+\-./\#\ ])
+    )
+    """,
+    re.VERBOSE,
+)
+"""Matches a single token. Incomplete escape sequences won't match."""
+
+DEC_FINAL = frozenset(map(chr, range(0x30, 0x7E + 1)))
+"""Valid final characters in a character set designation."""
+
+
+STRING_TERMINATORS = {
+    "]": re.compile(r"[\x07\x9c]|\x1b\\"),
+    "P": re.compile(r"\x9c|\x1b\\"),
+}
+"""Matches the end of OSC and DCS sequences, keyed on the introducer."""
+
+
+@rich.repr.auto
+class ANSITokenizer:
+    """Splits a stream of text containing escape sequences in to logical tokens.
+
+    Produces the same tokens as `ANSIParser`, but scans whole chunks with a single
+    compiled regular expression, rather than feeding one character at a time
+    through a generator.
+
+    """
+
+    def __init__(self, max_sequence_length: int = MAX_SEQUENCE_LENGTH) -> None:
+        """
+        Args:
+            max_sequence_length: Maximum length of an escape sequence. Longer
+                sequences are discarded.
+        """
+        self.max_sequence_length = max_sequence_length
+        """Maximum length of an escape sequence."""
+        self.metrics = ANSIMetrics()
+        """Counters for notable events."""
+        self._pending = ""
+        """An incomplete escape sequence, from the end of the previous chunk."""
+        self._discarding: str | None = None
+        """Introducer of an oversize OSC or DCS being discarded, or `None`."""
+        self._discard_escape = False
+        """Was the last discarded character an escape?"""
+
+    def __rich_repr__(self) -> rich.repr.Result:
+        yield "pending", self._pending, ""
+        yield "discarding", self._discarding, None
+
+    @property
+    def is_idle(self) -> bool:
+        """Is the tokenizer between escape sequences?"""
+        return not self._pending and self._discarding is None
+
+    @classmethod
+    def _find_terminator(cls, introducer: str, text: str, escaped: bool) -> int | None:
+        """Find the end of an OSC or DCS sequence.
+
+        Args:
+            introducer: Character following the escape (`"]"` or `"P"`).
+            text: Text to search.
+            escaped: Is the text preceded by an escape character?
+
+        Returns:
+            Offset following the terminator, or `None` if there is no terminator.
+        """
+        if escaped and text.startswith("\\"):
+            return 1
+        if (match := STRING_TERMINATORS[introducer].search(text)) is None:
+            return None
+        return match.end()
+
+    def _discard_pending(self) -> None:
+        """Discard a pending OSC or DCS which has exceeded the maximum length.
+
+        The remainder of the sequence will be discarded without buffering.
+        """
+        pending = self._pending
+        self._pending = ""
+        self.metrics.record_oversize(len(pending))
+        self._discarding = pending[1]
+        self._discard_escape = pending.endswith("\x1b")
+
+    def feed(self, text: str) -> Iterable[ANSIToken]:
+        """Feed text in to the tokenizer.
+
+        Args:
+            text: Text from stream.
+
+        Yields:
+            Tuples of token name and token text.
+        """
+        if not text:
+            return
+        if self._discarding is not None:
+            end = self._find_terminator(self._discarding, text, self._discard_escape)
+            if end is None:
+                self.metrics.discarded_characters += len(text)
+                self._discard_escape = text.endswith("\x1b")
+                return
+            self.metrics.discarded_characters += end
+            self._discarding = None
+            text = text[end:]
+
+        if pending := self._pending:
+            self._pending = ""
+            introducer = pending[1:2]
+            if (
+                introducer in STRING_TERMINATORS
+                and self._find_terminator(introducer, text, pending.endswith("\x1b"))
+                is None
+            ):
+                # No need to scan an OSC or DCS until there is a terminator
+                self._pending = pending + text
+                if len(self._pending) > self.max_sequence_length + 1:
+                    self._discard_pending()
+                return
+            text = pending + text
+
+        match_token = TOKENS.match
+        max_sequence_length = self.max_sequence_length
+        position = 0
+        text_length = len(text)
+        while position < text_length:
+            if (match := match_token(text, position)) is None:
+                # Escape sequence is incomplete
+                if text_length - position <= max_sequence_length + 1:
+                    # Wait for more text
+                    self._pending = text[position:]
+                    return
+                if text[position + 1] in STRING_TERMINATORS:
+                    self._pending = text[position:]
+                    self._discard_pending()
+                    return
+                # Abandon the oversize sequence
+                self.metrics.record_oversize(max_sequence_length + 2)
+                position += max_sequence_length + 2
+                continue
+            name = match.lastgroup
+            assert name is not None
+            token_text = match.group(name)
+            if len(token_text) > max_sequence_length and name != "content":
+                if name == "csi":
+                    self.metrics.record_oversize(max_sequence_length + 2)
+                    position += max_sequence_length + 2
+                else:
+                    self.metrics.record_oversize(len(token_text) + 1)
+                    position = match.end()
+                continue
+            position = match.end()
+            if name == "dec" and token_text[1] not in DEC_FINAL:
+                continue
+            yield name, token_text
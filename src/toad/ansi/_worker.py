@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import rich.repr
+
+from toad.ansi._ansi import DamageSpan, TerminalState, merge_damage
+
+PROCESS_SLICE_SIZE = 4096
+"""Maximum characters (or bytes) processed while holding the state lock."""
+
+type Damage = tuple[list[DamageSpan] | None, list[DamageSpan] | None]
+
+
+@rich.repr.auto
+class TerminalWorker:
+    """Processes writes to a terminal state in a dedicated thread.
+
+    Parsing and updating the buffers happens in the worker thread, so the event loop
+    is free to handle input and render. The worker holds `lock` while it updates the
+    state, so anything reading the buffers from another thread (such as a widget
+    rendering lines) should hold it too.
+
+    Writes are processed in slices of `PROCESS_SLICE_SIZE`, so the lock isn't held for
+    the duration of a large write. Replies to the process (which are I/O) are sent
+    from the event loop. Once the worker is closed, the remainder of a write (and any
+    later write) is discarded.
+
+    """
+
+    def __init__(self, state: TerminalState, name: str = "terminal") -> None:
+        """
+        Args:
+            state: Terminal state to update.
+            name: Name of the worker thread.
+        """
+        self.state = state
+        """The terminal state."""
+        self.lock = threading.RLock()
+        """Held while the state is updated."""
+        self._name = name
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix=name)
+        self._closed = False
+
+    def __rich_repr__(self) -> rich.repr.Result:
+        yield self._name
+        yield "closed", self._closed, False
+
+    def _process(self, text: str | bytes, hide_output: bool) -> Damage:
+        """Process text in slices (runs in the worker thread).
+
+        Args:
+            text: Text to write, or UTF-8 encoded bytes (from a PTY).
+            hide_output: Hide visible output from buffers.
+
+        Returns:
+            A pair of updated line spans or `None` for full refresh, for scrollback
+                and alternate screen.
+        """
+        lock = self.lock
+        process = self.state.process
+        scrollback_damage: list[DamageSpan] | None = []
+        alternate_damage: list[DamageSpan] | None = []
+        for offset in range(0, len(text), PROCESS_SLICE_SIZE):
+            with lock:
+                if self._closed:
+                    break
+                scrollback_delta, alternate_delta = process(
+                    text[offset : offset + PROCESS_SLICE_SIZE], hide_output=hide_output
+                )
+            scrollback_damage = merge_damage(scrollback_damage, scrollback_delta)
+            alternate_damage = merge_damage(alternate_damage, alternate_delta)
+        return scrollback_damage, alternate_damage
+
+    async def write(self, text: str | bytes, *, hide_output: bool = False) -> Damage:
+        """Write to the terminal in the worker thread, and send any replies to stdin.
+
+        Args:
+            text: Text to write, or UTF-8 encoded bytes (from a PTY).
+            hide_output: Hide visible output from buffers.
+
+        Returns:
+            A pair of updated line spans or `None` for full refresh, for scrollback
+                and alternate screen.
+        """
+        if self._closed:
+            return [], []
+        damage = await asyncio.get_running_loop().run_in_executor(
+            self._executor, self._process, text, hide_output
+        )
+        await self.state.send_stdin_replies()
+        return damage
+
+    def close(self) -> None:
+        """Stop processing writes, and shut down the worker thread.
+
+        The state won't be updated once this returns.
+
+        """
+        with self.lock:
+            self._closed = True
+        self._executor.shutdown(wait=False)
@@ -136,6 +136,37 @@ SCHEMA: list[SchemaDict] = [
                 "default": 1000,
                 "validate": [{"type": "minimum", "value": 0}],
             },
+            {
+                "key": "scrollback_lines",
+                "title": "Terminal scrollback",
+                "help": "Maximum number of lines kept by each terminal, after which the oldest lines are removed (0 for no limit).",
+                "type": "integer",
+                "default": 10000,
+                "validate": [{"type": "minimum", "value": 0}],
+            },
+            {
+                "key": "terminal_fps",
+                "title": "Terminal frame rate",
+                "help": "Maximum number of times per second a terminal is refreshed while output is streaming (0 to refresh on every write).",
+                "type": "integer",
+                "default": 60,
+                "validate": [{"type": "minimum", "value": 0}],
+            },
+            {
+                "key": "terminal_thread",
+                "title": "Threaded terminals?",
+                "help": "Process terminal output in a thread for each terminal, which keeps the UI responsive while commands write a lot of output.",
+                "type": "boolean",
+                "default": False,
+            },
+            {
+                "key": "terminal_max_sequence",
+                "title": "Maximum escape sequence",
+                "help": "Maximum length of an escape sequence (such as a hyperlink or an inline image) in terminal output. Longer sequences are discarded.",
+                "type": "integer",
+                "default": 65536,
+                "validate": [{"type": "minimum", "value": 1024}],
+            },
         ],
     },
     {
@@ -4,7 +4,6 @@ from __future__ import annotations
 from contextlib import suppress
 import os
 import asyncio
-import codecs
 import fcntl
 import platform
 import pty
@@ -16,7 +15,8 @@ from typing import TYPE_CHECKING
 from textual import log
 from textual.message import Message
 
-from toad.shell_read import shell_read
+from toad.shell_read import ShellReader
+from toad.shell_write import ShellWriter
 
 from toad.widgets.terminal import Terminal
 
@@ -69,6 +69,7 @@ class Shell:
         self.shell_start = start
         self.hide_start = hide_start
         self.master: int | None = None
+        self._writer: ShellWriter | None = None
         self._task: asyncio.Task | None = None
         self._process: asyncio.subprocess.Process | None = None
 
@@ -98,10 +99,7 @@ class Shell:
             self.terminal.finalize()
             self.terminal = None
 
-        try:
-            await asyncio.to_thread(resize_pty, self.master, width, max(height, 1))
-        except OSError:
-            pass
+        self.update_size(width, height)
 
         get_pwd_command = f"{command};" + r'printf "\e]2025;$(pwd);\e\\"' + "\n"
         await self.write(get_pwd_command, hide_echo=True)
@@ -130,7 +128,7 @@ class Shell:
     async def write(
         self, text: str | bytes, hide_echo: bool = False, hide_output: bool = False
     ) -> int:
-        if self.master is None:
+        if self._writer is None:
             return 0
         text_bytes = text.encode("utf-8", "ignore") if isinstance(text, str) else text
 
@@ -138,9 +136,7 @@ class Shell:
             for line in text_bytes.split(b"\n"):
                 if line:
                     self._hide_echo.add(line)
-        try:
-            result = await asyncio.to_thread(os.write, self.master, text_bytes)
-        except OSError:
+        if not (result := await self._writer.write(text_bytes)):
             return 0
         self._hide_output = hide_output
         return result
@@ -153,6 +149,7 @@ class Shell:
 
         flags = fcntl.fcntl(master, fcntl.F_GETFL)
         fcntl.fcntl(master, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        writer = self._writer = await ShellWriter.open(master)
 
         env = os.environ.copy()
         env["FORCE_COLOR"] = "1"
@@ -184,17 +181,12 @@ class Shell:
                 title="Shell",
                 severity="error",
             )
+            writer.close()
             return
 
         os.close(slave)
         BUFFER_SIZE = 64 * 1024
-        reader = asyncio.StreamReader(BUFFER_SIZE)
-        protocol = asyncio.StreamReaderProtocol(reader)
-
-        loop = asyncio.get_event_loop()
-        transport, _ = await loop.connect_read_pipe(
-            lambda: protocol, os.fdopen(master, "rb", 0)
-        )
+        reader = ShellReader(master, BUFFER_SIZE)
 
         self._ready_event.set()
 
@@ -204,10 +196,8 @@ class Shell:
                 shell_start += "\n"
             await self.write(shell_start, hide_echo=False, hide_output=self.hide_start)
 
-        unicode_decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
-
         while True:
-            data = await shell_read(reader, BUFFER_SIZE)
+            data = await reader.read()
 
             for string_bytes in list(self._hide_echo):
                 remove_bytes = string_bytes
@@ -222,7 +212,7 @@ class Shell:
 
                     self._hide_echo.discard(string_bytes)
 
-            if line := unicode_decoder.decode(data, final=not data):
+            if data:
                 if self.terminal is None or self.terminal.is_finalized:
                     previous_state = (
                         None if self.terminal is None else self.terminal.state
@@ -231,9 +221,10 @@ class Shell:
                     # if previous_state is not None:
                     #     self.terminal.set_state(previous_state)
                     self.terminal.set_write_to_stdin(self.write)
+                    self.terminal.read_stats = reader.stats
 
                 terminal_updated = await self.terminal.write(
-                    line, hide_output=self._hide_output
+                    data, hide_output=self._hide_output
                 )
                 if terminal_updated and not self.terminal.display:
                     if (
@@ -258,6 +249,9 @@ class Shell:
             if not data:
                 break
 
+        writer.close()
+        self._writer = None
+        reader.close()
         self.master = None
         self._finished = True
         self.conversation.post_message(ShellFinished())
@@ -1,42 +1,249 @@
 import asyncio
+import os
 from contextlib import suppress
+from dataclasses import dataclass, field
 from time import monotonic
 
+import rich.repr
 
-async def shell_read(
-    reader: asyncio.StreamReader,
-    buffer_size: int,
-    *,
-    buffer_period: float | None = 1 / 100,
-    max_buffer_duration: float = 1 / 60,
-) -> bytes:
-    """Read data from a stream reader, with buffer logic to reduce the number of chunks.
+SMALL_READ_SIZE = 256
+"""Reads up to this many bytes (such as echoed keys) skip batching, unless busy."""
 
-    Args:
-        reader: A reader instance.
-        buffer_size: Maximum buffer size.
-        buffer_period: Time in seconds where reads are batched, or `None` for no batching.
-        max_buffer_duration: Maximum time in seconds to buffer.
+MAX_BUFFER_DURATION = 1 / 20
+"""Default limit for the time to buffer, for a busy stream."""
+
+
+@dataclass
+class ReadStats:
+    """Counters for batches read from a PTY (a profiling aid)."""
+
+    bytes_read: int = 0
+    """Total number of bytes read."""
+    batches: int = 0
+    """Total number of batches."""
+    bytes_per_second: float = 0.0
+    """Bytes per second, over the most recent second with reads."""
+    batches_per_second: float = 0.0
+    """Batches per second, over the most recent second with reads."""
+    _window_start: float = field(default_factory=monotonic, repr=False)
+    _window_bytes: int = field(default=0, repr=False)
+    _window_batches: int = field(default=0, repr=False)
+
+    @property
+    def average_batch_size(self) -> float:
+        """Average number of bytes per batch."""
+        return self.bytes_read / self.batches if self.batches else 0.0
+
+    def record(self, size: int) -> None:
+        """Record a batch.
+
+        Args:
+            size: Number of bytes in the batch.
+        """
+        if not size:
+            return
+        self.bytes_read += size
+        self.batches += 1
+        self._window_bytes += size
+        self._window_batches += 1
+        now = monotonic()
+        if (elapsed := now - self._window_start) >= 1:
+            self.bytes_per_second = self._window_bytes / elapsed
+            self.batches_per_second = self._window_batches / elapsed
+            self._window_start = now
+            self._window_bytes = 0
+            self._window_batches = 0
+
+
+@rich.repr.auto
+class ShellReader:
+    """Reads from a PTY, with buffer logic to reduce the number of chunks.
+
+    The event loop watches the (non-blocking) file descriptor, and data is read
+    directly in to a buffer allocated up front. Reads are batched in place, so
+    building a batch doesn't allocate or copy. Each batch is copied once, to the bytes
+    returned from `read`, as the terminal keeps references to what it is given.
+
+    Reading pauses while the buffer is full, until the next call to `read`.
+
+    Batching adapts to the stream. A small read while the stream is quiet (such as
+    echoed keys) is returned immediately. While the stream is busy, the buffer size
+    doubles each time a batch fills it, and the time to buffer doubles each time a
+    batch takes the full time, up to `max_buffer_size` and `max_buffer_duration`.
+    Both are reset once the stream goes quiet.
 
-    Returns:
-        Bytes read. May be empty on the last read.
     """
-    try:
-        data = await reader.read(buffer_size)
-    except OSError:
-        data = b""
-    if data and buffer_period is not None:
-        buffer_time = monotonic() + max_buffer_duration
-        with suppress(asyncio.TimeoutError):
-            while len(data) < buffer_size and (time := monotonic()) < buffer_time:
-                async with asyncio.timeout(min(buffer_time - time, buffer_period)):
-                    try:
-                        if chunk := await reader.read(buffer_size - len(data)):
-                            data += chunk
-                        else:
-                            break
-                    except OSError as error:
-                        print(repr(error))
-
-                        break
-    return data
+
+    def __init__(
+        self,
+        fd: int,
+        buffer_size: int,
+        *,
+        buffer_period: float | None = 1 / 100,
+        buffer_duration: float = 1 / 60,
+        max_buffer_size: int | None = None,
+        max_buffer_duration: float = MAX_BUFFER_DURATION,
+    ) -> None:
+        """
+        Args:
+            fd: Non-blocking file descriptor to read from. The reader will close it.
+            buffer_size: Initial buffer size.
+            buffer_period: Time in seconds where reads are batched, or `None` for no
+                batching.
+            buffer_duration: Initial maximum time in seconds to buffer.
+            max_buffer_size: Limit for the buffer size while busy, or `None` for four
+                times the initial buffer size.
+            max_buffer_duration: Limit for the time in seconds to buffer while busy.
+        """
+        self.fd = fd
+        self.buffer_size = buffer_size
+        self.buffer_period = buffer_period
+        self.buffer_duration = buffer_duration
+        self.max_buffer_size = (
+            buffer_size * 4 if max_buffer_size is None else max_buffer_size
+        )
+        self.max_buffer_duration = max(buffer_duration, max_buffer_duration)
+        self.stats = ReadStats()
+        """Statistics for the batches read."""
+        self._loop = asyncio.get_running_loop()
+        self._buffer = memoryview(bytearray(buffer_size))
+        """Data read, up to `_size`."""
+        self._size = 0
+        self._batch_size = buffer_size
+        """Current buffer size."""
+        self._batch_duration = buffer_duration
+        """Current maximum time to buffer."""
+        self._busy_time: float | None = None
+        """Time the last busy batch was returned, or `None` if quiet."""
+        self._eof = False
+        self._closed = False
+        self._reading = False
+        self._waiter: asyncio.Future[None] | None = None
+        """Resolved when there is data (or EOF)."""
+        self._resume_reading()
+
+    def __rich_repr__(self) -> rich.repr.Result:
+        yield self.fd
+        yield "buffered", self._size, 0
+        yield "batch_size", self._batch_size
+        yield "batch_duration", self._batch_duration
+        yield "eof", self._eof, False
+
+    @property
+    def is_busy(self) -> bool:
+        """Was the stream still producing data when the last batch was returned?"""
+        return (
+            self._busy_time is not None
+            and monotonic() - self._busy_time < self._batch_duration
+        )
+
+    def _resume_reading(self) -> None:
+        if not (self._reading or self._eof):
+            self._loop.add_reader(self.fd, self._read_ready)
+            self._reading = True
+
+    def _pause_reading(self) -> None:
+        if self._reading:
+            self._loop.remove_reader(self.fd)
+            self._reading = False
+
+    def _wake(self) -> None:
+        if (waiter := self._waiter) is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def _read_ready(self) -> None:
+        """Read in to the buffer, when the file descriptor is readable."""
+        try:
+            size = os.readv(self.fd, [self._buffer[self._size : self._batch_size]])
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            # EIO, once the process has exited
+            size = 0
+        if size:
+            self._size += size
+            if self._size == self._batch_size:
+                self._pause_reading()
+        else:
+            self._eof = True
+            self._pause_reading()
+        self._wake()
+
+    async def _wait(self, timeout: float | None = None) -> None:
+        """Wait for data (or EOF).
+
+        Args:
+            timeout: Maximum time to wait in seconds, or `None` for no limit.
+        """
+        self._waiter = waiter = self._loop.create_future()
+        try:
+            async with asyncio.timeout(timeout):
+                await waiter
+        finally:
+            self._waiter = None
+
+    async def _batch(self, buffer_period: float) -> None:
+        """Wait for more data, and adapt the batching to the stream.
+
+        Args:
+            buffer_period: Time in seconds to wait for each read.
+        """
+        buffer_time = monotonic() + self._batch_duration
+        quiet = False
+        while (
+            not self._eof
+            and self._size < self._batch_size
+            and (time := monotonic()) < buffer_time
+        ):
+            try:
+                await self._wait(min(buffer_time - time, buffer_period))
+            except asyncio.TimeoutError:
+                quiet = monotonic() < buffer_time
+                break
+
+        if quiet or self._eof:
+            self._busy_time = None
+            self._batch_size = self.buffer_size
+            self._batch_duration = self.buffer_duration
+            return
+        self._busy_time = monotonic()
+        if self._size >= self._batch_size:
+            self._batch_size = min(self._batch_size * 2, self.max_buffer_size)
+        else:
+            self._batch_duration = min(
+                self._batch_duration * 2, self.max_buffer_duration
+            )
+
+    async def read(self) -> bytes:
+        """Read a batch of data.
+
+        Returns:
+            Bytes read. May be empty on the last read.
+        """
+        if not (self._size or self._eof):
+            await self._wait()
+        if (
+            self._size
+            and self.buffer_period is not None
+            and (self._size > SMALL_READ_SIZE or self.is_busy)
+        ):
+            await self._batch(self.buffer_period)
+        data = bytes(self._buffer[: self._size])
+        self._size = 0
+        if len(self._buffer) < self._batch_size:
+            # Grown while busy (the buffer is empty, so there is nothing to copy)
+            self._buffer = memoryview(bytearray(self._batch_size))
+        self.stats.record(len(data))
+        self._resume_reading()
+        return data
+
+    def close(self) -> None:
+        """Stop reading, and close the file descriptor."""
+        if self._closed:
+            return
+        self._pause_reading()
+        self._closed = True
+        self._eof = True
+        with suppress(OSError):
+            os.close(self.fd)
+        self._wake()
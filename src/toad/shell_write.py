@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import asyncio
+import os
+
+import rich.repr
+
+WRITE_HIGH_WATER = 64 * 1024
+"""Buffered bytes at which writes wait for the buffer to drain."""
+
+
+@rich.repr.auto
+class ShellWriter(asyncio.BaseProtocol):
+    """Writes to a PTY with a non-blocking write transport.
+
+    Writes are attempted immediately from the event loop, and anything the PTY won't
+    accept is buffered by the transport, and written in order once it is writable.
+    When the buffer exceeds the high water mark, `write` waits for it to drain.
+
+    Create with `ShellWriter.open`.
+
+    """
+
+    def __init__(self, high_water: int = WRITE_HIGH_WATER) -> None:
+        """
+        Args:
+            high_water: Buffered bytes at which writes wait for the buffer to drain.
+        """
+        self.high_water = high_water
+        self._transport: asyncio.WriteTransport | None = None
+        self._paused = False
+        self._closed = False
+        self._drain_waiter: asyncio.Future[None] | None = None
+
+    def __rich_repr__(self) -> rich.repr.Result:
+        yield "paused", self._paused, False
+        yield "closed", self._closed, False
+
+    @classmethod
+    async def open(cls, fd: int, high_water: int = WRITE_HIGH_WATER) -> ShellWriter:
+        """Open a writer for a PTY.
+
+        Args:
+            fd: File descriptor of the PTY. It is duplicated, so the caller may close
+                it independently of the writer.
+            high_water: Buffered bytes at which writes wait for the buffer to drain.
+
+        Returns:
+            A new writer.
+        """
+        writer = cls(high_water)
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.connect_write_pipe(
+            lambda: writer, os.fdopen(os.dup(fd), "wb", 0)
+        )
+        transport.set_write_buffer_limits(high=high_water)
+        return writer
+
+    @property
+    def is_closed(self) -> bool:
+        """Is the writer closed (or the PTY no longer writable)?"""
+        return self._closed
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        assert isinstance(transport, asyncio.WriteTransport)
+        self._transport = transport
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        self._closed = True
+        self._wake()
+
+    def pause_writing(self) -> None:
+        self._paused = True
+
+    def resume_writing(self) -> None:
+        self._paused = False
+        self._wake()
+
+    def _wake(self) -> None:
+        if (waiter := self._drain_waiter) is not None and not waiter.done():
+            waiter.set_result(None)
+
+    async def write(self, data: bytes) -> int:
+        """Write to the PTY, waiting if the buffer is over the high water mark.
+
+        Args:
+            data: Bytes to write.
+
+        Returns:
+            Number of bytes written (or buffered), or 0 if the writer is closed.
+        """
+        transport = self._transport
+        if transport is None or self._closed or transport.is_closing():
+            return 0
+        transport.write(data)
+        while self._paused and not self._closed:
+            self._drain_waiter = waiter = asyncio.get_running_loop().create_future()
+            try:
+                await waiter
+            finally:
+                self._drain_waiter = None
+        return 0 if self._closed else len(data)
+
+    def close(self) -> None:
+        """Close the writer, discarding anything buffered."""
+        if self._transport is not None and not self._closed:
+            self._transport.abort()
+        self._closed = True
+        self._wake()
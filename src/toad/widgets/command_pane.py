@@ -1,5 +1,4 @@
 import asyncio
-import codecs
 from dataclasses import dataclass
 
 import os
@@ -12,7 +11,8 @@ import termios
 from textual import events
 from textual.message import Message
 
-from toad.shell_read import shell_read
+from toad.shell_read import ShellReader
+from toad.shell_write import ShellWriter
 
 from toad.widgets.terminal import Terminal
 
@@ -39,6 +39,7 @@ class CommandPane(Terminal):
         self._execute_task: asyncio.Task | None = None
         self._return_code: int | None = None
         self._master: int | None = None
+        self._writer: ShellWriter | None = None
         super().__init__(name=name, id=id, classes=classes)
 
     @property
@@ -81,13 +82,10 @@ class CommandPane(Terminal):
         return bool(lflag & termios.ICANON)
 
     async def write_stdin(self, text: str | bytes, hide_echo: bool = False) -> int:
-        if self._master is None:
+        if self._writer is None:
             return 0
         text_bytes = text.encode("utf-8", "ignore") if isinstance(text, str) else text
-        try:
-            return await asyncio.to_thread(os.write, self._master, text_bytes)
-        except OSError:
-            return 0
+        return await self._writer.write(text_bytes)
 
     async def _execute(self, command: str, *, final: bool = True) -> None:
         # width, height = self.scrollable_content_region.size
@@ -130,32 +128,21 @@ class CommandPane(Terminal):
 
         self._size_changed()
 
+        writer = self._writer = await ShellWriter.open(master)
         self.set_write_to_stdin(self.write_stdin)
 
         BUFFER_SIZE = 64 * 1024
-        reader = asyncio.StreamReader(BUFFER_SIZE)
-        protocol = asyncio.StreamReaderProtocol(reader)
-
-        loop = asyncio.get_event_loop()
-        transport, _ = await loop.connect_read_pipe(
-            lambda: protocol, os.fdopen(master, "rb", 0)
-        )
-
-        # Create write transport
-        writer_protocol = asyncio.BaseProtocol()
-        self.write_transport, _ = await loop.connect_write_pipe(
-            lambda: writer_protocol,
-            os.fdopen(os.dup(master), "wb", 0),
-        )
-        unicode_decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        reader = ShellReader(master, BUFFER_SIZE)
+        self.read_stats = reader.stats
+
         try:
             while True:
-                data = await shell_read(reader, BUFFER_SIZE)
-                if line := unicode_decoder.decode(data, final=not data):
+                data = await reader.read()
+                if data:
                     try:
-                        await self.write(line)
+                        await self.write(data)
                     except Exception as error:
-                        print(repr(line))
+                        print(repr(data))
                         print(error)
                         from traceback import print_exc
 
@@ -164,7 +151,8 @@ class CommandPane(Terminal):
                 if not data:
                     break
         finally:
-            transport.close()
+            writer.close()
+            reader.close()
 
         await process.wait()
         return_code = self._return_code = process.returncode
@@ -1021,6 +1021,10 @@ class Conversation(containers.Vertical):
             output_byte_limit=message.output_byte_limit,
             id=message.terminal_id,
             minimum_terminal_width=width,
+            scrollback_lines=self.app.settings.get("ui.scrollback_lines", int) or None,
+            max_fps=self.app.settings.get("ui.terminal_fps", int),
+            threaded=self.app.settings.get("ui.terminal_thread", bool),
+            max_sequence_length=self.app.settings.get("ui.terminal_max_sequence", int),
         )
         self.terminals[message.terminal_id] = terminal
         terminal.display = False
@@ -1466,6 +1470,10 @@ class Conversation(containers.Vertical):
             id=f"shell-terminal-{self._terminal_count}",
             size=(terminal_width, terminal_height),
             get_terminal_dimensions=self.get_terminal_dimensions,
+            scrollback_lines=self.app.settings.get("ui.scrollback_lines", int) or None,
+            max_fps=self.app.settings.get("ui.terminal_fps", int),
+            threaded=self.app.settings.get("ui.terminal_thread", bool),
+            max_sequence_length=self.app.settings.get("ui.terminal_max_sequence", int),
         )
 
         terminal.display = False
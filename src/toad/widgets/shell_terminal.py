@@ -34,7 +34,8 @@ class ShellTerminal(Terminal):
             yield MenuItem("Focus", f"focus_block({self.id!r})", "f")
 
     def get_block_content(self, destination: str) -> str | None:
-        return "\n".join(line.content.plain for line in self.state.buffer.lines)
+        with self._state_lock:
+            return self.state.buffer.text
 
     def on_mount(self) -> None:
         self.border_title = Content(self.name)
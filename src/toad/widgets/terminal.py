@@ -1,12 +1,17 @@
-from dataclasses import dataclass
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
 
+from threading import RLock
 from time import monotonic
-from typing import Awaitable, Callable, Iterable
+from typing import Awaitable, Callable, Iterable, NamedTuple
 
-from textual.cache import LRUCache
+from rich.cells import cell_len
+from rich.segment import Segment
+from rich.style import Style as RichStyle
 
 from textual import on
 from textual import events
+from textual.content import Content
 from textual.css.query import NoMatches
 from textual.message import Message
 from textual.reactive import reactive
@@ -19,11 +24,155 @@ from textual.timer import Timer
 
 from toad import ansi
 from toad.menus import MenuItem
-
+from toad.shell_read import ReadStats
 
 # Time required to double tab escape
 ESCAPE_TAP_DURATION = 400 / 1000
 
+MAX_FPS = 60
+"""Default maximum number of refreshes per second, while output is being written."""
+
+STRIP_CACHE_BYTES = 4 * 1024 * 1024
+"""Default budget for the strip cache (estimated bytes)."""
+STRIP_SIZE = 200
+"""Estimated size of a strip, not including its segments."""
+SEGMENT_SIZE = 120
+"""Estimated size of a segment, not including its text."""
+
+
+@dataclass
+class RefreshMetrics:
+    """Counters for rows refreshed by a terminal (a profiling aid)."""
+
+    refreshes: int = 0
+    """Number of updates which refreshed rows."""
+    refreshed_rows: int = 0
+    """Total number of rows refreshed."""
+    rows_per_second: float = 0.0
+    """Rows refreshed per second, over the most recent second with refreshes."""
+    _window_start: float = field(default_factory=monotonic, repr=False)
+    _window_rows: int = field(default=0, repr=False)
+
+    def record(self, rows: int) -> None:
+        """Record refreshed rows.
+
+        Args:
+            rows: Number of rows refreshed.
+        """
+        if not rows:
+            return
+        self.refreshes += 1
+        self.refreshed_rows += rows
+        self._window_rows += rows
+        now = monotonic()
+        if (elapsed := now - self._window_start) >= 1:
+            self.rows_per_second = self._window_rows / elapsed
+            self._window_start = now
+            self._window_rows = 0
+
+
+class StripCacheInfo(NamedTuple):
+    """Statistics for a strip cache."""
+
+    hits: int
+    """Number of lookups found in the cache."""
+    misses: int
+    """Number of lookups not found in the cache."""
+    size: int
+    """Number of strips in the cache."""
+    bytes: int
+    """Estimated size of the strips in the cache."""
+    max_bytes: int
+    """Budget for the cache."""
+
+    @property
+    def hit_rate(self) -> float:
+        """Proportion of lookups found in the cache."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class StripCache:
+    """A least recently used cache of rendered lines, with a budget in bytes.
+
+    Strips are keyed on the identity of the content they were rendered from, so a line
+    is found wherever it is in the buffer, and after a resize if it didn't refold. The
+    content is stored with the strip, so its id can't be reused while it is cached.
+    Strips with a selection drawn over them are keyed on the selected span as well.
+
+    Sizes are estimated from the number of segments, and the length of their text.
+
+    """
+
+    def __init__(self, max_bytes: int = STRIP_CACHE_BYTES) -> None:
+        """
+        Args:
+            max_bytes: Budget for the cache.
+        """
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._bytes = 0
+        self._strips: OrderedDict[
+            int | tuple[int, int, int], tuple[Content, Strip, int]
+        ] = OrderedDict()
+        """Maps a content id (and selection) on to the content, its strip, and size."""
+
+    @property
+    def info(self) -> StripCacheInfo:
+        """Cache statistics."""
+        return StripCacheInfo(
+            self.hits, self.misses, len(self._strips), self._bytes, self.max_bytes
+        )
+
+    def get(
+        self, content: Content, selection: tuple[int, int] | None = None
+    ) -> Strip | None:
+        """Get the strip rendered from the given content.
+
+        Args:
+            content: Content of a folded line.
+            selection: Span of selected characters, or `None` for no selection.
+
+        Returns:
+            A strip, or `None` if it isn't cached.
+        """
+        key = id(content) if selection is None else (id(content), *selection)
+        if (cached := self._strips.get(key)) is None or cached[0] is not content:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._strips.move_to_end(key)
+        return cached[1]
+
+    def set(
+        self,
+        content: Content,
+        strip: Strip,
+        selection: tuple[int, int] | None = None,
+    ) -> None:
+        """Store a strip, discarding the least recently used strips as required.
+
+        Args:
+            content: Content the strip was rendered from.
+            strip: Rendered strip.
+            selection: Span of selected characters, or `None` for no selection.
+        """
+        key = id(content) if selection is None else (id(content), *selection)
+        strips = self._strips
+        if (previous := strips.pop(key, None)) is not None:
+            self._bytes -= previous[2]
+        size = STRIP_SIZE + sum(SEGMENT_SIZE + len(text) for text, _, _ in strip)
+        strips[key] = (content, strip, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes and strips:
+            self._bytes -= strips.popitem(last=False)[1][2]
+
+    def clear(self) -> None:
+        """Discard every strip (statistics are kept)."""
+        self._strips.clear()
+        self._bytes = 0
+
 
 class Terminal(ScrollView, can_focus=True):
     BINDING_GROUP_TITLE = "Terminal"
@@ -81,6 +230,10 @@ Tap escape *twice* to exit.
         minimum_terminal_width: int = 0,
         size: tuple[int, int] | None = None,
         get_terminal_dimensions: Callable[[], tuple[int, int]] | None = None,
+        scrollback_lines: int | None = None,
+        max_fps: float = MAX_FPS,
+        threaded: bool = False,
+        max_sequence_length: int = ansi.MAX_SEQUENCE_LENGTH,
     ):
         super().__init__(
             name=name,
@@ -92,7 +245,22 @@ Tap escape *twice* to exit.
         self.minimum_terminal_width = minimum_terminal_width
         self._get_terminal_dimensions = get_terminal_dimensions
 
-        self.state = ansi.TerminalState(self.write_process_stdin)
+        self.state = ansi.TerminalState(
+            self.write_process_stdin,
+            scrollback_lines=scrollback_lines,
+            max_sequence_length=max_sequence_length,
+            # A worker thread gets its own SGR parser, rather than contending for the
+            # caches of the shared parser
+            sgr_parser=ansi.SGRParser() if threaded else None,
+        )
+        self._worker = (
+            ansi.TerminalWorker(self.state, name=id or name or "terminal")
+            if threaded
+            else None
+        )
+        """Updates the state in a thread, if the terminal is threaded."""
+        self._state_lock = RLock() if self._worker is None else self._worker.lock
+        """Held while reading or updating the state's buffers."""
 
         if size is None:
             self._width = minimum_terminal_width or 80
@@ -111,10 +279,23 @@ Tap escape *twice* to exit.
         self._finalized: bool = False
         self.current_directory: str | None = None
         self._alternate_screen: bool = False
-        self._terminal_render_cache: LRUCache[tuple, Strip] = LRUCache(1024)
+        self._terminal_render_cache = StripCache()
         self._write_to_stdin: Callable[[str], Awaitable] | None = None
         self._write_count = 0
         self._long_running_timer: Timer | None = None
+        self._reflowing = False
+        self.refresh_metrics = RefreshMetrics()
+        """Counters for refreshed rows."""
+        self.read_stats: ReadStats | None = None
+        """Statistics for reads from a PTY, if output is read with a `ShellReader`."""
+        self.max_fps = max_fps
+        """Maximum refreshes per second while writing, or 0 to refresh every write."""
+        self._pending_damage: (
+            tuple[list[ansi.DamageSpan] | None, list[ansi.DamageSpan] | None] | None
+        ) = None
+        """Damage from writes yet to be refreshed (scrollback, alternate)."""
+        self._last_refresh_time = 0.0
+        self._refresh_timer: Timer | None = None
 
     @property
     def is_finalized(self) -> bool:
@@ -140,6 +321,11 @@ Tap escape *twice* to exit.
     def alternate_screen(self) -> bool:
         return self._alternate_screen
 
+    @property
+    def strip_cache_info(self) -> StripCacheInfo:
+        """Statistics for the cache of rendered lines."""
+        return self._terminal_render_cache.info
+
     def notify_style_update(self) -> None:
         """Clear cache when theme chages."""
         self._terminal_render_cache.clear()
@@ -151,7 +337,10 @@ Tap escape *twice* to exit.
         Args:
             state: Terminal state object.
         """
-        self.state = state
+        with self._state_lock:
+            self.state = state
+            if self._worker is not None:
+                self._worker.state = state
 
     def set_write_to_stdin(self, write_to_stdin: Callable[[str], Awaitable]) -> None:
         """Set a callable which is invoked with input, to be sent to stdin.
@@ -170,8 +359,16 @@ Tap escape *twice* to exit.
         if not self._finalized:
             if self._long_running_timer is not None:
                 self._long_running_timer.stop()
+            if self._worker is not None:
+                self._worker.close()
             self._finalized = True
+            self._refresh_damage()
             self.state.show_cursor = False
+            if (metrics := self.state.metrics).oversize_sequences:
+                self.log.warning(
+                    f"{self!r} discarded {metrics.oversize_sequences} oversize "
+                    f"escape sequence(s) ({metrics.discarded_characters} characters)"
+                )
             self.add_class("-finalized")
             self._terminal_render_cache.clear()
             self.refresh()
@@ -180,6 +377,10 @@ Tap escape *twice* to exit.
 
             if not self.state.buffer.height:
                 self.remove()
+            else:
+                # The terminal won't change again, so pack its lines in to less memory
+                with self._state_lock:
+                    self.state.compact()
 
     def allow_focus(self) -> bool:
         """Prohibit focus when the terminal is finalized and couldn't accept input."""
@@ -194,9 +395,8 @@ Tap escape *twice* to exit.
         Returns:
             Tuple of extracted text and ending (typically "\n" or " "), or `None` if no text could be extracted.
         """
-        text = "\n".join(
-            line_record.content.plain for line_record in self.state.buffer.lines
-        )
+        with self._state_lock:
+            text = self.state.buffer.text
         return selection.extract(text), "\n"
 
     def _on_resize(self, event: events.Resize) -> None:
@@ -210,7 +410,6 @@ Tap escape *twice* to exit.
         old_width = self._width
         old_height = self._height
 
-        self._terminal_render_cache.grow(height * 2)
         self._width = width or 80
         self._height = height or 24
         self._width = max(self._width, self.minimum_terminal_width)
@@ -229,9 +428,48 @@ Tap escape *twice* to exit.
             else:
                 conversation.shell.update_size(self._width, self._height)
 
-        self.state.update_size(self._width, height)
-        self._terminal_render_cache.clear()
+        with self._state_lock:
+            self.state.update_size(self._width, height)
         self.refresh()
+        if self.state.reflow_pending and not self._reflowing:
+            self._reflowing = True
+            self.call_later(self._continue_reflow)
+
+    def _continue_reflow(self) -> None:
+        """Refold a batch of lines folded to a previous width, then yield."""
+        with self._state_lock:
+            reflowing = self._reflow_batch()
+        if reflowing:
+            self.call_later(self._continue_reflow)
+        else:
+            self._reflowing = False
+
+    def _reflow_batch(self) -> bool:
+        """Refold a batch of lines, keeping the lines in view in place.
+
+        Returns:
+            `True` if there are more lines to reflow.
+        """
+        state = self.state
+        buffer = state.scrollback_buffer
+        folded_lines = buffer.folded_lines
+        scroll_y = int(self.scroll_y)
+        anchor: tuple[int, int] | None = None
+        if (
+            (not self._anchored or self._anchor_released)
+            and not state.alternate_screen
+            and scroll_y < len(folded_lines)
+        ):
+            # Refold the lines in view first, and keep them in view
+            state.reflow_folded_lines(buffer, scroll_y, scroll_y + self.size.height)
+            anchor = folded_lines.locate(scroll_y)
+        reflowing = state.continue_reflow()
+        if anchor is not None:
+            line_no, fold_offset = anchor
+            fold_offset = min(fold_offset, len(buffer.lines[line_no].folds) - 1)
+            self.scroll_y = folded_lines.line_start(line_no) + fold_offset
+        self._update_from_state(None, None)
+        return reflowing
 
     def on_mount(self) -> None:
         self.anchor()
@@ -241,16 +479,22 @@ Tap escape *twice* to exit.
             width, height = self._get_terminal_dimensions()
         self.update_size(width, height)
 
-    async def write(self, text: str, hide_output: bool = False) -> bool:
+    def on_unmount(self) -> None:
+        if self._worker is not None:
+            self._worker.close()
+
+    async def write(self, text: str | bytes, hide_output: bool = False) -> bool:
         """Write sequences to the terminal.
 
         Args:
-            text: Text with ANSI escape sequences.
+            text: Text with ANSI escape sequences, or UTF-8 encoded bytes.
             hide_output: Do not update the buffers with visible text.
 
         Returns:
             `True` if the state visuals changed, `False` if no visual change.
         """
+        if self.is_finalized:
+            return False
         if self._write_count and self._long_running_timer is None:
 
             def warn_long_run():
@@ -260,10 +504,24 @@ Tap escape *twice* to exit.
             self._long_running_timer = self.set_timer(2, warn_long_run)
         self._write_count += 1
 
-        scrollback_delta, alternate_delta = await self.state.write(
+        trimmed_folded_lines = self.state.scrollback_buffer.trimmed_folded_lines
+        writer = self.state if self._worker is None else self._worker
+        scrollback_delta, alternate_delta = await writer.write(
             text, hide_output=hide_output
         )
-        self._update_from_state(scrollback_delta, alternate_delta)
+        self._add_damage(scrollback_delta, alternate_delta)
+        if self.state.current_directory:
+            # The shell reports the directory once a command has finished. Finalize
+            # now rather than on the next refresh (which may be deferred), as the
+            # shell reads `current_directory` and `is_finalized` when the write returns.
+            self.current_directory = self.state.current_directory
+            self.finalize()
+        if trimmed := (
+            self.state.scrollback_buffer.trimmed_folded_lines - trimmed_folded_lines
+        ):
+            if not self._anchored or self._anchor_released:
+                # Keep the same lines in view, when scrolled back
+                self.scroll_y = max(0, self.scroll_y - trimmed)
         scrollback_changed = bool(scrollback_delta is None or scrollback_delta)
         alternate_changed = bool(alternate_delta is None or alternate_delta)
 
@@ -278,12 +536,55 @@ Tap escape *twice* to exit.
         self.focus()
         event.stop()
 
+    def _add_damage(
+        self,
+        scrollback_delta: list[ansi.DamageSpan] | None,
+        alternate_delta: list[ansi.DamageSpan] | None,
+    ) -> None:
+        """Add damage from a write, and refresh if a frame is due.
+
+        Refreshes are limited to `max_fps` per second. The first write after a quiet
+        period refreshes immediately. Further writes within the frame accumulate damage,
+        which is refreshed by a timer at the start of the next frame.
+
+        Args:
+            scrollback_delta: Updated scrollback lines, or `None` for all lines.
+            alternate_delta: Updated alternate screen lines, or `None` for all lines.
+        """
+        if (pending_damage := self._pending_damage) is None:
+            self._pending_damage = (scrollback_delta, alternate_delta)
+        else:
+            self._pending_damage = (
+                ansi.merge_damage(pending_damage[0], scrollback_delta),
+                ansi.merge_damage(pending_damage[1], alternate_delta),
+            )
+        if self._refresh_timer is not None:
+            return
+        delay = 0.0
+        if self.max_fps > 0:
+            delay = self._last_refresh_time + 1 / self.max_fps - monotonic()
+        if delay > 0:
+            self._refresh_timer = self.set_timer(delay, self._refresh_damage)
+        else:
+            self._refresh_damage()
+
+    def _refresh_damage(self) -> None:
+        """Refresh the damage accumulated from writes."""
+        if self._refresh_timer is not None:
+            self._refresh_timer.stop()
+            self._refresh_timer = None
+        if (pending_damage := self._pending_damage) is None:
+            return
+        self._pending_damage = None
+        self._last_refresh_time = monotonic()
+        with self._state_lock:
+            self._update_from_state(*pending_damage)
+
     def _update_from_state(
-        self, scrollback_delta: set[int] | None, alternate_delta: set[int] | None
+        self,
+        scrollback_delta: list[ansi.DamageSpan] | None,
+        alternate_delta: list[ansi.DamageSpan] | None,
     ) -> None:
-        if self.state.current_directory:
-            self.current_directory = self.state.current_directory
-            self.finalize()
         width = self.state.width
         height = self.state.scrollback_buffer.height
 
@@ -294,46 +595,48 @@ Tap escape *twice* to exit.
             self.scroll_y = self.max_scroll_y
 
         scroll_y = int(self.scroll_y)
-        visible_lines = frozenset(range(scroll_y, scroll_y + height))
+        window_width, window_height = self.region.size
 
         if scrollback_delta is None and alternate_delta is None:
             self.refresh()
-        else:
-            window_width = self.region.width
-            scrollback_height = self.state.scrollback_buffer.height
-            if scrollback_delta is None:
-                self.refresh(Region(0, 0, window_width, scrollback_height))
-            else:
-                refresh_lines = [
-                    Region(0, y - scroll_y, window_width, 1)
-                    for y in sorted(scrollback_delta & visible_lines)
-                ]
-                if refresh_lines:
-                    self.refresh(*refresh_lines)
-            alternate_height = self.state.alternate_buffer.height
-            if alternate_delta is None:
-                self.refresh(
-                    Region(
-                        0,
-                        scrollback_height - scroll_y,
-                        window_width,
-                        scrollback_height + alternate_height,
-                    )
-                )
-            else:
-                alternate_delta = {
-                    line_no + scrollback_height for line_no in alternate_delta
-                }
-                refresh_lines = [
-                    Region(0, y - scroll_y, window_width, 1)
-                    for y in sorted(alternate_delta & visible_lines)
+            self.refresh_metrics.record(window_height)
+            return
+
+        scrollback_height = self.state.scrollback_buffer.height
+        if scrollback_delta is None:
+            scrollback_delta = [ansi.DamageSpan(0, scrollback_height)]
+        if alternate_delta is None:
+            alternate_delta = [ansi.DamageSpan(0, self.state.alternate_buffer.height)]
+        # Clip spans to the window, and merge spans which touch
+        window_end = scroll_y + window_height
+        refresh_spans: list[tuple[int, int]] = []
+        for line_offset, delta in (
+            (0, scrollback_delta),
+            (scrollback_height, alternate_delta),
+        ):
+            for start, end in delta:
+                start = max(scroll_y, start + line_offset)
+                end = min(window_end, end + line_offset)
+                if start >= end:
+                    continue
+                if refresh_spans and refresh_spans[-1][1] == start:
+                    start = refresh_spans.pop()[0]
+                refresh_spans.append((start, end))
+        if refresh_spans:
+            self.refresh(
+                *[
+                    Region(0, start - scroll_y, window_width, end - start)
+                    for start, end in refresh_spans
                 ]
-                if refresh_lines:
-                    self.refresh(*refresh_lines)
+            )
+            self.refresh_metrics.record(
+                sum(end - start for start, end in refresh_spans)
+            )
 
     def render_line(self, y: int) -> Strip:
         scroll_x, scroll_y = self.scroll_offset
-        strip = self._render_line(scroll_x, scroll_y + y, self._width)
+        with self._state_lock:
+            strip = self._render_line(scroll_x, scroll_y + y, self._width)
         return strip
 
     def on_focus(self) -> None:
@@ -362,65 +665,31 @@ Tap escape *twice* to exit.
             return Strip.blank(width, rich_style)
 
         line_record = buffer.lines[line_no]
-        cache_key: tuple | None = (
-            self.state.alternate_screen,
-            y,
-            line_record.updates,
-            updates,
-        )
-
-        # Add in cursor
+        cursor_offset: int | None = None
         if (
             not self.hide_cursor
             and state.show_cursor
             and buffer.cursor_line == y - buffer_offset
         ):
-            if buffer.cursor_offset >= len(line):
-                line = line.pad_right(buffer.cursor_offset - len(line) + 1)
-            line_cursor_offset = buffer.cursor_offset
-            line = line.stylize(
-                self.CURSOR_STYLE, line_cursor_offset, line_cursor_offset + 1
-            )
-            cache_key = None
+            cursor_offset = buffer.cursor_offset
 
-        # get cached strip if there is no selection
-        if (
-            not selection
-            and cache_key is not None
-            and (strip := self._terminal_render_cache.get(cache_key))
-        ):
-            strip = strip.crop(x, x + width)
-            strip = strip.adjust_cell_length(
-                width, (visual_style + line_record.style).rich_style
-            )
-            strip = strip.apply_offsets(x + offset, line_no)
-            return strip
+        strip = self._terminal_render_cache.get(line)
+        if strip is None:
+            try:
+                strip = Strip(
+                    line.render_segments(visual_style), cell_length=line.cell_length
+                )
+            except Exception:
+                # TODO: Is this neccesary?
+                strip = Strip.blank(line.cell_length)
+            self._terminal_render_cache.set(line, strip)
 
         # Apply selection
         if selection is not None and (select_span := selection.get_span(line_no)):
-            unfolded_content = line_record.content.expand_tabs(8)
-            start, end = select_span
-            if end == -1:
-                end = len(unfolded_content)
-            selection_style = self.screen.get_visual_style("screen--selection")
-            unfolded_content = unfolded_content.stylize(selection_style, start, end)
-            try:
-                folded_lines = self.state._fold_line(line_no, unfolded_content, width)
-                line = folded_lines[line_offset].content
-                cache_key = None
-            except IndexError:
-                pass
+            strip = self._overlay_selection(strip, line, offset, select_span)
 
-        try:
-            strip = Strip(
-                line.render_segments(visual_style), cell_length=line.cell_length
-            )
-        except Exception:
-            # TODO: Is this neccesary?
-            strip = Strip.blank(line.cell_length)
-
-        if cache_key is not None:
-            self._terminal_render_cache[cache_key] = strip
+        if cursor_offset is not None:
+            strip = self._overlay_cursor(strip, line, cursor_offset)
 
         strip = strip.crop(x, x + width)
         strip = strip.adjust_cell_length(
@@ -430,6 +699,87 @@ Tap escape *twice* to exit.
 
         return strip
 
+    @classmethod
+    def _overlay_style(
+        cls, strip: Strip, start: int, end: int, style: RichStyle
+    ) -> Strip:
+        """Apply a style over a range of cells in a strip.
+
+        Args:
+            strip: A strip.
+            start: First cell.
+            end: Cell following the last cell.
+            style: Style to apply over the existing styles.
+
+        Returns:
+            A new strip.
+        """
+        before, middle, after = strip.divide([start, end, strip.cell_length])
+        middle = Strip(
+            Segment.apply_style(middle, post_style=style), middle.cell_length
+        )
+        return Strip.join([before, middle, after])
+
+    def _overlay_selection(
+        self, strip: Strip, line: Content, offset: int, select_span: tuple[int, int]
+    ) -> Strip:
+        """Draw the selection over a rendered line.
+
+        Args:
+            strip: Strip rendered from the line.
+            line: Content of the (folded) line.
+            offset: Offset of the folded line within the (unfolded) line.
+            select_span: Selected span of the unfolded line, with an end of -1 to
+                select to the end of the line.
+
+        Returns:
+            A new strip.
+        """
+        plain = line.plain
+        start, end = select_span
+        start = max(0, start - offset)
+        end = len(plain) if end == -1 else min(len(plain), end - offset)
+        if start >= end:
+            return strip
+        cache = self._terminal_render_cache
+        if (selected_strip := cache.get(line, (start, end))) is not None:
+            return selected_strip
+        selection_style = self.screen.get_visual_style("screen--selection")
+        if (foreground := selection_style.foreground) is not None and not foreground.a:
+            # A transparent foreground leaves the text color as it is
+            selection_style = replace(selection_style, foreground=None)
+        start_cell = cell_len(plain[:start])
+        end_cell = start_cell + cell_len(plain[start:end])
+        selected_strip = self._overlay_style(
+            strip, start_cell, end_cell, selection_style.rich_style
+        )
+        cache.set(line, selected_strip, (start, end))
+        return selected_strip
+
+    def _overlay_cursor(self, strip: Strip, line: Content, cursor_offset: int) -> Strip:
+        """Draw the cursor over a rendered line.
+
+        Args:
+            strip: Strip rendered from the line.
+            line: Content of the (folded) line.
+            cursor_offset: Offset of the cursor within the line.
+
+        Returns:
+            A new strip.
+        """
+        plain = line.plain
+        if cursor_offset < len(plain):
+            cursor_start = cell_len(plain[:cursor_offset])
+            cursor_end = cursor_start + cell_len(plain[cursor_offset])
+        else:
+            # Cursor is past the end of the line
+            cursor_start = line.cell_length + cursor_offset - len(plain)
+            cursor_end = cursor_start + 1
+            strip = strip.extend_cell_length(cursor_end, self.visual_style.rich_style)
+        return self._overlay_style(
+            strip, cursor_start, cursor_end, self.CURSOR_STYLE.rich_style
+        )
+
     async def _reset_escaping(self) -> None:
         if self._escaping:
             await self.write_process_stdin(self.state.key_escape())
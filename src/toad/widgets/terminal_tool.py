@@ -2,7 +2,6 @@ from __future__ import annotations
 
 import asyncio
 from asyncio.subprocess import Process
-import codecs
 import fcntl
 import os
 import pty
@@ -16,8 +15,10 @@ from typing import Iterable, Mapping
 from textual.content import Content
 from textual.reactive import var
 
-from toad.shell_read import shell_read
-from toad.widgets.terminal import Terminal
+from toad.shell_read import ShellReader
+from toad.shell_write import ShellWriter
+from toad.ansi import MAX_SEQUENCE_LENGTH
+from toad.widgets.terminal import MAX_FPS, Terminal
 from toad.menus import MenuItem
 
 
@@ -69,6 +70,10 @@ class TerminalTool(Terminal):
         classes: str | None = None,
         disabled: bool = False,
         minimum_terminal_width: int = -1,
+        scrollback_lines: int | None = None,
+        max_fps: float = MAX_FPS,
+        threaded: bool = False,
+        max_sequence_length: int = MAX_SEQUENCE_LENGTH,
     ):
         super().__init__(
             name=name,
@@ -76,6 +81,10 @@ class TerminalTool(Terminal):
             classes=classes,
             disabled=disabled,
             minimum_terminal_width=minimum_terminal_width,
+            scrollback_lines=scrollback_lines,
+            max_fps=max_fps,
+            threaded=threaded,
+            max_sequence_length=max_sequence_length,
         )
         self._command = command
         self._output_byte_limit = output_byte_limit
@@ -85,7 +94,7 @@ class TerminalTool(Terminal):
         self._process: Process | None = None
         self._bytes_read = 0
         self._output_bytes_count = 0
-        self._shell_fd: int | None = None
+        self._writer: ShellWriter | None = None
         self._return_code: int | None = None
         self._released: bool = False
         self._ready_event = asyncio.Event()
@@ -179,7 +188,6 @@ class TerminalTool(Terminal):
 
         assert self._command is not None
         master, slave = pty.openpty()
-        self._shell_fd = master
 
         flags = fcntl.fcntl(master, fcntl.F_GETFL)
         fcntl.fcntl(master, fcntl.F_SETFL, flags | os.O_NONBLOCK)
@@ -219,36 +227,25 @@ class TerminalTool(Terminal):
 
         os.close(slave)
 
+        writer = self._writer = await ShellWriter.open(master)
         self.set_write_to_stdin(self.write_stdin)
 
         BUFFER_SIZE = 64 * 1024 * 2
-        reader = asyncio.StreamReader(BUFFER_SIZE)
-        protocol = asyncio.StreamReaderProtocol(reader)
+        reader = ShellReader(master, BUFFER_SIZE)
+        self.read_stats = reader.stats
 
-        loop = asyncio.get_event_loop()
-        transport, _ = await loop.connect_read_pipe(
-            lambda: protocol, os.fdopen(master, "rb", 0)
-        )
-        # Create write transport
-        writer_protocol = asyncio.BaseProtocol()
-        write_transport, _ = await loop.connect_write_pipe(
-            lambda: writer_protocol,
-            os.fdopen(os.dup(master), "wb", 0),
-        )
-        self.writer = write_transport
-
-        unicode_decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
         try:
             while True:
-                data = await shell_read(reader, BUFFER_SIZE)
-                if process_data := unicode_decoder.decode(data, final=not data):
+                data = await reader.read()
+                if data:
                     self._record_output(data)
-                    if await self.write(process_data):
+                    if await self.write(data):
                         self.display = True
                 if not data:
                     break
         finally:
-            transport.close()
+            writer.close()
+            reader.close()
 
         self.finalize()
         return_code = self._return_code = await process.wait()
@@ -262,13 +259,10 @@ class TerminalTool(Terminal):
             )
 
     async def write_stdin(self, text: str | bytes, hide_echo: bool = False) -> int:
-        if self._shell_fd is None:
+        if self._writer is None:
             return 0
         text_bytes = text.encode("utf-8", "ignore") if isinstance(text, str) else text
-        try:
-            return await asyncio.to_thread(os.write, self._shell_fd, text_bytes)
-        except OSError:
-            return 0
+        return await self._writer.write(text_bytes)
 
     def _record_output(self, data: bytes) -> None:
         """Keep a record of the bytes left.
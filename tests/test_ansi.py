@@ -0,0 +1,132 @@
+import random
+
+import pytest
+
+from toad.ansi import TerminalState
+from toad.ansi._ansi import Buffer
+
+
+async def write_stdin(text: str) -> None:
+    pass
+
+
+def test_hyperlink_close() -> None:
+    """Text after closing a hyperlink should have no link."""
+    state = TerminalState(write_stdin)
+    state.process(
+        "\x1b]8;;https://example.org\x1b\\\x1b[1mlink\x1b]8;;\x1b\\\x1b[3m after"
+    )
+    content = state.buffer.lines[0].content
+    assert content.plain == "link after"
+    link_span, after_span = content.spans
+    assert link_span.style.link == "https://example.org"
+    assert (after_span.start, after_span.end) == (4, 10)
+    assert after_span.style.link is None
+    assert state.style.link is None
+
+
+OVERSIZE_TEXT = (
+    f"before \x1b]8;;https://example.org/{'x' * 2000}\x1b\\link\x1b]8;;\x1b\\ "
+    f"\x1bP{'y' * 2000}\x1b\\after"
+)
+
+
+@pytest.mark.parametrize("chunk_size", [None, 100, 7])
+@pytest.mark.parametrize("encode", [False, True])
+def test_max_sequence_length(chunk_size: int | None, encode: bool) -> None:
+    """Escape sequences longer than the maximum are discarded, and counted."""
+    state = TerminalState(write_stdin, max_sequence_length=1024)
+    text = OVERSIZE_TEXT.encode() if encode else OVERSIZE_TEXT
+    if chunk_size is None:
+        state.process(text)
+    else:
+        for offset in range(0, len(text), chunk_size):
+            state.process(text[offset : offset + chunk_size])
+    assert state.buffer.lines[0].content.plain == "before link after"
+    assert state.metrics.oversize_sequences == 2
+    assert state.metrics.discarded_characters > 4000
+
+    state = TerminalState(write_stdin)
+    state.process(OVERSIZE_TEXT.partition("\x1bP")[0])
+    assert state.metrics.oversize_sequences == 0
+
+
+LINE_PARTS = [
+    "a",
+    "bc",
+    "hello ",
+    " ",
+    "\t",
+    "\u30c8",
+    "\U0001f438",
+    "\x1b[1mxyz\x1b[0m",
+]
+
+
+def random_state(rng: random.Random) -> TerminalState:
+    """A terminal with random lines (some empty), folded to a random width."""
+    state = TerminalState(write_stdin, width=200)
+    lines = [
+        "".join(rng.choice(LINE_PARTS) for _ in range(rng.choice((0, 1, 5, 40))))
+        for _ in range(rng.randrange(1, 8))
+    ]
+    state.process("\r\n".join(lines))
+    state.update_size(rng.randrange(1, 30))
+    assert not state.reflow_pending
+    return state
+
+
+def walk_cursor(buffer: Buffer) -> tuple[int, int]:
+    """Unfolded cursor, by walking the folds."""
+    folded_line = buffer.folded_lines[buffer.cursor_line]
+    position = 0
+    for fold in buffer.lines[folded_line.line_no].folds:
+        if fold.line_offset == folded_line.line_offset:
+            return folded_line.line_no, position + buffer.cursor_offset
+        position += len(fold.content)
+    raise AssertionError("cursor fold not found")
+
+
+def walk_update_cursor(buffer: Buffer, line_no: int, offset: int) -> tuple[int, int]:
+    """Folded cursor for an unfolded offset, by walking the folds."""
+    folds = buffer.lines[line_no].folds
+    fold_line_start = buffer.folded_lines.line_start(line_no)
+    position = 0
+    for fold_offset, fold in enumerate(folds):
+        if position <= offset < position + len(fold.content):
+            return fold_line_start + fold_offset, offset - position
+        position += len(fold.content)
+    return fold_line_start + len(folds) - 1, len(folds[-1].content)
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_cursor_translation(seed: int) -> None:
+    """Translating the cursor between folded and unfolded lines matches a walk of
+    the folds, and round trips."""
+    rng = random.Random(seed)
+    state = random_state(rng)
+    buffer = state.buffer
+    for line_no, line in enumerate(buffer.lines):
+        line_length = sum(len(fold.content) for fold in line.folds)
+        for offset in range(line_length + 3):
+            buffer.update_cursor(line_no, offset)
+            cursor = (buffer.cursor_line, buffer.cursor_offset)
+            assert cursor == walk_update_cursor(buffer, line_no, offset)
+            # Unfolded -> folded -> unfolded
+            expected = (line_no, min(offset, line_length))
+            assert buffer.cursor == walk_cursor(buffer) == expected
+            assert state.get_cursor_line_offset(buffer) == expected[1]
+
+    for cursor_line, folded_line in enumerate(buffer.folded_lines):
+        for cursor_offset in range(len(folded_line.content)):
+            buffer.cursor_line = cursor_line
+            buffer.cursor_offset = cursor_offset
+            line_no, offset = buffer.cursor
+            assert (line_no, offset) == walk_cursor(buffer)
+            assert state.get_cursor_line_offset(buffer) == offset
+            # Folded -> unfolded -> folded
+            buffer.update_cursor(line_no, offset)
+            assert (buffer.cursor_line, buffer.cursor_offset) == (
+                cursor_line,
+                cursor_offset,
+            )
@@ -0,0 +1,37 @@
+import random
+import sys
+import threading
+
+from textual.style import NULL_STYLE
+
+from toad.ansi._sgr import SGRCache, SGRParser
+
+
+def test_sgr_cache_threads() -> None:
+    """Threads may store to (and evict from) a shared cache."""
+    cache: SGRCache[int, int] = SGRCache(64, 64)
+    parser = SGRParser(64, 64)
+    errors: list[Exception] = []
+
+    def store(seed: int) -> None:
+        rng = random.Random(seed)
+        try:
+            for value in range(20_000):
+                cache.store(rng.randrange(1000), value)
+                style = parser.apply(NULL_STYLE, str(rng.randrange(30, 38)))
+                parser.apply(style, f"48;5;{rng.randrange(256)}")
+        except Exception as error:
+            errors.append(error)
+
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=store, args=(seed,)) for seed in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+    assert errors == []
+    assert len(cache) <= cache.maxsize
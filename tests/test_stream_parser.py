@@ -0,0 +1,139 @@
+import random
+
+import pytest
+
+from toad.ansi._ansi import ANSIParser
+from toad.ansi._stream_parser import (
+    MatchToken,
+    ParseResult,
+    ReadRegex,
+    StreamParser,
+    Token,
+)
+
+
+class QuoteParser(StreamParser[Token]):
+    def __init__(self, max_length: int | None, lookbehind: int | None) -> None:
+        self.max_length = max_length
+        self.lookbehind = lookbehind
+        super().__init__()
+
+    def parse(self) -> ParseResult[Token]:
+        while True:
+            yield (yield self.read_regex(r"'[a-z]*'", self.max_length, self.lookbehind))
+
+
+def parse(parser: StreamParser, *chunks: str) -> list[tuple[bool, str]]:
+    return [
+        (isinstance(token, MatchToken), token.text)
+        for chunk in chunks
+        for token in parser.feed(chunk)
+    ]
+
+
+def test_read_regex_lookbehind() -> None:
+    """Searches resume near the end of the previous text, with a bounded buffer."""
+    read = ReadRegex(r"'[a-z]*'", lookbehind=8)
+    released: list[str] = []
+    for _ in range(100):
+        text, match, consumed = read.feed("x" * 100)
+        assert match is None
+        assert consumed == 100
+        assert read.buffer_size <= 8
+        released.append(text)
+    text, match, _ = read.feed("x'abc")
+    assert match is None
+    released.append(text)
+    text, match, consumed = read.feed("def'yz")
+    assert match is not None
+    assert match.group(0) == "'abcdef'"
+    assert consumed == 4
+    released.append(text)
+    assert "".join(released) == "x" * 10_001
+
+
+def test_read_regex_max_length() -> None:
+    """Matches longer than `max_length` are released as text."""
+    read = ReadRegex(r"'[a-z]*'", max_length=5)
+    text, match, consumed = read.feed("'abcdefgh' 'ab'!")
+    assert match is not None
+    assert match.group(0) == "'ab'"
+    assert text == "'abcdefgh' "
+    assert consumed == 15
+
+    read = ReadRegex(r"'[a-z]*'", max_length=5)
+    text, match, _ = read.feed("'abcdefgh'")
+    assert match is None
+    assert text == "'abcdefgh'"
+    assert read.buffer_size == 0
+
+
+def test_parse_read_regex() -> None:
+    assert parse(QuoteParser(5, None), "'abcdefgh' 'a", "b'") == [
+        (False, "'abcdefgh'"),
+        (False, " "),
+        (True, "'ab'"),
+    ]
+    assert parse(QuoteParser(None, 4), "xxxxxx'a", "b'") == [
+        (False, "xxxx"),
+        (False, "xx"),
+        (True, "'ab'"),
+    ]
+
+
+ANSI_TEXT = (
+    "\x1b[1;31mError:\x1b[0m build failed\r\n"
+    "\x1b[38;2;255;128;0mwarning\x1b[39m: unused \x1b[4mvariable\x1b[24m\r\n"
+    "\x1b]8;;https://example.org\x1b\\link\x1b]8;;\x1b\\ and "
+    "\x1b]8;;https://example.com\x07other\x1b]8;;\x07\r\n"
+    "\x1b]2025;/home/user\x07\x1b[?25l\x1b[?1049h\x1b[2J\x1b[10;20H"
+    "\x1b(0lqqk\x1b(B\x1b=\x1b>\x1b7\x1b8\x1bM\r"
+    "progress 50%\x08\x08\x08\x0875%\r\n"
+    "\U0001f438 \u30c8\u30fc\u30c9\ttab\n\n\x1b[K\x1b[?1049l\x1b[?25h\r\n"
+)
+
+
+def parse_tokens(*chunks: str) -> list[tuple[str, str]]:
+    """Parse chunks with `ANSIParser`, combining consecutive content."""
+    parser = ANSIParser()
+    tokens: list[tuple[str, str]] = []
+    for chunk in chunks:
+        for token in parser.feed(chunk):
+            if token[0] == "content" and tokens and tokens[-1][0] == "content":
+                tokens[-1] = ("content", tokens[-1][1] + token[1])
+            elif token != ("content", ""):
+                tokens.append(token)
+    return tokens
+
+
+def random_chunks(text: str, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    chunks: list[str] = []
+    position = 0
+    while position < len(text):
+        size = rng.choice((1, 2, 3, 5, 8, 16, 64))
+        chunks.append(text[position : position + size])
+        position += size
+    return chunks
+
+
+def test_parse_chunks_single_split() -> None:
+    """Splitting anywhere (including inside escape sequences) parses the same."""
+    expected = parse_tokens(ANSI_TEXT)
+    assert ("osc", "]8;;https://example.org\x1b\\") in expected
+    for split in range(1, len(ANSI_TEXT)):
+        assert parse_tokens(ANSI_TEXT[:split], ANSI_TEXT[split:]) == expected
+
+
+def test_parse_chunks_lines() -> None:
+    """Feeding line by line, or splitting "\\r\\n", parses the same."""
+    expected = parse_tokens(ANSI_TEXT)
+    assert parse_tokens(*ANSI_TEXT.splitlines(keepends=True)) == expected
+    assert parse_tokens(*ANSI_TEXT.replace("\r\n", "\r\0\n").split("\0")) == expected
+    assert parse_tokens(*ANSI_TEXT) == expected
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_parse_chunks_random(seed: int) -> None:
+    text = ANSI_TEXT * 4
+    assert parse_tokens(*random_chunks(text, seed)) == parse_tokens(text)
@@ -0,0 +1,58 @@
+import asyncio
+
+from textual import on
+from textual.app import App, ComposeResult
+
+from toad.widgets.terminal import MAX_FPS, Terminal
+
+
+class TerminalApp(App):
+    def __init__(self, max_fps: float = MAX_FPS) -> None:
+        super().__init__()
+        self.max_fps = max_fps
+        self.finalized: list[Terminal] = []
+
+    def compose(self) -> ComposeResult:
+        yield Terminal(size=(80, 24), max_fps=self.max_fps)
+
+    @on(Terminal.Finalized)
+    def on_terminal_finalized(self, event: Terminal.Finalized) -> None:
+        self.finalized.append(event.terminal)
+
+
+def test_finalize_with_pending_damage() -> None:
+    """Flushing damage on finalize shouldn't finalize a second time."""
+
+    async def run() -> None:
+        app = TerminalApp()
+        async with app.run_test() as pilot:
+            terminal = app.query_one(Terminal)
+            await terminal.write("Hello\r\n")
+            await terminal.write("World\r\n")
+            assert terminal._refresh_timer is not None
+            terminal.state.current_directory = "/tmp"
+            terminal.finalize()
+            await pilot.pause()
+            assert app.finalized == [terminal]
+
+    asyncio.run(run())
+
+
+def test_finalize_on_directory_with_frame_cap() -> None:
+    """A terminal reporting its directory is finalized by the same write, even when
+    the refresh is deferred by the frame cap."""
+
+    async def run() -> None:
+        app = TerminalApp(max_fps=1)
+        async with app.run_test() as pilot:
+            terminal = app.query_one(Terminal)
+            await terminal.write("Hello\r\n")
+            await terminal.write("World\r\n\x1b]2025;/tmp\x07")
+            assert terminal.is_finalized
+            assert terminal.current_directory == "/tmp"
+            assert terminal._refresh_timer is None
+            assert terminal.state.buffer.lines[1].content.plain == "World"
+            await pilot.pause()
+            assert app.finalized == [terminal]
+
+    asyncio.run(run())
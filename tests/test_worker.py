@@ -0,0 +1,89 @@
+import asyncio
+import random
+import sys
+
+import pytest
+
+from toad.ansi import SGRParser, TerminalState, TerminalWorker
+
+
+async def write_stdin(text: str) -> None:
+    pass
+
+
+def styled_output(seed: int) -> str:
+    """Lines of text with many distinct styles (enough to evict from SGR caches)."""
+    rng = random.Random(seed)
+    lines: list[str] = []
+    for line_no in range(500):
+        parts: list[str] = []
+        for _ in range(8):
+            red, green, blue = (
+                rng.randrange(256),
+                rng.randrange(256),
+                rng.randrange(256),
+            )
+            sgr = rng.choice(
+                (
+                    f"38;2;{red};{green};{blue}",
+                    f"48;5;{rng.randrange(256)};1",
+                    f"{rng.randrange(30, 38)};4",
+                    "0",
+                )
+            )
+            parts.append(f"\x1b[{sgr}m{line_no}:{rng.randrange(1000)} ")
+        lines.append("".join(parts))
+    return "\r\n".join(lines)
+
+
+def snapshot(state: TerminalState) -> list[tuple[str, list[tuple[int, int, str]]]]:
+    return [
+        (
+            line.content.plain,
+            [(span.start, span.end, str(span.style)) for span in line.content.spans],
+        )
+        for line in state.scrollback_buffer.lines
+    ]
+
+
+@pytest.mark.parametrize("own_parser", [False, True])
+def test_workers(own_parser: bool) -> None:
+    """Several workers may process styled output at once."""
+    outputs = [styled_output(seed) for seed in range(6)]
+    expected = []
+    for output in outputs:
+        state = TerminalState(write_stdin, width=200, sgr_parser=SGRParser())
+        state.process(output)
+        expected.append(snapshot(state))
+
+    async def run() -> list[TerminalState]:
+        workers = [
+            TerminalWorker(
+                TerminalState(
+                    write_stdin,
+                    width=200,
+                    sgr_parser=SGRParser(64, 64) if own_parser else None,
+                ),
+                name=f"worker-{index}",
+            )
+            for index in range(len(outputs))
+        ]
+        try:
+            await asyncio.gather(
+                *[
+                    worker.write(output.encode())
+                    for worker, output in zip(workers, outputs)
+                ]
+            )
+        finally:
+            for worker in workers:
+                worker.close()
+        return [worker.state for worker in workers]
+
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        states = asyncio.run(run())
+    finally:
+        sys.setswitchinterval(switch_interval)
+    assert [snapshot(state) for state in states] == expected
@@ -0,0 +1,184 @@
+"""
+Benchmark the ANSI tokenizer engines, and writing to the terminal state.
+
+Run with:
+
+    uv run python tools/benchmark_ansi.py [--size MEGABYTES] [LOG ...]
+
+If no logs are given, a synthetic build log is generated.
+"""
+
+import argparse
+import asyncio
+import random
+from pathlib import Path
+from time import perf_counter
+
+from toad.ansi._ansi import ANSIParser, ANSIStream, TerminalState
+from toad.ansi._byte_tokenizer import ANSIByteTokenizer
+from toad.ansi._tokenizer import ANSITokenizer
+
+CHUNK_SIZE = 4096
+
+
+def build_log(size: float = 1.0) -> str:
+    """Generate something resembling the output of cargo build, pytest -v, and ls -R.
+
+    Args:
+        size: Approximate size in megabytes.
+    """
+    random_ = random.Random(42)
+    lines: list[str] = []
+    target_size = int(size * 1024 * 1024)
+    log_size = 0
+    line_no = 0
+    while log_size < target_size:
+        line_no += 1
+        match random_.randrange(5):
+            case 0:
+                lines.append(
+                    f"\x1b[1m\x1b[32m   Compiling\x1b[0m crate-{line_no} v0.{line_no % 20}.0\r\n"
+                )
+            case 1:
+                lines.append(
+                    f"tests/test_module.py::test_{line_no} \x1b[32mPASSED\x1b[0m"
+                    f"\x1b[36m [{line_no % 100:3}%]\x1b[0m\r\n"
+                )
+            case 2:
+                lines.append(
+                    f"\x1b[1m\x1b[33mwarning\x1b[0m\x1b[1m: unused variable: `x{line_no}`\x1b[0m\r\n"
+                )
+            case 3:
+                lines.append(
+                    f"\x1b[0m\x1b[01;34mdir{line_no}\x1b[0m\r\nfile{line_no}.py\r\n"
+                )
+            case _:
+                lines.append(
+                    f"\r\x1b[K\x1b[1m\x1b[36m    Building\x1b[0m [{'=' * (line_no % 30):<30}] {line_no}"
+                )
+        log_size += len(lines[-1])
+    return "".join(lines)
+
+
+def build_plain_text(size: float = 1.0) -> str:
+    """Generate plain text, as if from `cat largefile.txt`.
+
+    Args:
+        size: Approximate size in megabytes.
+    """
+    random_ = random.Random(42)
+    words = ["terminal", "render", "buffer", "line", "fold", "cursor", "style", "a"]
+    lines: list[str] = []
+    target_size = int(size * 1024 * 1024)
+    log_size = 0
+    while log_size < target_size:
+        lines.append(
+            " ".join(random_.choice(words) for _ in range(random_.randrange(12))) + "\n"
+        )
+        log_size += len(lines[-1])
+    return "".join(lines)
+
+
+def time_feed(feed, text: str | bytes, split_lines: bool = False) -> float:
+    """Feed text in chunks, and return the time taken.
+
+    Args:
+        feed: Feed method.
+        text: Text (or bytes) to feed.
+        split_lines: Split chunks in to lines, as `StreamParser` used to.
+    """
+    chunks = [
+        text[offset : offset + CHUNK_SIZE] for offset in range(0, len(text), CHUNK_SIZE)
+    ]
+    if split_lines:
+        chunks = [line for chunk in chunks for line in chunk.splitlines(keepends=True)]
+    start = perf_counter()
+    for chunk in chunks:
+        for _ in feed(chunk):
+            pass
+    return perf_counter() - start
+
+
+def benchmark(name: str, text: str) -> None:
+    data = text.encode("utf-8", "replace")
+    megabytes = len(data) / (1024 * 1024)
+    print(f"{name} ({megabytes:.1f}MB)")
+    results: dict[str, float] = {
+        "parser lines": time_feed(ANSIParser().feed, text, split_lines=True),
+        "parser tokens": time_feed(ANSIParser().feed, text),
+        "tokenizer tokens": time_feed(ANSITokenizer().feed, text),
+        "parser commands": time_feed(ANSIStream(ANSIParser()).feed, text),
+        "tokenizer commands": time_feed(ANSIStream(ANSITokenizer()).feed, text),
+        "byte tokens": time_feed(ANSIByteTokenizer().feed, data),
+        "byte commands": time_feed(ANSIStream().feed, data),
+    }
+    for label, elapsed in results.items():
+        print(f"  {label:<20} {megabytes / elapsed:8.2f} MB/s")
+    print(
+        f"  speedup: chunks {results['parser lines'] / results['parser tokens']:.1f}x, "
+        f"tokens {results['parser tokens'] / results['tokenizer tokens']:.1f}x, "
+        f"commands {results['parser commands'] / results['tokenizer commands']:.1f}x"
+    )
+
+
+async def _write_commands(state: TerminalState, text: str) -> None:
+    """Write to the terminal state one command at a time, without the fast paths."""
+    for ansi_command in state._ansi_stream.feed(text):
+        state._apply_ansi_command(ansi_command)
+
+
+def time_write(write, text: str) -> float:
+    """Write text in chunks to a new terminal state, and return the time taken.
+
+    Args:
+        write: Async callable that takes the state and a chunk.
+        text: Text to write.
+    """
+
+    async def write_stdin(text: str) -> bool:
+        return True
+
+    chunks = [
+        text[offset : offset + CHUNK_SIZE] for offset in range(0, len(text), CHUNK_SIZE)
+    ]
+    state = TerminalState(write_stdin)
+
+    async def run() -> float:
+        start = perf_counter()
+        for chunk in chunks:
+            await write(state, chunk)
+        return perf_counter() - start
+
+    return asyncio.run(run())
+
+
+def benchmark_write(name: str, text: str) -> None:
+    megabytes = len(text.encode("utf-8", "replace")) / (1024 * 1024)
+    print(f"{name} ({megabytes:.1f}MB)")
+    results: dict[str, float] = {
+        "commands": time_write(_write_commands, text),
+        "write": time_write(TerminalState.write, text),
+    }
+    for label, elapsed in results.items():
+        print(f"  {label:<20} {megabytes / elapsed:8.2f} MB/s")
+    print(f"  speedup: {results['commands'] / results['write']:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the ANSI parser.")
+    parser.add_argument("logs", nargs="*", help="Recorded terminal output.")
+    parser.add_argument(
+        "--size",
+        type=float,
+        default=1.0,
+        help="Size of synthetic log in megabytes (e.g. 100).",
+    )
+    args = parser.parse_args()
+    if args.logs:
+        for path in args.logs:
+            log = Path(path).read_bytes().decode("utf-8", "replace")
+            benchmark(path, log)
+            benchmark_write(f"{path} (write)", log)
+    else:
+        benchmark("synthetic build log", build_log(args.size))
+        benchmark_write("cat largefile.txt (write)", build_plain_text(args.size))
@@ -0,0 +1,651 @@
+"""
+Benchmark replaying terminal transcripts through `TerminalState.write`.
+
+Run with:
+
+    uv run python tools/benchmark_terminal.py [--corpus DIRECTORY] [--save FILE] [--compare FILE]
+
+Without `--corpus`, synthetic transcripts are generated for a compiler log, `pytest -v`,
+an htop session, `git log --color`, a progress bar storm, and a vim session.
+Use `--record DIRECTORY` to write them to disk.
+
+A directory of recorded transcripts (one file per transcript, raw PTY output) may be
+used in their place. Record one with, for example:
+
+    script -q -c "htop" corpus/htop.log
+
+Each transcript is written in chunks (as if read from a PTY), and the benchmark reports:
+
+- MB/s: Throughput of the best run.
+- blocks/MB: Memory blocks allocated by the first replay and still held afterwards
+  (by the terminal state and caches), per megabyte. CPython doesn't count every
+  allocation, so this is the net allocation count.
+- peak KB/MB: Peak memory allocated during the replay (via tracemalloc), per megabyte.
+- p99 ms: 99th percentile latency of a single chunk.
+
+The benchmark also measures the memory used by each line of the scrollback buffer,
+before and after it is compacted (as it is when a terminal is finalized), and resizes a
+terminal with a large scrollback buffer (`--resize-lines`),
+and reports how long the resize blocks for, the slowest step of the reflow which
+follows, and the total time to refold every line.
+
+Finally, it reports the damage from each write: the number of lines updated, and the
+number of spans (refresh regions) they coalesce in to.
+
+Results may be saved with `--save`, and compared with a saved baseline with `--compare`.
+The exit code is 1 if any result regressed by more than the tolerance. Timings are only
+comparable on the same (otherwise idle) machine.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import gc
+import io
+import json
+import random
+import sys
+import tracemalloc
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from time import perf_counter
+from typing import Callable
+
+from toad.ansi._ansi import Buffer, TerminalState
+
+CHUNK_SIZE = 4096
+"""Bytes per write (a typical PTY read)."""
+WIDTH = 120
+HEIGHT = 40
+
+WORDS = ["buffer", "render", "cursor", "style", "fold", "line", "résumé", "naïve"]
+
+
+def build_compiler_log(random_: random.Random, size: int) -> str:
+    """Something resembling the output of `cargo build`.
+
+    Args:
+        random_: Random number generator.
+        size: Approximate size in characters.
+    """
+    lines: list[str] = []
+    length = 0
+    line_no = 0
+    while length < size:
+        line_no += 1
+        match random_.randrange(6):
+            case 0 | 1 | 2:
+                line = f"\x1b[1m\x1b[32m   Compiling\x1b[0m crate-{line_no} v0.{line_no % 20}.{random_.randrange(9)}\r\n"
+            case 3:
+                line = (
+                    f"\x1b[1m\x1b[33mwarning\x1b[0m\x1b[1m: unused variable: `{random_.choice(WORDS)}`\x1b[0m\r\n"
+                    f"\x1b[1m\x1b[34m  --> \x1b[0msrc/module_{line_no}.rs:{random_.randrange(1, 999)}:9\r\n"
+                    f"\x1b[1m\x1b[34m   |\x1b[0m\r\n"
+                    f"\x1b[1m\x1b[34m{line_no % 1000:<3}|\x1b[0m     let {random_.choice(WORDS)} = compute();\r\n"
+                    f"\x1b[1m\x1b[34m   |\x1b[0m         \x1b[1m\x1b[33m^^^^^^\x1b[0m\r\n"
+                )
+            case 4:
+                line = f"\x1b[1m\x1b[32m     Running\x1b[0m `target/debug/build/crate-{line_no}/build-script-build`\r\n"
+            case _:
+                done = line_no % 300
+                line = f"\r\x1b[K\x1b[1m\x1b[36m    Building\x1b[0m [{'=' * (done // 10):>30}] {done}/300: crate-{line_no}"
+        lines.append(line)
+        length += len(line)
+    return "".join(lines)
+
+
+def build_pytest(random_: random.Random, size: int) -> str:
+    """Something resembling the output of `pytest -v`.
+
+    Args:
+        random_: Random number generator.
+        size: Approximate size in characters.
+    """
+    lines = [
+        f"\x1b[1m{' test session starts ':=^{WIDTH}}\x1b[0m\r\n",
+        "platform linux -- Python 3.14.0, pytest-8.4.2, pluggy-1.6.0 -- /usr/bin/python\r\n",
+        "collecting ... \x1b[1mcollected 5000 items\x1b[0m\r\n\r\n",
+    ]
+    length = sum(map(len, lines))
+    test_no = 0
+    while length < size:
+        test_no += 1
+        test = f"tests/test_{random_.choice(WORDS)}.py::test_{random_.choice(WORDS)}_{test_no}"
+        percent = f"[{test_no % 100:3}%]"
+        if random_.randrange(40):
+            result, color = "PASSED", "32"
+        else:
+            result, color = "FAILED", "31"
+        padding = " " * max(1, WIDTH - len(test) - len(result) - len(percent) - 2)
+        line = f"{test} \x1b[{color}m{result}\x1b[0m\x1b[{color}m{padding}{percent}\x1b[0m\r\n"
+        if result == "FAILED":
+            line += (
+                f"\x1b[1m\x1b[31mE       AssertionError: assert {test_no} == {test_no + 1}\x1b[0m\r\n"
+                f"\x1b[1m\x1b[31mE        +  where {test_no} = len([...])\x1b[0m\r\n"
+            )
+        lines.append(line)
+        length += len(line)
+    return "".join(lines)
+
+
+def build_htop(random_: random.Random, size: int) -> str:
+    """Something resembling an htop session (full screen redraws on the alternate screen).
+
+    Args:
+        random_: Random number generator.
+        size: Approximate size in characters.
+    """
+    frames = [f"\x1b[?1049h\x1b[1;{HEIGHT}r\x1b[?25l\x1b[39;49m\x1b[H\x1b[2J"]
+    length = len(frames[0])
+    users = ["root", "will", "postgres", "www-data"]
+    commands = ["python -m toad", "/usr/bin/postgres", "nginx: worker", "htop", "bash"]
+    while length < size:
+        frame: list[str] = []
+        for cpu in range(4):
+            used = random_.randrange(40)
+            kernel = random_.randrange(40 - used + 1)
+            frame.append(
+                f"\x1b[{cpu + 1};3H\x1b[36m{cpu}\x1b[39m\x1b[1m[\x1b[32m{'|' * used}"
+                f"\x1b[31m{'|' * kernel}\x1b[30m{' ' * (40 - used - kernel)}"
+                f"{(used + kernel) * 2.5:5.1f}%\x1b[39m]\x1b[0m"
+            )
+        frame.append(
+            f"\x1b[5;3H\x1b[36mMem\x1b[39m\x1b[1m[\x1b[32m{'|' * random_.randrange(30)}"
+            f"\x1b[0m\x1b[5;48H\x1b[1m{random_.randrange(900, 7900)}M/7.7G\x1b[39m]\x1b[0m"
+        )
+        frame.append(
+            f"\x1b[2;60H\x1b[36mTasks: \x1b[1m{random_.randrange(80, 200)}\x1b[0m\x1b[36m, "
+            f"\x1b[1m{random_.randrange(300, 900)}\x1b[0m\x1b[36m thr; \x1b[1m\x1b[32m{random_.randrange(1, 9)}"
+            f"\x1b[0m\x1b[36m running\x1b[K"
+        )
+        frame.append(
+            "\x1b[7;1H\x1b[30m\x1b[42m    PID USER       PRI  NI  VIRT   RES   SHR S CPU% MEM%   TIME+  Command"
+            "\x1b[K\x1b[m"
+        )
+        for row in range(8, HEIGHT - 1):
+            cpu_percent = random_.random() * 100
+            # The selected process is highlighted
+            highlight = "\x1b[30m\x1b[46m" if row == 8 else ""
+            frame.append(
+                f"\x1b[{row};1H{highlight}"
+                f"{random_.randrange(1, 99999):7} {random_.choice(users):<9}  20   0 "
+                f"\x1b[36m{random_.randrange(1, 999):4}M\x1b[39m {random_.randrange(1, 999):4}M "
+                f"{random_.randrange(1, 99):4}M {random_.choice('SR')} "
+                f"\x1b[{'31' if cpu_percent > 50 else '39'}m{cpu_percent:4.1f}\x1b[39m "
+                f"{random_.random() * 10:4.1f}  0:{random_.randrange(60):02}.{random_.randrange(100):02} "
+                f"\x1b[1m{random_.choice(commands)}\x1b[0m\x1b[K"
+            )
+        frame.append(
+            f"\x1b[{HEIGHT};1H\x1b[30m\x1b[46mF1\x1b[39;49mHelp  \x1b[30m\x1b[46mF2\x1b[39;49mSetup"
+            "  \x1b[30m\x1b[46mF10\x1b[39;49mQuit\x1b[K"
+        )
+        frame_text = "".join(frame)
+        frames.append(frame_text)
+        length += len(frame_text)
+    frames.append(f"\x1b[{HEIGHT};1H\x1b[r\x1b[?1049l\x1b[?25h")
+    return "".join(frames)
+
+
+def build_git_log(random_: random.Random, size: int) -> str:
+    """Something resembling the output of `git log --color`.
+
+    Args:
+        random_: Random number generator.
+        size: Approximate size in characters.
+    """
+    lines: list[str] = []
+    length = 0
+    while length < size:
+        sha = "%040x" % random_.getrandbits(160)
+        refs = (
+            "\x1b[33m (\x1b[m\x1b[1;36mHEAD -> \x1b[m\x1b[1;32mmain\x1b[m\x1b[33m, "
+            "\x1b[m\x1b[1;31morigin/main\x1b[m\x1b[33m)\x1b[m"
+            if not lines
+            else ""
+        )
+        message = " ".join(
+            random_.choice(WORDS) for _ in range(random_.randrange(3, 12))
+        )
+        entry = (
+            f"\x1b[33mcommit {sha}\x1b[m{refs}\r\n"
+            f"Author: Developer {random_.randrange(20)} <dev{random_.randrange(20)}@example.org>\r\n"
+            f"Date:   Mon Oct {random_.randrange(1, 29)} 12:{random_.randrange(60):02}:00 2025 +0100\r\n"
+            f"\r\n    {message.capitalize()}\r\n\r\n"
+        )
+        lines.append(entry)
+        length += len(entry)
+    return "".join(lines)
+
+
+def build_progress_storm(random_: random.Random, size: int) -> str:
+    """Many progress bars redrawn in place (think `pip install` or `tqdm`).
+
+    Args:
+        random_: Random number generator.
+        size: Approximate size in characters.
+    """
+    updates: list[str] = []
+    length = 0
+    task = 0
+    while length < size:
+        task += 1
+        total = random_.randrange(50, 200)
+        for done in range(0, total + 1, random_.randrange(1, 4)):
+            eighths = done * 40 * 8 // total
+            bar = "█" * (eighths // 8) + (
+                " ▏▎▍▌▋▊▉"[eighths % 8] if eighths < 320 else ""
+            )
+            update = (
+                f"\r\x1b[K\x1b[32m{bar:<40}\x1b[0m {done}/{total} "
+                f"\x1b[31m{random_.random() * 50:.1f} MB/s\x1b[0m eta \x1b[36m0:00:{random_.randrange(60):02}\x1b[0m"
+            )
+            updates.append(update)
+            length += len(update)
+        updates.append(f"\r\n\x1b[1mdownloaded package-{task}\x1b[0m\r\n")
+    return "".join(updates)
+
+
+def build_vim(random_: random.Random, size: int) -> str:
+    """Something resembling a vim session (editing and scrolling a file).
+
+    Args:
+        random_: Random number generator.
+        size: Approximate size in characters.
+    """
+    keywords = ["def", "class", "return", "import", "for", "if", "async", "await"]
+
+    def code_line() -> str:
+        indent = " " * (4 * random_.randrange(3))
+        return (
+            f"{indent}\x1b[38;5;130m{random_.choice(keywords)}\x1b[m "
+            + " ".join(random_.choice(WORDS) for _ in range(random_.randrange(1, 8)))
+            + f"\x1b[38;5;28m  # {random_.choice(WORDS)}\x1b[m"
+        )
+
+    def status_line() -> str:
+        position = f"{random_.randrange(1, 5000)},{random_.randrange(1, 80)}"
+        return (
+            f"\x1b[{HEIGHT};1H\x1b[1m-- INSERT --\x1b[m\x1b[K"
+            f"\x1b[{HEIGHT};{WIDTH - 18}H{position:<14}{random_.randrange(100)}%"
+        )
+
+    tilde = "\x1b[94m~\x1b[m"
+    output = ["\x1b[?1049h\x1b[?1h\x1b=\x1b[?2004h\x1b[H\x1b[2J"]
+    for row in range(1, HEIGHT):
+        output.append(f"\x1b[{row};1H{code_line() if row < HEIGHT - 8 else tilde}")
+    length = sum(map(len, output))
+    while length < size:
+        match random_.randrange(4):
+            case 0:
+                # Scroll down a few lines
+                lines = random_.randrange(1, 6)
+                edit = f"\x1b[?25l\x1b[1;{HEIGHT - 1}r\x1b[{HEIGHT - 1};1H" + "".join(
+                    f"\n\x1b[K{code_line()}\r" for _ in range(lines)
+                )
+                edit += f"\x1b[r{status_line()}\x1b[?25h"
+            case 1:
+                # Scroll up
+                edit = f"\x1b[?25l\x1b[1;{HEIGHT - 1}r\x1b[{random_.randrange(1, 4)}T\x1b[1;1H{code_line()}\x1b[r{status_line()}\x1b[?25h"
+            case _:
+                # Type a word
+                row = random_.randrange(1, HEIGHT - 1)
+                column = random_.randrange(1, 60)
+                edit = "".join(
+                    f"\x1b[{row};{column + offset}H{character}\x1b[K{status_line()}\x1b[{row};{column + offset + 1}H"
+                    for offset, character in enumerate(random_.choice(WORDS) + " ")
+                )
+        output.append(edit)
+        length += len(edit)
+    output.append("\x1b[?2004l\x1b[?1l\x1b>\x1b[?1049l")
+    return "".join(output)
+
+
+SYNTHETIC_CORPUS: dict[str, Callable[[random.Random, int], str]] = {
+    "compiler-log": build_compiler_log,
+    "pytest-v": build_pytest,
+    "htop": build_htop,
+    "git-log-color": build_git_log,
+    "progress-storm": build_progress_storm,
+    "vim": build_vim,
+}
+
+
+def build_scrollback(random_: random.Random, line_count: int) -> str:
+    """Lines of words, some of which are long enough to wrap.
+
+    Args:
+        random_: Random number generator.
+        line_count: Number of lines.
+    """
+    return "".join(
+        " ".join(random_.choice(WORDS) for _ in range(random_.randrange(1, 30)))
+        + "\r\n"
+        for _ in range(line_count)
+    )
+
+
+def build_corpus(size: float) -> dict[str, bytes]:
+    """Build the synthetic transcripts.
+
+    Args:
+        size: Approximate size of each transcript in megabytes.
+    """
+    return {
+        name: build(random.Random(42), int(size * 1024 * 1024)).encode("utf-8")
+        for name, build in SYNTHETIC_CORPUS.items()
+    }
+
+
+def load_corpus(path: Path) -> dict[str, bytes]:
+    """Load recorded transcripts.
+
+    Args:
+        path: Directory containing transcripts.
+    """
+    return {
+        transcript.stem: transcript.read_bytes()
+        for transcript in sorted(path.iterdir())
+        if transcript.is_file()
+    }
+
+
+@dataclass
+class Result:
+    """Results for a single transcript."""
+
+    megabytes: float
+    """Size of the transcript."""
+    mb_per_second: float
+    """Throughput of the best run."""
+    blocks_per_mb: float
+    """Memory blocks allocated and held by the first replay, per megabyte."""
+    peak_kb_per_mb: float
+    """Peak memory allocated, per megabyte."""
+    p99_ms: float
+    """99th percentile latency of a chunk, in milliseconds."""
+
+
+def replay(transcript: bytes, chunk_size: int) -> tuple[TerminalState, list[float]]:
+    """Replay a transcript through a new terminal state.
+
+    Args:
+        transcript: Bytes to write.
+        chunk_size: Bytes per write.
+
+    Returns:
+        The terminal state, and the time taken for each chunk.
+    """
+
+    async def write_stdin(text: str) -> bool:
+        return True
+
+    chunks = [
+        transcript[offset : offset + chunk_size]
+        for offset in range(0, len(transcript), chunk_size)
+    ]
+    state = TerminalState(write_stdin, width=WIDTH, height=HEIGHT)
+
+    async def run() -> list[float]:
+        timings: list[float] = []
+        for chunk in chunks:
+            start = perf_counter()
+            await state.write(chunk)
+            timings.append(perf_counter() - start)
+        return timings
+
+    # The terminal state may print unknown sequences, which would skew timings
+    with contextlib.redirect_stdout(io.StringIO()):
+        return state, asyncio.run(run())
+
+
+def benchmark(transcript: bytes, chunk_size: int, repeat: int) -> Result:
+    """Benchmark a single transcript.
+
+    Args:
+        transcript: Bytes to write.
+        chunk_size: Bytes per write.
+        repeat: Number of timed runs.
+    """
+    megabytes = len(transcript) / (1024 * 1024)
+
+    # Count blocks before the timed runs, which would fill caches
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    # Keep a reference to the state, so its blocks are counted
+    state, _ = replay(transcript, chunk_size)
+    gc.collect()
+    blocks = sys.getallocatedblocks() - blocks
+    del state
+
+    best_timings: list[float] | None = None
+    for _ in range(repeat):
+        _, timings = replay(transcript, chunk_size)
+        if best_timings is None or sum(timings) < sum(best_timings):
+            best_timings = timings
+    assert best_timings is not None
+
+    tracemalloc.start()
+    try:
+        replay(transcript, chunk_size)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    timings = sorted(best_timings)
+    return Result(
+        megabytes=megabytes,
+        mb_per_second=megabytes / sum(timings),
+        blocks_per_mb=blocks / megabytes,
+        peak_kb_per_mb=peak / 1024 / megabytes,
+        p99_ms=timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000,
+    )
+
+
+def measure_compact(transcript: bytes) -> tuple[int, float, float]:
+    """Measure the memory used by the scrollback buffer, before and after compacting.
+
+    Args:
+        transcript: Bytes to write.
+
+    Returns:
+        The number of lines, and bytes per line before and after compacting.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        state, _ = replay(transcript, CHUNK_SIZE)
+        line_count = max(1, state.scrollback_buffer.line_count)
+        gc.collect()
+        live = tracemalloc.get_traced_memory()[0]
+        state.compact()
+        gc.collect()
+        packed = tracemalloc.get_traced_memory()[0]
+        # Subtract everything but the scrollback buffer
+        state.scrollback_buffer = Buffer("scrollback")
+        gc.collect()
+        other = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return line_count, (live - other) / line_count, (packed - other) / line_count
+
+
+def measure_damage(transcript: bytes) -> tuple[int, int, int]:
+    """Measure the lines updated by each write, and the spans they coalesce in to.
+
+    Writes which require a full refresh aren't counted.
+
+    Args:
+        transcript: Bytes to write.
+
+    Returns:
+        The number of writes, updated lines, and spans.
+    """
+
+    async def write_stdin(text: str) -> bool:
+        return True
+
+    state = TerminalState(write_stdin, width=WIDTH, height=HEIGHT)
+    writes = line_count = span_count = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        for offset in range(0, len(transcript), CHUNK_SIZE):
+            writes += 1
+            for spans in state.process(transcript[offset : offset + CHUNK_SIZE]):
+                if spans is not None:
+                    line_count += sum(end - start for start, end in spans)
+                    span_count += len(spans)
+    return writes, line_count, span_count
+
+
+def benchmark_resize(line_count: int) -> None:
+    """Benchmark resizing a terminal with a large scrollback buffer, and print a report.
+
+    Args:
+        line_count: Number of lines in the scrollback buffer.
+    """
+    transcript = build_scrollback(random.Random(42), line_count).encode("utf-8")
+    state, _ = replay(transcript, CHUNK_SIZE)
+    start = perf_counter()
+    state.update_size(WIDTH // 2, HEIGHT)
+    blocking = perf_counter() - start
+    steps: list[float] = []
+    while state.reflow_pending:
+        start = perf_counter()
+        state.continue_reflow()
+        steps.append(perf_counter() - start)
+    print(
+        f"\nresize {line_count:,} lines: blocking {blocking * 1000:.1f} ms, "
+        f"{len(steps)} steps (slowest {max(steps, default=0) * 1000:.1f} ms), "
+        f"total {(blocking + sum(steps)) * 1000:.0f} ms"
+    )
+
+
+def compare(
+    results: dict[str, Result], baseline: dict[str, dict[str, float]], tolerance: float
+) -> bool:
+    """Compare results with a baseline, and print a report.
+
+    Args:
+        results: Results to compare.
+        baseline: Saved results.
+        tolerance: Maximum allowed change for the worse (0.1 for 10%).
+
+    Returns:
+        `True` if there were regressions.
+    """
+    # Metric, and if higher values are better
+    metrics = [
+        ("mb_per_second", True),
+        ("blocks_per_mb", False),
+        ("peak_kb_per_mb", False),
+        ("p99_ms", False),
+    ]
+    regressed = False
+    print(f"\nCompared with baseline (tolerance {tolerance:.0%})")
+    for name, result in results.items():
+        if (saved := baseline.get(name)) is None:
+            print(f"  {name:<16} no baseline")
+            continue
+        changes: list[str] = []
+        for metric, higher_is_better in metrics:
+            new_value = getattr(result, metric)
+            old_value = saved[metric]
+            if not old_value:
+                continue
+            change = (new_value - old_value) / abs(old_value)
+            worse = -change if higher_is_better else change
+            flag = ""
+            if worse > tolerance:
+                regressed = True
+                flag = " REGRESSION"
+            changes.append(f"{metric} {change:+.1%}{flag}")
+        print(f"  {name:<16} {', '.join(changes)}")
+    return regressed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark replaying terminal transcripts."
+    )
+    parser.add_argument(
+        "--corpus", type=Path, help="Directory of recorded transcripts."
+    )
+    parser.add_argument(
+        "--size",
+        type=float,
+        default=1.0,
+        help="Size of each synthetic transcript in megabytes.",
+    )
+    parser.add_argument(
+        "--record", type=Path, help="Write synthetic transcripts to a directory."
+    )
+    parser.add_argument(
+        "--chunk-size", type=int, default=CHUNK_SIZE, help="Bytes per write."
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs.")
+    parser.add_argument(
+        "--resize-lines",
+        type=int,
+        default=100_000,
+        help="Lines in the scrollback buffer for the resize benchmark (0 to skip).",
+    )
+    parser.add_argument("--save", type=Path, help="Save results as a baseline.")
+    parser.add_argument("--compare", type=Path, help="Compare with a saved baseline.")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="Allowed regression before failing (default 0.1 for 10%%).",
+    )
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else build_corpus(args.size)
+    if args.record:
+        args.record.mkdir(parents=True, exist_ok=True)
+        for name, transcript in corpus.items():
+            (args.record / f"{name}.log").write_bytes(transcript)
+        return 0
+
+    print(
+        f"{'transcript':<16} {'MB':>6} {'MB/s':>8} {'blocks/MB':>10} {'peak KB/MB':>11} {'p99 ms':>8}"
+    )
+    results: dict[str, Result] = {}
+    for name, transcript in corpus.items():
+        result = results[name] = benchmark(transcript, args.chunk_size, args.repeat)
+        print(
+            f"{name:<16} {result.megabytes:6.2f} {result.mb_per_second:8.2f} "
+            f"{result.blocks_per_mb:10.0f} {result.peak_kb_per_mb:11.0f} {result.p99_ms:8.2f}"
+        )
+
+    print(f"\n{'transcript':<16} {'lines':>8} {'B/line':>8} {'packed':>8}")
+    for name, transcript in corpus.items():
+        line_count, live, packed = measure_compact(transcript)
+        print(f"{name:<16} {line_count:8} {live:8.0f} {packed:8.0f}")
+
+    if args.resize_lines:
+        benchmark_resize(args.resize_lines)
+
+    print(f"\n{'transcript':<16} {'writes':>8} {'lines/write':>12} {'spans/write':>12}")
+    for name, transcript in corpus.items():
+        writes, line_count, span_count = measure_damage(transcript)
+        print(
+            f"{name:<16} {writes:8} {line_count / writes:12.1f} "
+            f"{span_count / writes:12.1f}"
+        )
+
+    if args.save:
+        args.save.write_text(
+            json.dumps(
+                {name: asdict(result) for name, result in results.items()}, indent=2
+            )
+        )
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())